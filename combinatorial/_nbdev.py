@@ -3,6 +3,12 @@
 __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 
 index = {"Marks": "00_gmaps.ipynb",
+         "narrowest_integer_dtype": "00_gmaps.ipynb",
+         "AttributeSchema": "00_gmaps.ipynb",
+         "ROLE_BLOCKED": "00_gmaps.ipynb",
+         "ROLE_SEED": "00_gmaps.ipynb",
+         "ROLE_PROPAGATE": "00_gmaps.ipynb",
+         "ROLE_TARGET": "00_gmaps.ipynb",
          "DualArray": "00_gmaps.ipynb",
          "nGmap": "00_gmaps.ipynb",
          "G0_ISOLATED_VERTEX": "01_zoo.ipynb",
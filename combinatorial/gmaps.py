@@ -1,11 +1,15 @@
-# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/00_gmaps.ipynb (unless otherwise specified).
+# Originally generated from notebooks/00_gmaps.ipynb, this module is now edited by hand and it is the source of truth.
+# The notebook is out of date: do not export it over this file.
 
-__all__ = ['Marks', 'DualArray', 'nGmap']
+__all__ = ['Marks', 'narrowest_integer_dtype', 'AttributeSchema', 'ROLE_BLOCKED', 'ROLE_SEED', 'ROLE_PROPAGATE',
+           'ROLE_TARGET', 'DualArray', 'nGmap']
 
 # Cell
 
 import numpy as np
 import itertools
+import copy
+import typing
 import logging
 import logging_configuration
 
@@ -16,6 +20,18 @@ logging_configuration.set_logging()
 
 
 class Marks:
+    """
+    Marks based on epochs (generation counters).
+
+    Each mark has a current epoch and a dart d is marked with m if its stamp is equal to the epoch of m.
+    Unmarking all the darts only requires to increment the epoch of the mark, so a reset takes constant time.
+    The stamps of the mark are cleared (O(number of darts)) only when the epoch overflows, that is once every
+    2 ** 31 - 1 resets, so in practice never.
+    """
+
+    # int32 stamps: 4 bytes for each dart and mark, the overflow (and the clear of the row) practically never happens
+    _epoch_dtype = np.int32
+
     @property
     def m (self):
         return self._marks.shape[0]
@@ -25,7 +41,8 @@ class Marks:
         return self._free_marks
 
     def __init__ (self, m, d):
-        self._marks      = np.zeros ((m,d), dtype=np.bool8)
+        self._marks      = np.zeros ((m,d), dtype=Marks._epoch_dtype)
+        self._epochs     = [1] * m  # stamp 0 is never a valid epoch
         self._free_marks = {i for i in range (m)}
 
     def reserve_mark (self):
@@ -37,20 +54,116 @@ class Marks:
         self._free_marks |= {m}
 
     def marked (self,m,d):
-        return self._marks [m,d]
+        return self._marks [m,d] == self._epochs [m]
 
     def mark (self,m,d):
-        self._marks [m,d] = True
+        self._marks [m,d] = self._epochs [m]
 
     def unmark (self,m,d):
-        self._marks [m,d] = False
+        self._marks [m,d] = 0
 
     def mark_all (self,m):
-        self._marks [m,:] = True
+        self._marks [m,:] = self._epochs [m]
 
     def unmark_all (self,m):
-        self._marks [m,:] = False
+        if self._epochs [m] == np.iinfo (Marks._epoch_dtype).max:
+            self._marks [m,:] = 0
+            self._epochs [m] = 1
+        else:
+            self._epochs [m] += 1
+
+
+# Cell
+
+
+def narrowest_integer_dtype(min_value: int, max_value: int) -> np.dtype:
+    """Returns the smallest integer dtype that can represent all the values in [min_value, max_value]"""
+    for dtype in (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(dtype)
+    raise Exception(f"No integer dtype can represent values in [{min_value}, {max_value}]")
+
+
+class AttributeSchema:
+    """
+    Schema of the per-dart attributes of a gmap.
+
+    For each attribute it keeps the fill value and the range of values it has to represent, so that the
+    narrowest dtype can be chosen when the attribute array is allocated (only when it is used for the first time).
+    Three kinds of attributes are supported:
+    - "dart":   dart identifiers or distances. Distances are bounded by the sum of the weights, so both fit in
+                [-1, 2 * number_of_darts] (-1 is used as marker, example None type)
+    - "weight": non negative sums of weights, they fit in [0, 2 * number_of_darts]
+    - "label":  labels, the range has to be set with set_value_range (the default dtype is used otherwise).
+                The labels out of the range would be truncated by the narrow dtype, so the image labels
+                are read only and they are written with nGmap.set_image_labels, that widens the dtype.
+
+    The default dtype is the one used before the schema was introduced, when all the arrays were allocated eagerly.
+    It is used to report the saved memory.
+
+    After a compaction (see nGmap.compact) the arrays have one entry for each alive dart, but the values are still
+    bounded by the original number of darts (example, the weights of the removed edges are accumulated).
+    """
+
+    def __init__(self, number_of_darts: int):
+        self.number_of_darts = number_of_darts
+        self.original_number_of_darts = number_of_darts
+        self._attributes = {}
+
+    def compacted(self, number_of_darts: int):
+        """Returns a copy of the schema for the compacted gmap with number_of_darts darts"""
+        schema = copy.deepcopy(self)
+        schema.number_of_darts = number_of_darts
+        return schema
+
+    def add(self, name: str, kind: str, fill_value: int, default_dtype) -> None:
+        assert kind in {"dart", "weight", "label"}
+        self._attributes[name] = {"kind": kind, "fill_value": fill_value,
+                                  "default_dtype": np.dtype(default_dtype), "value_range": None}
+
+    def __contains__(self, name) -> bool:
+        return name in self._attributes
+
+    def __iter__(self):
+        return iter(self._attributes)
+
+    def fill_value(self, name: str) -> int:
+        return self._attributes[name]["fill_value"]
+
+    def set_fill_value(self, name: str, fill_value: int) -> None:
+        self._attributes[name]["fill_value"] = fill_value
+
+    def set_value_range(self, name: str, min_value: int, max_value: int) -> None:
+        """Sets the range of values of a label attribute. The fill value is always included in the range"""
+        self._attributes[name]["value_range"] = (int(min_value), int(max_value))
+
+    def dtype(self, name: str) -> np.dtype:
+        attribute = self._attributes[name]
+        fill_value = attribute["fill_value"]
+        if attribute["kind"] == "dart":
+            min_value, max_value = -1, 2 * self.original_number_of_darts
+        elif attribute["kind"] == "weight":
+            min_value, max_value = 0, 2 * self.original_number_of_darts
+        elif attribute["value_range"] is not None:
+            min_value, max_value = attribute["value_range"]
+        else:
+            return attribute["default_dtype"]
+        return narrowest_integer_dtype(min(min_value, fill_value), max(max_value, fill_value))
+
+    def default_nbytes(self, name: str) -> int:
+        """Bytes required by the attribute with the default dtype"""
+        return self.number_of_darts * self._attributes[name]["default_dtype"].itemsize
+
 
+# Cell
+
+# Roles of the darts in a distance transform query (bit flags, see nGmap.dart_roles)
+# A dart with role ROLE_BLOCKED (no flags) cannot be reached
+ROLE_BLOCKED = 0
+ROLE_SEED = 1
+ROLE_PROPAGATE = 2
+ROLE_TARGET = 4
 
 # Cell
 
@@ -68,6 +181,7 @@ class DualArray(np.ndarray):
         # see InfoArray.__array_finalize__ for comments
         if obj is None: return
         self._marks      = getattr(obj, '_marks',      None)
+        self._epochs     = getattr(obj, '_epochs',     None)
         self._free_marks = getattr(obj, '_free_marks', None)
 
 
@@ -86,61 +200,204 @@ class nGmap(DualArray, Marks):
         if number_of_darts > (np.iinfo(np.int32).max + 1):
             raise Exception(f"int32 is not sufficient to represent {number_of_darts} darts")
 
-        # Allocate darts dict
-        # It is necessary to store only the alive darts and obtain better time performances
-        # Using a dict I can remove darts in constant amortized time, otherwise using an array
-        # I need linear time. Right now, for the experiments, my priority is time, so I will
-        # also use a dict
-        # I can use something similar to canonical encoding.
-        self.alive_darts = {}
-        for i in range(number_of_darts):
-            self.alive_darts[i] = i
-
-        # allocate distances array
-        self.distances = np.zeros(number_of_darts, dtype=np.int32)
-        logger.debug(f"distances array successfully initialized with shape {self.distances.shape}"
-                     f" and dtype {self.distances.dtype}")
-        # Initialization
-        self.distances.fill(-1)
-
-        # allocate weights array
+        # Alive darts
+        # A boolean mask keeps track of the alive darts, so a dart can be removed in constant time
+        # and the number of alive darts is maintained by a counter (constant time n_darts).
+        # The dense index of the alive darts (sorted identifiers) is built lazily, only when it is
+        # required, and it is invalidated each time a dart is removed.
+        # Compared to a dict with one entry for each dart, only 1 byte for each dart is used.
+        self._alive_darts_mask = np.asarray(self)[0] >= 0
+        self._n_alive_darts = int(np.count_nonzero(self._alive_darts_mask))
+        self._alive_darts_index = None
+
+        # Cached i-cells index for each dimension i (None for connected components).
+        # It is invalidated each time an involution is modified (removal, contraction, sewing).
+        self._i_cells_index = {}
+
+        # Compaction (see compact)
+        # original_darts[d] is the identifier before any compaction of the dart d,
+        # compact_darts[d] is the identifier of the original dart d (-1 if it was removed before the compaction).
+        # Both are None if the gmap has not been compacted.
+        # The face identifiers of the darts removed before the compaction are kept with the original identifiers.
+        self.original_darts = None
+        self.compact_darts = None
+        self._original_face_identifiers = None
+
+        # Cached alive representative of each original dart (see representative_darts).
+        # It is invalidated each time a dart is removed.
+        self._representative_darts = None
+
+        # Label index (see label_darts): the alive darts sorted by image label, built lazily.
+        # The removed darts are filtered when the index is queried, it is rebuilt when more than half
+        # of the indexed darts have been removed.
+        self._label_index = None
+        self._label_index_removed = 0
+
+        # Cached roles of the darts for each query (see dart_roles)
+        self._dart_roles = {}
+
+        # Dart attributes
+        # The arrays are not allocated here. Each array is allocated only when it is used for the first time
+        # (see __getattr__) with the narrowest dtype that fits the values it has to store.
+        self.attribute_schema = AttributeSchema(number_of_darts)
+
+        # distances (-1 if the distance has not been computed)
+        self.attribute_schema.add("distances", "dart", fill_value=-1, default_dtype=np.int32)
+
+        # weights
         # It keeps the weights associated to each dart.
         # Each dart keeps the weight associated to the corresponding edge
         # So if alfa0(d) = d1 then weight(d) = weight(d1)
-        self.weights = np.ones(number_of_darts, dtype=np.uint32)
-        logger.debug(f"weights array successfully initialized with shape {self.weights.shape}"
-                     f" and dtype {self.weights.dtype}")
+        self.attribute_schema.add("weights", "weight", fill_value=1, default_dtype=np.uint32)
 
-        # allocate labels array
-        # int16 is sufficient to represent a label
-        self.image_labels = np.zeros(number_of_darts, dtype=np.int16)
-        logger.debug(f"labels array successfully initialized with shape {self.image_labels.shape}"
-                     f" and dtype {self.image_labels.dtype}")
+        # labels
+        # int16 is sufficient to represent a label, a narrower dtype is used if the range of labels is known.
+        # The array is read only: it is modified with set_image_labels, that widens the dtype when it is required
+        # and invalidates the label index and the roles.
+        self.attribute_schema.add("image_labels", "label", fill_value=0, default_dtype=np.int16)
 
-        # allocate connected components labels array
+        # connected components labels
         # In order to reduce the space occupied by this array and by the labels array
         # Only this array can be allocated and then a structure that maintains the relation
         # between connected components of the same type can be used
         # int32 (-1 if no label is passed in input) is sufficient for 1000x1000 images.
         # I can retrieve the minimum size by the number of labels
-        self.connected_components_labels = np.zeros(number_of_darts, dtype=np.int32)
-        logger.debug(f"connected_components_labels array successfully initialized with shape {self.connected_components_labels.shape}"
-                     f" and dtype {self.connected_components_labels.dtype}")
+        self.attribute_schema.add("connected_components_labels", "label", fill_value=0, default_dtype=np.int32)
 
         # It stores the label of the closes connected component label after the evaluation of dt
         # Useful for voronoi diagram
-        self.dt_connected_components_labels = np.zeros(number_of_darts, dtype=np.int32)
-        logger.debug(f"dt_connected_components_labels array successfully initialized with shape {self.dt_connected_components_labels.shape}"
-                     f" and dtype {self.dt_connected_components_labels.dtype}")
+        self.attribute_schema.add("dt_connected_components_labels", "label", fill_value=0, default_dtype=np.int32)
+
+        # face identifiers (the dart that identifies the face of a removed dart)
+        self.attribute_schema.add("face_identifiers", "dart", fill_value=0, default_dtype=np.int32)
 
-        # allocate face identifiers array
-        self.face_identifiers = np.zeros(number_of_darts, dtype=np.int32)
-        logger.debug(f"face_identifiers array successfully initialized with shape {self.face_identifiers.shape}"
-                     f" and dtype {self.face_identifiers.dtype}")
+    def invalidate_labels(self) -> None:
+        """It has to be called each time the image labels are modified, the label index and the roles are rebuilt"""
+        self._label_index = None
+        self._dart_roles = {}
+
+    def set_image_labels(self, darts, labels) -> None:
+        """
+        Sets the image labels of the darts (a label for each dart or the same label for all of them).
+
+        The labels array is widened if the new labels are not in the range of its dtype,
+        the label index and the roles are rebuilt (see invalidate_labels).
+        """
+        labels = np.asarray(labels)
+        image_labels = self.image_labels
+        if labels.size > 0:
+            min_label = min(int(labels.min()), int(image_labels.min()))
+            max_label = max(int(labels.max()), int(image_labels.max()))
+            if min_label < np.iinfo(image_labels.dtype).min or max_label > np.iinfo(image_labels.dtype).max:
+                self.attribute_schema.set_value_range("image_labels", min_label, max_label)
+                image_labels = image_labels.astype(self.attribute_schema.dtype("image_labels"))
+                self._set_attribute("image_labels", image_labels)
+        image_labels.flags.writeable = True
+        image_labels[darts] = labels
+        image_labels.flags.writeable = False
+        self.invalidate_labels()
+
+    def _get_label_index(self):
+        """Returns (labels, offsets, darts): the darts with label labels[k] are darts[offsets[k]:offsets[k+1]]"""
+        if self._label_index is None or 2 * self._label_index_removed > self._label_index[2].size:
+            darts = self.darts
+            order = np.argsort(self.image_labels[darts], kind="stable")  # darts with the same label stay sorted
+            labels, starts = np.unique(self.image_labels[darts[order]], return_index=True)
+            self._label_index = (labels, np.append(starts, darts.size), darts[order])
+            self._label_index_removed = 0
+        return self._label_index
+
+    def label_darts(self, labels: typing.Iterable[int]) -> np.array:
+        """
+        Returns the alive darts whose image label is in labels, sorted by identifier.
+
+        The cost depends only on the number of darts with those labels (the index is built once).
+        """
+        index_labels, offsets, darts = self._get_label_index()
+        positions = np.flatnonzero(np.isin(index_labels, list(labels)))
+        result = np.concatenate([darts[offsets[k]:offsets[k + 1]] for k in positions] + [darts[:0]])
+        result = result[self._alive_darts_mask[result]]
+        if positions.size > 1:
+            result.sort()
+        return result
+
+    def dart_roles(self, seed_labels: typing.Iterable[int], propagation_labels: typing.Iterable[int],
+                   target_labels: typing.Iterable[int] = ()) -> np.array:
+        """
+        Returns the roles of the darts for a distance transform query, an uint8 array of bit flags
+        (ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET) with one entry for each dart.
+        The darts whose label is not in any list have role ROLE_BLOCKED.
+
+        The array is read only and it is cached until the labels are modified (see invalidate_labels),
+        so the engines can check the role of a dart with a single lookup.
+        """
+        key = (frozenset(seed_labels), frozenset(propagation_labels), frozenset(target_labels))
+        if key not in self._dart_roles:
+            image_labels = self.image_labels
+            min_label, max_label = int(image_labels.min()), int(image_labels.max())
+            table = np.zeros(max_label - min_label + 1, dtype=np.uint8)
+            for labels, role in zip(key, (ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET)):
+                for label in labels:
+                    if min_label <= label <= max_label:
+                        table[label - min_label] |= role
+            roles = table[image_labels.astype(np.intp) - min_label]
+            roles.flags.writeable = False
+            self._dart_roles[key] = roles
+        return self._dart_roles[key]
+
+    def __getattr__(self, name):
+        # It is called only if the attribute has not been found,
+        # i.e. for the dart attributes that have not been allocated yet
+        schema = self.__dict__.get("attribute_schema")
+        if schema is None or name not in schema:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        return self.allocate_attribute(name)
+
+    def allocate_attribute(self, name: str) -> np.array:
+        """(Re)allocates the array of a dart attribute, filled with its fill value"""
+        schema = self.attribute_schema
+        array = np.full(schema.number_of_darts, fill_value=schema.fill_value(name), dtype=schema.dtype(name))
+        self._set_attribute(name, array)
+        logger.debug(f"{name} array successfully initialized with shape {array.shape}"
+                     f" and dtype {array.dtype}")
+        return array
+
+    def _set_attribute(self, name: str, array: np.array) -> None:
+        # the image labels are modified only by set_image_labels (see _init_structures)
+        if name == "image_labels":
+            array.flags.writeable = False
+        self.__dict__[name] = array
+
+    def is_attribute_allocated(self, name: str) -> bool:
+        return name in self.__dict__
+
+    def attributes_nbytes(self) -> int:
+        """Bytes used by the allocated dart attributes"""
+        return sum(self.__dict__[name].nbytes for name in self.attribute_schema if self.is_attribute_allocated(name))
+
+    def attributes_saved_nbytes(self) -> int:
+        """Bytes saved with respect to allocating all the dart attributes with the default dtypes"""
+        schema = self.attribute_schema
+        return sum(schema.default_nbytes(name) for name in schema) - self.attributes_nbytes()
+
+    def attributes_memory_string(self) -> str:
+        """Returns a summary of the memory used by the dart attributes"""
+        s = ''
+        for name in self.attribute_schema:
+            if self.is_attribute_allocated(name):
+                array = self.__dict__[name]
+                s += f'  {name:<31}: {array.dtype} ({array.nbytes} bytes)\n'
+            else:
+                s += f'  {name:<31}: not allocated\n'
+        s += f'  saved: {self.attributes_saved_nbytes()} bytes\n'
+        return s
 
     def uniform_labels_for_vertices(self):
         """
         Assign a common label for each vertex. The most common label is chosen for each vertex
+
+        In case of ties the label found first by the traversal of the vertex (cell_i from its smallest dart) is chosen.
+        The counts are computed for all the vertices at once, only the vertices with a tie are traversed.
         """
 
         def _get_most_common_value(representative_dart, values):
@@ -161,12 +418,36 @@ class nGmap(DualArray, Marks):
 
             return max_value
 
-        for representative_dart in self.darts_of_i_cells(0):
-            image_label = _get_most_common_value(representative_dart, self.image_labels)
-            connected_components_label = _get_most_common_value(representative_dart, self.connected_components_labels)
-            for dart in self.cell_i(0, representative_dart):
-                self.image_labels[dart] = image_label
-                self.connected_components_labels[dart] = connected_components_label
+        def _get_most_common_values(values):
+            ids = self.cell_ids(0)
+            darts = self.darts
+            cell_of_dart = ids[darts]
+            dart_values = values[darts].astype(np.int64)
+
+            # count the occurrences of each (vertex, value) pair
+            pairs, counts = np.unique(np.stack((cell_of_dart, dart_values), axis=1), axis=0, return_counts=True)
+            pairs_cells, pairs_values = pairs[:, 0], pairs[:, 1]
+
+            # for each vertex take the first pair ordered by count (desc)
+            order = np.lexsort((pairs_values, -counts, pairs_cells))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = pairs_cells[order][1:] != pairs_cells[order][:-1]
+            most_common_values = pairs_values[order][first]
+            max_counts = counts[order][first]
+
+            # the order of the traversal breaks the ties
+            n_max_values = np.bincount(pairs_cells, weights=counts == max_counts[pairs_cells])
+            representative_darts = self.darts_of_i_cells(0)
+            for cell in np.flatnonzero(n_max_values > 1):
+                most_common_values[cell] = _get_most_common_value(representative_darts[cell], values)
+            return most_common_values
+
+        ids = self.cell_ids(0)
+        darts = self.darts
+        image_labels = _get_most_common_values(self.image_labels)
+        connected_components_labels = _get_most_common_values(self.connected_components_labels)
+        self.set_image_labels(darts, image_labels[ids[darts]])
+        self.connected_components_labels[darts] = connected_components_labels[ids[darts]]
 
     @classmethod
     def n_by_d (cls, n, n_darts):
@@ -209,31 +490,156 @@ class nGmap(DualArray, Marks):
     @property
     def n_darts(self):
         """Returns the number of darts"""
-        ### return (self[0] >= 0).sum()  # this would first create another big array of booleans
-        return sum(1 for d in self.darts)
+        # The counter is updated each time a dart is removed
+        return self._n_alive_darts
 
     def set_dart_distance(self, identifier: np.uint32, distance: np.uint32) -> None:
         self.distances[identifier] = distance
 
     @property
     def n_darts_init(self):
-        sum = 0
-        for index in range(self.shape[1]):
-            if self.a0(index) >= 0:
-                sum += 1
-        return sum
+        return int(np.count_nonzero(np.asarray(self)[0] >= 0))
 
     @property
     def darts(self):
-        """Generator to iterate thru all valid (non-negative alphas) darts"""
-        alive_darts = self.alive_darts.keys()
-        for dart in alive_darts:
-            yield dart
         """
-        for index in range (self.shape[1]):
-            if self.a0(index) >= 0:
-                yield index
+        Array of all valid (non-negative alphas) darts, sorted by identifier
+
+        The array is cached until the next removal of a dart and it is read only.
+        It can be iterated as before or used directly for fancy indexing.
+        """
+        if self._alive_darts_index is None:
+            self._alive_darts_index = np.flatnonzero(self._alive_darts_mask)
+            self._alive_darts_index.flags.writeable = False
+        return self._alive_darts_index
+
+    def is_alive(self, dart) -> bool:
+        """True if the dart has not been removed"""
+        return bool(self._alive_darts_mask[dart])
+
+    def compact(self):
+        """
+        Returns a copy of the gmap where the alive darts are renumbered densely (0, ..., n_darts - 1),
+        preserving their order.
+
+        The alphas and the allocated dart attributes are rewritten with the new identifiers, so after a strong
+        reduction the following computations (example, distance transforms) work on small arrays.
+        The mapping with the original identifiers is kept in original_darts and compact_darts (see resolve_dart).
+        """
+        alive = self.darts
+        new_identifiers = np.full(self.shape[1], -1, dtype=np.int32)
+        new_identifiers[alive] = np.arange(alive.size, dtype=np.int32)
+
+        compacted = type(self)(new_identifiers[np.asarray(self)[:, alive]])
+
+        # mapping with the identifiers before any compaction
+        if self.original_darts is None:
+            original_darts = np.asarray(alive, dtype=np.int32)
+            n_original_darts = self.shape[1]
+        else:
+            original_darts = self.original_darts[alive]
+            n_original_darts = self.compact_darts.size
+        compacted.original_darts = original_darts
+        compacted.compact_darts = np.full(n_original_darts, -1, dtype=np.int32)
+        compacted.compact_darts[original_darts] = np.arange(alive.size, dtype=np.int32)
+
+        # face identifiers of the removed darts, with the original identifiers
+        face_identifiers = self._original_face_identifiers
+        removed = np.flatnonzero(~self._alive_darts_mask)
+        if removed.size > 0 and self.is_attribute_allocated("face_identifiers"):
+            face_identifiers = np.zeros(n_original_darts, dtype=np.int32) if face_identifiers is None \
+                else face_identifiers.copy()
+            if self.original_darts is None:
+                face_identifiers[removed] = self.face_identifiers[removed]
+            else:
+                face_identifiers[self.original_darts[removed]] = self.original_darts[self.face_identifiers[removed]]
+        compacted._original_face_identifiers = face_identifiers
+
+        # dart attributes (the face identifiers of alive darts are not meaningful)
+        compacted.attribute_schema = self.attribute_schema.compacted(alive.size)
+        for name in self.attribute_schema:
+            if name != "face_identifiers" and self.is_attribute_allocated(name):
+                compacted._set_attribute(name, self.__dict__[name][alive])
+
+        logger.debug(f"Compacted gmap from {self.shape[1]} to {alive.size} darts")
+        return compacted
+
+    def resolve_dart(self, dart):
+        """
+        Returns the alive dart that represents the original dart `dart` (identifier before any compaction).
+
+        If the dart has been removed, the dart that identifies its face is taken (face_identifiers),
+        until an alive dart is found.
+        """
+        if self.compact_darts is not None:
+            while self.compact_darts[dart] == -1:
+                dart = self._original_face_identifiers[dart]
+            dart = self.compact_darts[dart]
+        while not self._alive_darts_mask[dart]:
+            dart = self.face_identifiers[dart]
+        return dart
+
+    @staticmethod
+    def _pointer_jumping(parent: np.array) -> np.array:
+        """
+        Follows the pointers parent[d] until a fixed point (parent[r] == r) is reached, for all the darts at once.
+
+        Each step replaces each pointer with the pointer of its parent (path halving), so the chains are
+        resolved in a logarithmic number of steps. The darts whose chain does not reach a fixed point are set to -1.
         """
+        parent = parent.copy()
+        for _ in range(max(1, int(parent.size).bit_length()) + 1):
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+        unresolved = parent[parent] != parent
+        logger.debug(f"{np.count_nonzero(unresolved)} darts have not a valid face identifier")
+        parent[unresolved] = -1
+        return parent
+
+    def representative_darts(self) -> np.array:
+        """
+        Returns, for each original dart (identifier before any compaction), the alive dart that represents it
+        (see resolve_dart), -1 if the chain of face identifiers does not reach an alive dart.
+
+        The array is computed for all the darts at once and it is cached until the next removal.
+        """
+        if self._representative_darts is not None:
+            return self._representative_darts
+
+        # darts removed before the compaction, resolved with the original identifiers
+        if self.compact_darts is not None:
+            darts = np.arange(self.compact_darts.size, dtype=np.int32)
+            if self._original_face_identifiers is not None:
+                roots = self._pointer_jumping(
+                    np.where(self.compact_darts != -1, darts, self._original_face_identifiers))
+            else:
+                roots = darts
+            current = np.where(roots != -1, self.compact_darts[roots], -1)
+        else:
+            current = np.arange(self.shape[1], dtype=np.int32)
+
+        # darts removed from the current gmap
+        if self._n_alive_darts < self.shape[1] and self.is_attribute_allocated("face_identifiers"):
+            darts = np.arange(self.shape[1], dtype=np.int32)
+            roots = self._pointer_jumping(
+                np.where(self._alive_darts_mask, darts, self.face_identifiers).astype(np.int32))
+            current = np.where(current != -1, roots[current], -1)
+        # the darts not resolved are not alive
+        current[(current != -1) & ~self._alive_darts_mask[current]] = -1
+
+        current.flags.writeable = False
+        self._representative_darts = current
+        return current
+
+    def current_dart(self, dart):
+        """Returns the current identifier of the original dart `dart`, -1 if it has been removed"""
+        if self.compact_darts is not None:
+            dart = self.compact_darts[dart]
+            if dart == -1:
+                return -1
+        return dart if self._alive_darts_mask[dart] else -1
 
     def all_dimensions_but_i (self, i=None):
         """Return a sorted sequence [0,...,n], without i, if 0 <= i <= n"""
@@ -248,6 +654,8 @@ class nGmap(DualArray, Marks):
         """Sets dart.alpha_i = new_dart"""
         assert 0 <= i <= self.n
         self [i,dart] = new_dart
+        if self._i_cells_index:
+            self._i_cells_index.clear()
 
     def ai (self, i, indices): return self[i,indices]  # TODO direct access
     def a0 (self,    indices): return self.ai(0,indices)
@@ -258,15 +666,24 @@ class nGmap(DualArray, Marks):
 
     @property
     def is_valid(self):
-        """Checks validity, i.e., if a_i and (a_i  a_j) are involutions"""
+        """Checks validity, i.e., if a_i and (a_i  a_j) are involutions
+
+        The checks are evaluated on all the alive darts at once, using fancy indexing on the alpha array.
+        The first offending dart (the smallest one) is reported in the log.
+        """
+
+        alphas = np.asarray(self)
+        darts = self.darts
 
         # check ai
         for i in self.all_dimensions:
             logging.debug (f'Involution check for  α{i}     ') #, end=' ')
-            for dart in self.darts:
-                if self.ai (i, self.ai (i, dart)) != dart:
-                    logging.debug (f'broken at dart {dart}: α{i}.α{i} ({dart}) = {self.ai (i, self.ai (i, dart))} :(')
-                    return False
+            aii = alphas [i, alphas [i, darts]]
+            broken = aii != darts
+            if broken.any():
+                first = np.argmax (broken)
+                logging.debug (f'broken at dart {darts[first]}: α{i}.α{i} ({darts[first]}) = {aii[first]} :(')
+                return False
             logging.debug ('passed.')
 
         # check ai.aj
@@ -276,11 +693,12 @@ class nGmap(DualArray, Marks):
             if j - i in {-1,+1}:
                 logging.debug ('not required.')
                 continue
-            for dart in self.darts:
-                aij = self.ai (i, self.ai (j, dart))
-                if self.ai (i, self.ai (j, aij)) != dart:
-                    logging.critical (f'broken at dart {dart}: (α{i} α{j})({dart}) = {self.ai (i, self.ai (j, dart))} :(')
-                    return False
+            aij = alphas [i, alphas [j, darts]]
+            broken = alphas [i, alphas [j, aij]] != darts
+            if broken.any():
+                first = np.argmax (broken)
+                logging.critical (f'broken at dart {darts[first]}: (α{i} α{j})({darts[first]}) = {aij[first]} :(')
+                return False
             logging.debug ('passed.')
         return True
 
@@ -309,25 +727,83 @@ class nGmap(DualArray, Marks):
             self.unmark_all (m)
             self.free_mark(m)
 
-    def darts_of_i_cells(self, i=None):
-        """Yields arbitrary dart for every i-cell (0<=i<=n) or for every connected component (i is None)"""
+    def _orbit_roots(self, sequence):
+        """
+        For each dart returns the smallest dart of its orbit <sequence>.
 
-        m = self.reserve_mark()
-        try:
-            for d in self.darts:
-                if not self.marked (m,d):
-                    yield d
-                    for dd in self.orbit(self.all_dimensions_but_i(i), d):  # i.e, in self.cell_i (i, d):
-                        self.mark (m,dd)
-        finally:
-            self.unmark_all (m)
-            self.free_mark(m)
+        Vectorized union-find over the alpha arrays: at each round the root of each orbit is hooked
+        to the smallest root among its neighbours, then pointer jumping flattens the trees.
+        Removed darts are roots of themselves.
+        """
+        alphas = np.asarray(self)
+        darts = self.darts
+        parent = np.arange(self.shape[1])
+
+        src = np.tile(darts, len(sequence))
+        dst = alphas[sequence][:, darts].ravel() if len(sequence) else np.empty(0, dtype=src.dtype)
+        while len(src):
+            root_src, root_dst = parent[src], parent[dst]
+            # pairs already in the same tree are never considered again
+            not_joined = root_src != root_dst
+            src, dst = src[not_joined], dst[not_joined]
+            root_src, root_dst = root_src[not_joined], root_dst[not_joined]
+            if not len(src):
+                break
+            np.minimum.at(parent, np.maximum(root_src, root_dst), np.minimum(root_src, root_dst))
+            # pointer jumping
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+        return parent
+
+    def _get_i_cells_index(self, i=None):
+        """
+        Returns the (cached) i-cells index, a tuple of three arrays:
+            cell_ids ... i-cell identifier of each dart (-1 for removed darts)
+            darts    ... alive darts sorted by i-cell identifier (and by dart inside each i-cell)
+            offsets  ... the darts of the i-cell c are darts[offsets[c]:offsets[c+1]]
+
+        The i-cells are numbered in the order of their smallest dart.
+        """
+        assert i is None or 0 <= i <= self.n
+        if i not in self._i_cells_index:
+            darts = self.darts
+            roots = self._orbit_roots(self.all_dimensions_but_i(i))[darts]
+            representatives, cell_of_dart = np.unique(roots, return_inverse=True)
+
+            cell_ids = np.full(self.shape[1], -1, dtype=np.int32)
+            cell_ids[darts] = cell_of_dart
+            offsets = np.zeros(len(representatives) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(cell_of_dart, minlength=len(representatives)), out=offsets[1:])
+            sorted_darts = darts[np.argsort(cell_of_dart, kind='stable')]
+
+            self._i_cells_index[i] = (cell_ids, sorted_darts, offsets)
+        return self._i_cells_index[i]
+
+    def cell_ids(self, i=None):
+        """Returns the i-cell (connected component if i is None) identifier of each dart, -1 for removed darts"""
+        return self._get_i_cells_index(i)[0]
+
+    def cell_i_darts(self, i, dart):
+        """Returns the array of darts of the i-cell of dart, sorted by identifier"""
+        cell_ids, sorted_darts, offsets = self._get_i_cells_index(i)
+        cell = cell_ids[dart]
+        return sorted_darts[offsets[cell]:offsets[cell + 1]]
+
+    def darts_of_i_cells(self, i=None):
+        """Returns the smallest dart of every i-cell (0<=i<=n) or of every connected component (i is None)"""
+        _, sorted_darts, offsets = self._get_i_cells_index(i)
+        return sorted_darts[offsets[:-1]]
 
     def all_i_cells (self, i=None):
         """For each i-cell (connected component) yield a list of its darts"""
         logging.debug (f'Listing {i}-cells:')
-        for counter, d in enumerate (self.darts_of_i_cells(i)):
-            cell = list (self.cell_i (i, d))  # compute orbit from d
+        _, sorted_darts, offsets = self._get_i_cells_index(i)
+        for counter in range (len (offsets) - 1):
+            cell = sorted_darts [offsets[counter]:offsets[counter+1]].tolist()
             logging.debug (f'\t#{counter+1:2d}: {cell}')
             yield cell
 
@@ -354,8 +830,7 @@ class nGmap(DualArray, Marks):
             connected components if i is None
         """
         assert i is None or 0 <= i <= self.n
-        # return more_itertools.ilen (self.darts_of_i_cells(i))
-        return sum ((1 for d in self.darts_of_i_cells(i)))
+        return len (self._get_i_cells_index(i)[2]) - 1
 
     @property
     def no_0_cells (self): return self.no_i_cells (0)
@@ -419,12 +894,9 @@ class nGmap(DualArray, Marks):
     def incident (self, i, d1, j, d2):
         """True if i-cell of d is incident with j-cell of d2)"""
         # simply a check if the intersection of the two respective orbits is nonempty
-        # uses sets,  `&` for interesection , len() for cardinality)
-        # TODO using set for large orbits may be memory inefficient
-
-        i_cell_of_d1 = set (self.cell_i (i,d1))
-        j_cell_of_d2 = set (self.cell_i (j,d2))
-        return len (i_cell_of_d1 & j_cell_of_d2) > 0
+        # i.e. if a dart of the i-cell of d1 belongs to the j-cell of d2
+        j_cell_ids = self.cell_ids (j)
+        return bool (np.any (j_cell_ids [self.cell_i_darts (i,d1)] == j_cell_ids [d2]))
 
     def adjacent (self,i,d1,d2):
         """True if i-cell of d is adjacent to i-cell of d2.
@@ -436,23 +908,22 @@ class nGmap(DualArray, Marks):
             3. check if they have an intersection with the second orbit
         """
 
-        i_cell_of_d1 = self.cell_i (i,d1)  # iterator over i-cell of d1
-        i_cell_of_d2 = self.cell_i (i,d2)  # iterator over i-cell of d2
-        s_cell_of_d1 = set(i_cell_of_d1)   # set of darts of i-cell of d1
-        # TODO  query 'in' python set could be O(1) but creating set requires additional memory
-        for d in i_cell_of_d2:
-            ai_d = self.ai(i,d)
-            if ai_d in s_cell_of_d1:  # TODO do we really need to test if d1 \neq d2?!
-                logging.debug (f'a{i}({d}) == {ai_d} which belongs to {i}-cell of dart {d1}, so these {i}-cells are adjacent')
-                return True
-        return False
+        i_cell_ids = self.cell_ids (i)
+        ai_of_i_cell_of_d2 = self.ai (i, self.cell_i_darts (i,d2))
+        return bool (np.any (i_cell_ids [np.asarray (ai_of_i_cell_of_d2)] == i_cell_ids [d1]))
 
     # -----------------------
     # contraction and removal
 
     def _remove_dart (self,d):
         # self [:,d] = -1    # this would be a direct access
-        self.alive_darts.pop(d)
+        if self._alive_darts_mask[d]:
+            self._alive_darts_mask[d] = False
+            self._n_alive_darts -= 1
+            self._alive_darts_index = None
+            self._representative_darts = None
+            if self._label_index is not None:
+                self._label_index_removed += 1
         for i in self.all_dimensions:
             self.set_ai(i,d,-1)
 
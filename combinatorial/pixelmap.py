@@ -1,18 +1,21 @@
-# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/02_pixelmap.ipynb (unless otherwise specified).
+# Originally generated from notebooks/02_pixelmap.ipynb, this module is now edited by hand and it is the source of truth.
+# The notebook is out of date: do not export it over this file.
 
 __all__ = ['PixelMap', 'LabelMap']
 
 # Cell
 
+import copy
 import logging
 import typing
 
 import numpy as np
 from combinatorial.utils import *
 from .gmaps import nGmap
-from .zoo import G2_SQUARE_BOUNDED, G2_SQUARE_UNBOUNDED
+from .zoo import G2_SQUARE_BOUNDED
 import random
 from distance_transform.preprocessing import generate_random_color
+from distance_transform.incremental_dt import IncrementalDt
 
 from memory_profiler import profile
 
@@ -157,54 +160,24 @@ class PixelMap (nGmap):
             2-gMap representing a pixel array
 
         """
-        def _swap2 (A,  r1,c1,i1,  r2,c2,i2):
-            """swap helper to 2-sew darts"""
-            tmp = A [r1,c1,i1,2].copy()
-            A [r1,c1,i1,2] = A [r2,c2,i2,2]
-            A [r2,c2,i2,2] = tmp
-
-        def _iter_boundary (R,C):
-            """counter-clockwise boundary iteration around the block darts"""
-            c = 0
-            for r in range (R):
-                yield 8*(r*C+c) + 7
-                yield 8*(r*C+c) + 6
-            r = R-1
-            for c in range(C):
-                yield 8*(r*C+c) + 5
-                yield 8*(r*C+c) + 4
-            c = C-1
-            for r in range (R-1,-1,-1):
-                yield 8*(r*C+c) + 3
-                yield 8*(r*C+c) + 2
-            r = 0
-            for c in range (C-1,-1,-1):
-                yield 8*(r*C+c) + 1
-                yield 8*(r*C+c) + 0
-
-        # set the members
-        cls._nR = R
-        cls._nC = C
-
         n_all_darts = 8*R*C + (not bounded)*4*(R+C)
-        alphas_all = np.full ((3, n_all_darts), fill_value=-1, dtype=np.int32)
+        alphas_all = np.empty ((3, n_all_darts), dtype=np.int32)
         alphas_block = alphas_all [:, :8*R*C ] # view at the block part
         alphas_bound = alphas_all [:,  8*R*C:] # view at the outer boundary part
 
-        # create the square by replicating bounded square with increments
-        alphas_square = nGmap.from_string (G2_SQUARE_BOUNDED).T
-        A = alphas_block.T.reshape ((R,C,8,3)) # rearrange view at the block part
-        for r in range (R):
-            for c in range (C):
-                A [r,c] = alphas_square + 8 * (r*C + c)
-
-        if sew: # 2-sew the squares
-            for r in range (R):
-                for c in range (C-1):
-                    _swap2 (A, r,c,[2,3], r,c+1, [7,6])
-            for c in range (C):
-                for r in range (R-1):
-                    _swap2 (A, r,c,[4,5], r+1, c, [1,0])
+        # create the square by replicating bounded square with increments (broadcasting)
+        alphas_square = np.asarray (nGmap.from_string (G2_SQUARE_BOUNDED))
+        A = alphas_block.reshape ((3,R,C,8)) # rearrange view at the block part
+        A [...] = alphas_square [:,None,None,:] + 8 * np.arange (R*C, dtype=np.int32).reshape (1,R,C,1)
+
+        if sew: # 2-sew the squares, swapping alpha2 of the facing darts (strided views over rows and columns)
+            alphas2 = A [2]
+            tmp = alphas2 [:,:-1,[2,3]]
+            alphas2 [:,:-1,[2,3]] = alphas2 [:,1:,[7,6]]
+            alphas2 [:,1:,[7,6]] = tmp
+            tmp = alphas2 [:-1,:,[4,5]]
+            alphas2 [:-1,:,[4,5]] = alphas2 [1:,:,[1,0]]
+            alphas2 [1:,:,[1,0]] = tmp
 
         if not bounded: #` add boundary darts
             # set alpha0 to: 1 0 3 2 5 3 ...
@@ -220,15 +193,135 @@ class PixelMap (nGmap):
             # add offsets to alpha0 and alpha1 of the boundary block
             alphas_bound[:2] += 8*R*C
 
+            # counter-clockwise boundary around the block darts
+            rows, cols = np.arange (R), np.arange (C)
+            boundary_block_darts = np.concatenate ((
+                (8*(rows*C)             [:,None] + [7,6]).ravel(),  # left column, top to bottom
+                (8*((R-1)*C + cols)     [:,None] + [5,4]).ravel(),  # bottom row, left to right
+                (8*(rows[::-1]*C + C-1) [:,None] + [3,2]).ravel(),  # right column, bottom to top
+                (8*cols[::-1]           [:,None] + [1,0]).ravel(),  # top row, right to left
+            ))
+
             # 2-sew the the darts of the boundary with the darts of the block
-            for d_bound,d_block in enumerate (_iter_boundary(R,C)):
-                alphas_block [2, d_block] = d_bound + 8*R*C
-                alphas_bound [2, d_bound] = d_block
-        return cls.from_alpha_array(alphas_all)
+            alphas_block [2, boundary_block_darts] = np.arange (alphas_bound.shape[1]) + 8*R*C
+            alphas_bound [2] = boundary_block_darts
+
+        # the grid is valid by construction: the involution checks of from_alpha_array (is_valid) are skipped,
+        # they build several fancy-indexed copies of the alphas (the peak memory of the construction
+        # was about 6 times the alphas and the checks took 2/3 of the time)
+        pixel_map = cls(alphas_all)
+        pixel_map._nR, pixel_map._nC = R, C
+        return pixel_map
+
+    def compact(self):
+        compacted = super().compact()
+        compacted._nR, compacted._nC = self._nR, self._nC
+        return compacted
 
 # Cell
 
 
+class _DartPolylines:
+    """
+    Drawable polylines of the darts of a LabelMap.
+
+    The polylines are not stored explicitly, they are reconstructed from the dart identifiers.
+    The initial polyline of a dart is computed from its identifier.
+    When a vertex is removed, the polyline of the dart e = a0(d) is extended with the reversed polyline of d:
+    d is appended (in constant time) to the list of children of e, so the polyline of a dart is its initial polyline
+    followed by the reversed polylines of its children.
+    The lists of children are kept in four int32 arrays (first child, last child, next sibling, parent),
+    allocated only when the first polyline is extended.
+    """
+
+    def __init__(self, n_cols: int, n_darts: int):
+        self.n_cols = n_cols
+        self.n_darts = n_darts
+        self._first_child = None
+        self._last_child = None
+        self._next_sibling = None
+        self._parent = None
+        self._explicit = {}  # dart -> polyline, only for degenerate cases (see append_reversed)
+        self._original_darts = None  # original identifiers of the darts of a compacted map
+
+    @property
+    def nbytes(self) -> int:
+        if self._first_child is None:
+            return 0
+        return self._first_child.nbytes + self._last_child.nbytes + self._next_sibling.nbytes + self._parent.nbytes
+
+    def _children(self, dart) -> typing.List[int]:
+        children = []
+        if self._first_child is None:
+            return children
+        child = self._first_child[dart]
+        while child != -1:
+            children.append(child)
+            child = self._next_sibling[child]
+        return children
+
+    def renumbered(self, original_darts: np.array):
+        """Returns a copy of the polylines for a compacted map, whose darts have the given original identifiers"""
+        polylines = copy.deepcopy(self)
+        polylines._original_darts = original_darts
+        return polylines
+
+    def __getitem__(self, dart) -> np.array:
+        if self._original_darts is not None:
+            dart = self._original_darts[dart]
+        # Iterative expansion: each item is (dart, reversed, expanded)
+        points = []
+        stack = [(dart, False, False)]
+        while stack:
+            d, reverse, expanded = stack.pop()
+            if expanded:
+                polyline = self._explicit.get(d)
+                if polyline is None:
+                    polyline = LabelMap.initial_dart_polylines(d, self.n_cols)
+                points.append(polyline[::-1] if reverse else polyline)
+                continue
+            # forward:  d, reversed(child_1), ..., reversed(child_k)
+            # reversed: child_k, ..., child_1, reversed(d)
+            children = self._children(d)
+            if not reverse:
+                parts = [(d, False, True)] + [(child, True, False) for child in children]
+            else:
+                parts = [(child, False, False) for child in reversed(children)] + [(d, True, True)]
+            stack.extend(reversed(parts))
+        return np.vstack(points)
+
+    def append_reversed(self, e, d) -> None:
+        """Extends the polyline of e with the reversed polyline of d"""
+        if self._original_darts is not None:
+            e, d = self._original_darts[e], self._original_darts[d]
+        if self._first_child is None:
+            self._first_child = np.full(self.n_darts, -1, dtype=np.int32)
+            self._last_child = np.full(self.n_darts, -1, dtype=np.int32)
+            self._next_sibling = np.full(self.n_darts, -1, dtype=np.int32)
+            self._parent = np.full(self.n_darts, -1, dtype=np.int32)
+
+        if self._parent[e] != -1:
+            # e has already been appended to another polyline (it can happen only for degenerate vertices).
+            # The polylines of its ancestors are frozen, so that they are not affected by the change of e
+            ancestors = []
+            ancestor = self._parent[e]
+            while ancestor != -1:
+                ancestors.append(ancestor)
+                ancestor = self._parent[ancestor]
+            frozen = [self[ancestor] for ancestor in ancestors]
+            for ancestor, polyline in zip(ancestors, frozen):
+                self._explicit[ancestor] = polyline
+                self._first_child[ancestor] = self._last_child[ancestor] = -1
+            self._parent[e] = -1
+
+        if self._first_child[e] == -1:
+            self._first_child[e] = d
+        else:
+            self._next_sibling[self._last_child[e]] = d
+        self._last_child[e] = d
+        self._parent[d] = e
+
+
 class LabelMap (PixelMap):
     # _initial_dart_polylines_00 stores start and end coordinates of darts in pixel (0,0)
     _initial_dart_polylines_00 = np.fromstring("""\
@@ -247,15 +340,12 @@ class LabelMap (PixelMap):
             n_lines = len (labels.splitlines())
             labels = np.fromstring (labels, sep=' ', dtype=np.uint8).reshape(n_lines, -1)
         c = cls.from_shape(labels.shape[0], labels.shape[1])
-        cls._labels = labels
+        c._labels = labels
 
         # add drawable polyline for each dart
+        # The initial polylines are computed from the dart identifiers only when they are requested
         if add_polyline:
-            c._dart_polyline = {}
-            for d in c.darts:
-                c._dart_polyline [d] = LabelMap._initial_dart_polylines_00[d % 8].copy()
-                c._dart_polyline [d][..., 0] += (d // 8)  % c.n_cols
-                c._dart_polyline [d][..., 1] += (d // 8) // c.n_cols
+            c._dart_polyline = _DartPolylines(c.n_cols, c.shape[1])
 
         # save labels
         cls._save_labels(c, labels, connected_components_labels)
@@ -263,18 +353,87 @@ class LabelMap (PixelMap):
         return c
 
     def _save_labels(gmap, labels: np.array, connected_components_labels: np.array) -> None:
-        for i in range(labels.shape[0]):
-            for j in range(labels.shape[1]):
-                # Get the first dart associated to each pixel
-                start_identifier = (i * labels.shape[1]) * 8 + j * 8
-                # Save label to all the darts of the cells
-                for k in range(8):
-                    gmap.image_labels[start_identifier + k] = labels[i][j]
-                    if connected_components_labels is not None:
-                        gmap.connected_components_labels[start_identifier + k] = connected_components_labels[i][j]
-                    else:
-                        gmap.connected_components_labels[start_identifier + k] = -1
+        # The range of the labels is known, so the narrowest dtype can be used for the labels arrays
+        schema = gmap.attribute_schema
+        schema.set_value_range("image_labels", np.min(labels), np.max(labels))
+        gmap.allocate_attribute("image_labels")
+        if connected_components_labels is not None:
+            for name in ("connected_components_labels", "dt_connected_components_labels"):
+                schema.set_value_range(name, np.min(connected_components_labels), np.max(connected_components_labels))
+            gmap.allocate_attribute("connected_components_labels")
+        else:
+            # -1 for all the darts, the array is allocated only if it is modified
+            schema.set_fill_value("connected_components_labels", -1)
+            for name in ("connected_components_labels", "dt_connected_components_labels"):
+                schema.set_value_range(name, -1, -1)
+
+        # The darts of the pixel (i, j) are 8*(i*C+j) + k, so each label is repeated for the 8 darts of its pixel
+        n_block_darts = 8 * labels.shape[0] * labels.shape[1]
+        gmap.set_image_labels(slice(0, n_block_darts), np.repeat(np.ravel(labels), 8))
+        if connected_components_labels is not None:
+            gmap.connected_components_labels[:n_block_darts] = np.repeat(np.ravel(connected_components_labels), 8)
+
+    def compact(self):
+        compacted = super().compact()
+        compacted._labels = self._labels
+        # labels of the pixels, read from the first dart of each pixel (it can be removed by the compaction)
+        compacted._pixel_image_labels = self.pixel_image_labels()
+        if hasattr(self, "_dart_polyline"):
+            compacted._dart_polyline = self._dart_polyline.renumbered(compacted.original_darts)
+        return compacted
+
+    def pixel_image_labels(self) -> np.array:
+        """Returns the image labels of the first dart of each pixel, with shape (n_rows, n_cols)"""
+        if "_pixel_image_labels" in self.__dict__:
+            return self._pixel_image_labels
+        n_block_darts = 8 * self.n_rows * self.n_cols
+        return self.image_labels[:n_block_darts:8].reshape(self.n_rows, self.n_cols)
+
+    def pixel_darts(self, interpolate_missing_values: bool = True) -> np.array:
+        """
+        Returns the alive dart associated to each pixel (see pixel_dart), with shape (n_rows, n_cols).
 
+        It is a gather on the representative darts, computed once after the reduction.
+        """
+        first_darts = 8 * np.arange(self.n_rows * self.n_cols).reshape(self.n_rows, self.n_cols)
+        if interpolate_missing_values:
+            return self.representative_darts()[first_darts]
+        darts = first_darts if self.compact_darts is None else self.compact_darts[first_darts]
+        alive = np.zeros(darts.shape, dtype=bool)
+        alive[darts != -1] = self._alive_darts_mask[darts[darts != -1]]
+        return np.where(alive, darts, -1)
+
+    def pixel_dart(self, i: int, j: int, interpolate_missing_values: bool = True):
+        """
+        Returns the alive dart associated to the pixel (i, j).
+
+        If the first dart of the pixel has been removed during the reduction, the dart that identifies the
+        face that contains it is returned if interpolate_missing_values is True, -1 otherwise.
+        """
+        dart = (i * self.n_cols * 8) + j * 8
+        if interpolate_missing_values:
+            return self.resolve_dart(dart)
+        return self.current_dart(dart)
+
+    def incremental_dt(self, seed_labels: typing.List[int], propagation_labels: typing.List[int],
+                       target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None,
+                       engine: str = "wave", max_distance: int = None) -> IncrementalDt:
+        """
+        Computes the distance transform of the map and returns an IncrementalDt that updates it
+        (distances and dt_connected_components_labels) when the labels of darts or pixels are modified.
+        """
+        return IncrementalDt(self, seed_labels, propagation_labels, target_labels, accumulation_directions, engine,
+                             max_distance)
+
+    @staticmethod
+    def initial_dart_polylines(darts, n_cols: int) -> np.array:
+        """Returns the initial polylines (start and end coordinates) of the darts, with shape darts.shape + (2, 2)"""
+        darts = np.asarray(darts)
+        polylines = LabelMap._initial_dart_polylines_00[darts % 8].copy()
+        pixels = darts // 8
+        polylines[..., 0] += np.asarray(pixels %  n_cols)[..., None]
+        polylines[..., 1] += np.asarray(pixels // n_cols)[..., None]
+        return polylines
 
     def plot(self, attribute_to_show: str = "dart_id", image_palette='gray'):
         """Plots the label map.
@@ -385,37 +544,32 @@ class LabelMap (PixelMap):
 
         """
 
-        voronoi_diagram = np.zeros((self.n_rows, self.n_cols, 3))
-
-        colors = {}
-
-        for i in range(voronoi_diagram.shape[0]):
-            for j in range(voronoi_diagram.shape[1]):
-                # get dart associated to each cell
-                dart = (i * voronoi_diagram.shape[1] * 8) + j * 8
-
-                if self.image_labels[dart] not in propagation_labels:
-                    voronoi_diagram[i][j] = (255, 255, 255)
-                    continue
-
-                # If the darts has been removed, take the new corresponding dart
-                # to assign a color to the corresponding cell
-                while self.ai(0, dart) == -1:
-                    dart = self.face_identifiers[dart]
-
-                if self.distances[dart] == -1:
-                    # distance not computed for that dart
-                    voronoi_diagram[i][j] = (255, 255, 255)  # white
-                    continue
-
-                if seed_labels is not None and self.image_labels[dart] in seed_labels:
-                    voronoi_diagram[i][j] = (0, 0, 0)  # black
-                    continue
-
-                if self.dt_connected_components_labels[dart] not in colors:
-                    colors[self.dt_connected_components_labels[dart]] = generate_random_color()
-
-                voronoi_diagram[i][j] = colors[self.dt_connected_components_labels[dart]]
+        voronoi_diagram = np.full((self.n_rows, self.n_cols, 3), 255.)  # white
+
+        # get dart associated to each cell
+        # If the darts has been removed, take the new corresponding dart
+        # to assign a color to the corresponding cell
+        darts = self.pixel_darts()
+        propagation = np.isin(self.pixel_image_labels(), list(propagation_labels)) & (darts != -1)
+        darts = darts[propagation]
+
+        # distance not computed for that dart (white)
+        computed = self.distances[darts] != -1
+        pixels = np.flatnonzero(propagation)[computed]
+        darts = darts[computed]
+
+        if seed_labels is not None:
+            seed = np.isin(self.image_labels[darts], list(seed_labels))
+            voronoi_diagram.reshape(-1, 3)[pixels[seed]] = (0, 0, 0)  # black
+            pixels, darts = pixels[~seed], darts[~seed]
+
+        # a color for each label, generated in the order in which the labels are found in the image
+        dt_labels = self.dt_connected_components_labels[darts]
+        unique_labels, first_pixels, inverse = np.unique(dt_labels, return_index=True, return_inverse=True)
+        colors = np.zeros((unique_labels.size, 3))
+        for k in np.argsort(first_pixels):
+            colors[k] = generate_random_color()
+        voronoi_diagram.reshape(-1, 3)[pixels] = colors[inverse]
 
         return voronoi_diagram
 
@@ -441,58 +595,30 @@ class LabelMap (PixelMap):
         :return:
         """
 
-        image = np.zeros((self.n_rows, self.n_cols))
-
-        for i in range(image.shape[0]):
-            for j in range(image.shape[1]):
-                # Get the dart associated to each pixel
-                dart = (i * image.shape[1] * 8) + j * 8
-
-                if self.image_labels[dart] not in propagation_labels:
-                    image[i][j] = -2
-                    continue
-
-                # Check if the current dart has been deleted during the reduction process of the gmap
-                if self.ai(0, dart) == -1:
-                    if interpolate_missing_values:
-                        # If the dart has been removed take the new corresponding dart
-                        # to assign a distance value to the pixel associated to the removed dart
-                        while self.ai(0, dart) == -1:
-                            dart = self.face_identifiers[dart]
-                    else:
-                        image[i][j] = -1
-                        continue
+        # Get the dart associated to each pixel
+        # If the dart has been removed during the reduction process of the gmap take the new
+        # corresponding dart to assign a distance value to the pixel associated to the removed dart
+        darts = self.pixel_darts(interpolate_missing_values)
+        removed = darts == -1
 
-                distance = self.distances[dart]
-                if distance == -1:
-                    # the distance is -1 if the corresponding face has not been used
-                    # for propagating the distance
-                    image[i][j] = -2
-                else:
-                    image[i][j] = distance
+        image = self.distances[np.where(removed, 0, darts)].astype(np.float64)
+        # the distance is -1 if the corresponding face has not been used
+        # for propagating the distance
+        image[image == -1] = -2
+        image[removed] = -1
+        image[~np.isin(self.pixel_image_labels(), list(propagation_labels))] = -2
 
         return image
 
     def get_label_image(self, interpolate_missing_values: bool = True) -> np.array:
-        image = np.zeros((self.n_rows, self.n_cols))
-
-        for i in range(image.shape[0]):
-            for j in range(image.shape[1]):
-                # Get the dart associated to each pixel
-                dart = (i * image.shape[1] * 8) + j * 8
-
-                # Check if the current dart has been deleted during the reduction process of the gmap
-                if self.ai(0, dart) == -1:
-                    if interpolate_missing_values:
-                        # If the dart has been removed take the new corresponding dart
-                        # to assign a distance value to the pixel associated to the removed dart
-                        while self.ai(0, dart) == -1:
-                            dart = self.face_identifiers[dart]
-                    else:
-                        image[i][j] = 255
-                        continue
+        # Get the dart associated to each pixel
+        # If the dart has been removed during the reduction process of the gmap take the new
+        # corresponding dart to assign a label to the pixel associated to the removed dart
+        darts = self.pixel_darts(interpolate_missing_values)
+        removed = darts == -1
 
-                image[i][j] = self.image_labels[dart]
+        image = self.image_labels[np.where(removed, 0, darts)].astype(np.float64)
+        image[removed] = 255
 
         return image
 
@@ -589,6 +715,8 @@ class LabelMap (PixelMap):
 
     def value (self,d):
         """Returns label value for given dart"""
+        if self.original_darts is not None:
+            d = self.original_darts[d]
         p = d // 8
         return self.labels [p // self.n_cols, p % self.n_cols]
 
@@ -635,7 +763,7 @@ class LabelMap (PixelMap):
             return
         for d in self.cell_0 (d):
             e = self.a0 (d)
-            self._dart_polyline [e] = np.vstack ((self._dart_polyline [e], self._dart_polyline [d][::-1]))
+            self._dart_polyline.append_reversed (e, d)
         super().remove_vertex(d)
 
     # TODO vetrices removal causes skips in darts in the outer loop if used w/i list() ???
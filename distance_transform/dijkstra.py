@@ -1,26 +1,50 @@
 import typing
-from heapq import heapify, heappush, heappop
+
+import numpy as np
+
+from combinatorial.gmaps import ROLE_PROPAGATE, ROLE_TARGET
+from distance_transform.priority_queues import build_priority_queue
 
 
 def generalized_dijkstra_dt_gmap(gmap, seed_labels: typing.List[int], propagation_labels: typing.List[int],
-                                 target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None) -> None:
+                                 target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None,
+                                 backend: str = "auto", max_distance: int = None,
+                                 stop_when_targets_reached: bool = False, weights: np.array = None) -> None:
     """
     It also saves for each dart the connected_component_label of the closest seed.
     It is useful for the generation of voronoi diagrams.
 
     It does make no sense to use the algorithms also for faces.
     I do that only for test purposes.
+
+    backend: priority queue to use, "bucket" (Dial), "radix", "dary" (indexed d-ary heap) or "auto"
+             (see build_priority_queue, the backend is chosen from the range of the weights).
+             All the backends pop the darts with the same distance in increasing order, so the result
+             does not depend on the backend.
+    max_distance: if not None, the distances greater than max_distance are not pushed in the queue,
+                  the farther darts are not reached (-1)
+    stop_when_targets_reached: if True, when all the darts with a target label have a distance, the largest one
+                               is used as max_distance (the farther darts are not reached)
+    weights: weight of each dart, if None the weights of the gmap
     """
 
     """
-    At the moment the heap implementation that I am using doesn't has a method to update a value
-    So I add values to the heap even if it is already present.
-    This not affect the correctness but memory consumption and performance.
-    In order to not consider the same dart multiple times, I need a visited structure.
+    The priority queues support the decrease of a key, so each dart is in the queue at most once.
+    The darts are processed a bucket at a time (all the darts with the smallest distance, see pop_bucket):
+    all their neighbours are gathered with fancy indexing, as in the wave propagation (see _propagate_batch).
+    The result is the same of processing the darts one at a time in increasing order, if all the directions
+    increase the distance. The darts found through directions that do not increase the distance are pushed
+    in the same bucket and processed by the next step.
+    In that case (vertex and cell accumulation) the distances are still the same, but the labels of the darts
+    at the same distance from two seeds can differ from the ones of the one at a time visit (the previous heapq
+    version), that processed such a dart as soon as it was the smallest one of the bucket: here a dart takes
+    the label of the first dart of the step that reaches it, as in generalized_wave_propagation_gmap
+    (see test_generalized_dijkstra_dt_gmap_zero_weight_labels).
+    The visited darts are kept in a boolean array.
     """
 
-    #
-    admissible_labels = propagation_labels + target_labels
+    # role of each dart (a single lookup tells if a dart is admissible)
+    roles = gmap.dart_roles(seed_labels, propagation_labels, target_labels)
 
     # Initialization
     gmap.distances.fill(-1)
@@ -31,45 +55,69 @@ def generalized_dijkstra_dt_gmap(gmap, seed_labels: typing.List[int], propagatio
         for i in range(gmap.n + 1):
             accumulation_directions.append(True)
 
-    # Initialize distance to 0 for seeds and add the seeds to the heap
-    heap = []  # each element is a tuple -> (distance, dart)
-    heapify(heap)
-    for dart in gmap.darts:
-        if gmap.image_labels[dart] in seed_labels:
-            gmap.distances[dart] = 0
-            heappush(heap, (gmap.distances[dart], dart))
-            gmap.dt_connected_components_labels[dart] = gmap.connected_components_labels[dart]
+    alphas = np.asarray(gmap)
+    distances = gmap.distances
+    weights = gmap.weights if weights is None else weights
+    labels = gmap.dt_connected_components_labels
+    n_involutions = len(accumulation_directions)
+    accumulates = np.array(accumulation_directions, dtype=bool)
+
+    darts = gmap.darts
+    max_weight = int(weights[darts].max()) if any(accumulation_directions) and darts.size > 0 else 0
+    queue = build_priority_queue(backend, max_weight, gmap.shape[1])
+
+    # Initialize distance to 0 for seeds and add the seeds to the queue
+    seeds = gmap.label_darts(seed_labels)
+    distances[seeds] = 0
+    labels[seeds] = gmap.connected_components_labels[seeds]
+    queue.push_many(np.zeros(seeds.size, dtype=np.int64), seeds.astype(np.int64))
 
     # visited
-    visited = set()
+    visited = np.zeros(gmap.shape[1], dtype=bool)
 
-    while len(heap) > 0:
-        distance, dart = heappop(heap)
-        visited.add(dart)
-        # Visit all the neighbours
-        for i in range(gmap.n + 1):
-            neighbour = gmap.ai(i, dart)
-
-            # check if visited
-            if neighbour in visited:
-                continue
-
-            # Check if I can propagate to that dart
-            if gmap.image_labels[neighbour] not in admissible_labels:
-                continue
-
-            if accumulation_directions[i]:
-                if gmap.distances[neighbour] == -1 \
-                        or gmap.distances[dart] + gmap.weights[dart] < gmap.distances[neighbour]:
-                    gmap.distances[neighbour] = gmap.distances[dart] + gmap.weights[dart]
-                    gmap.dt_connected_components_labels[neighbour] = gmap.dt_connected_components_labels[dart]
-                    if gmap.image_labels[neighbour] in propagation_labels:
-                        heappush(heap, (gmap.distances[neighbour], neighbour))
-            else:
-                if gmap.distances[neighbour] == -1 \
-                        or gmap.distances[dart] < gmap.distances[neighbour]:
-                    gmap.distances[neighbour] = gmap.distances[dart]
-                    gmap.dt_connected_components_labels[neighbour] = gmap.dt_connected_components_labels[dart]
-                    if gmap.image_labels[neighbour] in propagation_labels:
-                        heappush(heap, (gmap.distances[neighbour], neighbour))
+    # darts with a target label without a distance
+    targets = gmap.label_darts(target_labels) if stop_when_targets_reached else None
+    unreached_targets = targets[distances[targets] == -1] if stop_when_targets_reached else None
+    if stop_when_targets_reached and unreached_targets.size == 0:
+        max_distance = 0 if max_distance is None else min(max_distance, 0)
+        unreached_targets = None
+
+    while len(queue) > 0:
+        distance, batch = queue.pop_bucket()
+        if max_distance is not None and distance > max_distance:
+            # pushed before max_distance was reduced (cleared below), the following ones are farther
+            break
+        visited[batch] = True
+
+        # candidates in the order of the sequential visit (dart by dart, involution by involution)
+        neighbours = alphas[:, batch].T.ravel().astype(np.int64)
+        sources = np.repeat(batch, n_involutions)
+        values = np.where(np.tile(accumulates, batch.size), distance + weights[sources].astype(np.int64), distance)
+        keep = ~visited[neighbours] & (roles[neighbours] & (ROLE_PROPAGATE | ROLE_TARGET) != 0)
+        if max_distance is not None:
+            keep &= values <= max_distance
+        neighbours, sources, values = neighbours[keep], sources[keep], values[keep]
+
+        # For each neighbour, the first candidate with the smallest value (lexsort is stable)
+        order = np.lexsort((values, neighbours))
+        first = order[np.flatnonzero(np.diff(neighbours[order], prepend=-1) != 0)]
+        neighbours, sources, values = neighbours[first], sources[first], values[first]
+        update = (distances[neighbours] == -1) | (values < distances[neighbours])
+        neighbours, sources, values = neighbours[update], sources[update], values[update]
+        distances[neighbours] = values
+        labels[neighbours] = labels[sources]
+        propagates = roles[neighbours] & ROLE_PROPAGATE != 0
+        queue.push_many(values[propagates], neighbours[propagates])
+
+        if unreached_targets is not None:
+            unreached_targets = unreached_targets[distances[unreached_targets] == -1]
+            if unreached_targets.size == 0:
+                # an upper bound of the distance of the farthest target
+                bound = int(distances[targets].max())
+                max_distance = bound if max_distance is None else min(max_distance, bound)
+                unreached_targets = None
 
+    if stop_when_targets_reached and unreached_targets is None and targets.size > 0:
+        # the darts farther than the farthest target
+        farthest = distances[targets].max()
+        distances[distances > farthest] = -1
@@ -9,6 +9,7 @@ import numpy as np
 from combinatorial.utils import build_dt_grey_image_from_gmap
 from distance_transform.dt_utils import *
 from distance_transform.dijkstra import *
+from distance_transform.pyramidal_dt import PYRAMIDAL_DT_GMAP_MAX_STRIDE, pyramidal_dt_gmap
 import time
 import os
 
@@ -71,18 +72,28 @@ def compute_diffusion_distance_image(image: np.array, dt_image: np.array, label:
 
 def compute_dt_for_diffusion_distance(image: np.array, dt_image_path: str = None, verbose: bool = False,
                                       compute_voronoi_diagram: bool = False, reduction_factor: float = 0,
-                                      use_weights: bool = False) -> (nGmap, float, float):
+                                      use_weights: bool = False, pyramid_stride: int = 0) -> (nGmap, float, float):
     """
     Computes the diffusion distance of the cell represented by the image in image_path.
 
     Add the parameter save_gmap in order to save the gmap
     Add the parameter reduction_factor in order to compute dt on the reduced gfap
+    Add the parameter pyramid_stride (> 1) in order to compute an approximate dt on a coarse gmap of the image
+    reduced by pyramid_stride, refined near the label boundaries (see pyramidal_dt_gmap).
+    It cannot be used with reduction_factor, use_weights or compute_voronoi_diagram, and it cannot be greater than
+    PYRAMIDAL_DT_GMAP_MAX_STRIDE (the error of the larger strides is not usable).
 
     It returns a tuple of t
     The first element is the time, in seconds, required to reduce the gmap
     The second element is the time, in seconds, required to compure dt
     """
 
+    if pyramid_stride > 1 and (reduction_factor > 0 or use_weights or compute_voronoi_diagram):
+        raise ValueError("pyramid_stride cannot be used with reduction_factor, use_weights or compute_voronoi_diagram")
+    if pyramid_stride > PYRAMIDAL_DT_GMAP_MAX_STRIDE:
+        raise ValueError(f"pyramid_stride cannot be greater than {PYRAMIDAL_DT_GMAP_MAX_STRIDE}, "
+                         f"the error of the approximate dt is not usable")
+
     connected_components_labels = None
     if compute_voronoi_diagram:
         # Find connected components labels
@@ -110,6 +121,9 @@ def compute_dt_for_diffusion_distance(image: np.array, dt_image_path: str = None
     start = time.time_ns()
     if use_weights:
         generalized_dijkstra_dt_gmap(gmap, [labels["stomata"]], [labels['air']], [labels['cell']], accumulation_directions)
+    elif pyramid_stride > 1:
+        pyramidal_dt_gmap(gmap, [labels["stomata"]], [labels['air']], [labels['cell']], accumulation_directions,
+                          stride=pyramid_stride)
     else:
         generalized_wave_propagation_gmap(gmap, [labels["stomata"]], [labels['air']], [labels['cell']], accumulation_directions)
         # improved_wave_propagation_gmap_vertex(gmap, [labels["stomata"]], propagation_labels)
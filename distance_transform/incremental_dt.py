@@ -0,0 +1,208 @@
+import typing
+from heapq import heappush, heappop
+
+import numpy as np
+
+from combinatorial.gmaps import ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET
+
+
+class IncrementalDt:
+    """
+    Distance transform of a gmap that can be updated after the labels of some darts are modified,
+    for example when a seed is removed (relabelled) or a region is reclassified.
+    Only the darts whose distance or closest seed can change are recomputed.
+
+    The distances are the shortest ones: the same of generalized_dijkstra_dt_gmap, with unit weights for the
+    engine "wave". They are not the ones of generalized_wave_propagation_gmap: with directions that do not increase
+    the distance (vertex or cell accumulation) the wave propagation does not always find the shortest distance,
+    and it saves the label of the first dart that reaches each dart.
+    The connected_component_label of the closest seed is saved for each dart, it is the label of the predecessor
+    of the dart, the one with the smallest (key, dart) among the darts that give it its key (the same of
+    generalized_dijkstra_dt_gmap, that processes the darts by distance and then by hops).
+
+    The key of a dart is distance * hop_base + hops, where hops is the number of directions that do not increase
+    the distance after the last one that increases it, so each step increases the key and the predecessors
+    cannot form cycles.
+
+    The result depends only on the labels, not on the sequence of updates. The distances and the labels are saved
+    in the gmap (distances and dt_connected_components_labels) after each update, the not reached darts have
+    distance -1.
+
+    max_distance: if not None, the darts farther than max_distance are not reached
+    """
+
+    _UNREACHED = np.iinfo(np.int64).max
+
+    def __init__(self, gmap, seed_labels: typing.List[int], propagation_labels: typing.List[int],
+                 target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None,
+                 engine: str = "wave", max_distance: int = None):
+        if engine not in ("dijkstra", "wave"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if accumulation_directions is None:
+            accumulation_directions = [True] * (gmap.n + 1)
+
+        self._gmap = gmap
+        self._query = (list(seed_labels), list(propagation_labels), list(target_labels))
+        self._alphas = np.asarray(gmap)
+        weights = gmap.weights.astype(np.int64) if engine == "dijkstra" else np.ones(gmap.shape[1], dtype=np.int64)
+        # weight of the edge from each dart for each involution
+        self._steps = np.array(accumulation_directions, dtype=np.int64)[:, None] * weights[None, :]
+        self._hop_base = gmap.shape[1] + 1
+        # the largest key with a distance not greater than max_distance
+        self._max_key = self._UNREACHED - 1 if max_distance is None else (max_distance + 1) * self._hop_base - 1
+
+        self._keys = np.full(gmap.shape[1], self._UNREACHED, dtype=np.int64)
+        self._parents = np.full(gmap.shape[1], -1, dtype=np.int64)
+        self._labels = np.zeros(gmap.shape[1], dtype=np.int64)
+        self._roles = None
+        self._update_roles()
+
+        seeds = gmap.label_darts(seed_labels)
+        modified = self._relax(self._set_seeds(seeds))
+        gmap.distances[gmap.darts] = -1
+        self._save(np.union1d(seeds, modified))
+
+    def _update_roles(self) -> np.array:
+        """Reads the roles of the darts for the current labels, returns the darts whose role has changed"""
+        previous = self._roles
+        self._roles = self._gmap.dart_roles(*self._query)
+        self._admissible = self._roles & (ROLE_PROPAGATE | ROLE_TARGET) != 0
+        self._propagates = self._roles & (ROLE_SEED | ROLE_PROPAGATE) != 0
+        if previous is None:
+            return np.flatnonzero(self._roles)
+        return np.flatnonzero(previous != self._roles)
+
+    def _set_seeds(self, seeds: np.array) -> np.array:
+        self._keys[seeds] = 0
+        self._parents[seeds] = seeds
+        self._labels[seeds] = self._gmap.connected_components_labels[seeds]
+        return seeds
+
+    @property
+    def distances(self) -> np.array:
+        """Distance of each dart, -1 if it is not reached"""
+        return np.where(self._keys == self._UNREACHED, -1, self._keys // self._hop_base)
+
+    def relabel_darts(self, darts, labels) -> None:
+        """
+        Sets the image labels of the darts (see nGmap.set_image_labels) and repairs the distance transform:
+        1) the darts whose distance depends on a dart whose role has changed (the subtrees of the predecessors)
+           are invalidated
+        2) the distances are propagated again from the new seeds and from the valid darts around the invalidated
+           and the changed ones, processing the keys in increasing order (as dijkstra). The propagation continues
+           outside the invalidated darts only where the distance decreases or the closest seed changes.
+        """
+        gmap = self._gmap
+        darts = np.asarray(darts, dtype=np.int64).ravel()
+        gmap.set_image_labels(darts, labels)
+        changed = self._update_roles()
+        changed = changed[gmap._alive_darts_mask[changed]]
+        if changed.size == 0:
+            return
+
+        invalid = self._subtrees(changed[self._keys[changed] != self._UNREACHED])
+        self._keys[invalid] = self._UNREACHED
+        self._parents[invalid] = -1
+
+        seeds = self._set_seeds(changed[self._roles[changed] & ROLE_SEED != 0])
+        around = np.unique(self._alphas[:, np.concatenate([invalid, changed])])
+        around = around[(self._keys[around] != self._UNREACHED) & self._propagates[around]]
+        modified = self._relax(np.union1d(seeds, around))
+        self._save(np.union1d(np.union1d(invalid, seeds), modified))
+
+    def relabel_pixels(self, mask: np.array, label: int) -> None:
+        """Sets the label of the alive darts of the pixels where mask is True (see relabel_darts)"""
+        gmap = self._gmap
+        darts = gmap.darts
+        original = darts if gmap.original_darts is None else gmap.original_darts[darts]
+        in_block = original < 8 * gmap.n_rows * gmap.n_cols
+        darts, pixels = darts[in_block], original[in_block] // 8
+        self.relabel_darts(darts[np.ravel(mask)[pixels]], label)
+        if "_pixel_image_labels" in gmap.__dict__:
+            # labels of the pixels saved by the compaction
+            gmap._pixel_image_labels = np.where(mask, label, gmap._pixel_image_labels)
+
+    def _subtrees(self, roots: np.array) -> np.array:
+        """Returns the darts whose chain of predecessors contains one of the roots (roots included)"""
+        n_involutions = self._alphas.shape[0]
+        subtrees = [roots]
+        level = roots
+        while level.size > 0:
+            neighbours = self._alphas[:, level].ravel().astype(np.int64)
+            sources = np.tile(level, n_involutions)
+            children = neighbours[(self._parents[neighbours] == sources) & (neighbours != sources)]
+            level = np.unique(children)
+            subtrees.append(level)
+        return np.unique(np.concatenate(subtrees))
+
+    def _relax(self, sources: np.array) -> np.array:
+        """
+        Propagates the keys from the sources (in increasing order of key, all the darts with the same key at once).
+        A neighbour is updated if its key decreases or if the dart is a better predecessor (a smaller key or
+        the same key and a smaller identifier) or if its predecessor has a different label.
+
+        Returns the updated darts.
+        """
+        keys, parents, labels = self._keys, self._parents, self._labels
+        hop_base = self._hop_base
+        n_involutions = self._alphas.shape[0]
+
+        buckets = {}
+        sources = sources[self._propagates[sources]]
+        for key in np.unique(keys[sources]):
+            buckets[int(key)] = [sources[keys[sources] == key]]
+        heap = sorted(buckets)
+
+        modified = []
+        while heap:
+            key = heappop(heap)
+            while key in buckets:
+                batch = np.unique(np.concatenate(buckets.pop(key)))
+                batch = batch[keys[batch] == key]
+
+                neighbours = self._alphas[:, batch].ravel().astype(np.int64)
+                darts = np.tile(batch, n_involutions)
+                steps = self._steps[:, batch].ravel()
+                values = np.where(steps > 0, (key // hop_base + steps) * hop_base, key + 1)
+                admissible = self._admissible[neighbours] & (values <= self._max_key)
+                neighbours, darts, values = neighbours[admissible], darts[admissible], values[admissible]
+
+                # the best proposal (smallest value and dart) for each neighbour
+                order = np.lexsort((darts, values, neighbours))
+                neighbours, darts, values = neighbours[order], darts[order], values[order]
+                first = np.ones(neighbours.size, dtype=bool)
+                first[1:] = neighbours[1:] != neighbours[:-1]
+                neighbours, darts, values = neighbours[first], darts[first], values[first]
+
+                current_parents = parents[neighbours]
+                parent_keys = np.where(current_parents >= 0, keys[current_parents], self._UNREACHED)
+                decreased = values < keys[neighbours]
+                equal = values == keys[neighbours]
+                better_parent = equal & ((key < parent_keys) | ((key == parent_keys) & (darts < current_parents)))
+                new_label = labels[darts] != labels[neighbours]
+                update = decreased | better_parent | (equal & (current_parents == darts) & new_label)
+                neighbours, darts, values = neighbours[update], darts[update], values[update]
+                push = decreased[update] | new_label[update]
+
+                keys[neighbours] = values
+                parents[neighbours] = darts
+                labels[neighbours] = labels[darts]
+                modified.append(neighbours)
+
+                push &= self._propagates[neighbours]
+                neighbours, values = neighbours[push], values[push]
+                for value in np.unique(values):
+                    value = int(value)
+                    if value not in buckets:
+                        buckets[value] = []
+                        if value != key:
+                            heappush(heap, value)
+                    buckets[value].append(neighbours[values == value])
+
+        return np.unique(np.concatenate(modified + [sources[:0]]))
+
+    def _save(self, darts: np.array) -> None:
+        """Writes the distances and the closest seeds of the darts in the gmap"""
+        reached = self._keys[darts] != self._UNREACHED
+        self._gmap.distances[darts] = np.where(reached, self._keys[darts] // self._hop_base, -1)
+        self._gmap.dt_connected_components_labels[darts[reached]] = self._labels[darts[reached]]
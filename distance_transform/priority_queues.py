@@ -0,0 +1,250 @@
+import typing
+from heapq import heappush, heappop
+
+import numpy as np
+
+
+"""
+Priority queues for the generalized dijkstra (see generalized_dijkstra_dt_gmap).
+
+The items are darts (0, ..., n_items - 1) and the keys are non negative integer distances.
+All the queues have the same interface:
+- push(key, item): inserts the item or decreases its key
+- pop(): removes and returns (key, item) with the smallest key. Items with the same key are returned in increasing
+         order, so the result of the dijkstra does not depend on the backend.
+- len(queue): number of items in the queue
+- push_many(keys, items): push of arrays of keys and (distinct) items
+- pop_bucket(): removes and returns (key, items) with all the items with the smallest key, in increasing order.
+                It is the same of popping them one at a time, the dijkstra processes a whole bucket at once.
+
+The bucket queue and the radix heap are monotone: the pushed keys cannot be smaller than the last popped key
+(always true for dijkstra with non negative weights). The lazy deletion is used, the current key of each item
+is kept in an array and the outdated entries are skipped.
+"""
+
+
+class _PriorityQueue:
+    """push_many on top of push (one item at a time)"""
+
+    def push_many(self, keys: np.array, items: np.array) -> None:
+        for key, item in zip(keys.tolist(), items.tolist()):
+            self.push(key, item)
+
+
+class BucketQueue(_PriorityQueue):
+    """
+    Dial's bucket queue, for small integer weights.
+
+    The keys in the queue are in [current, current + max_weight], so a circular array of max_weight + 1 buckets
+    is sufficient. Each bucket is a list of arrays of items: push_many appends an array to each bucket it touches
+    and pop_bucket merges the arrays of the current bucket, so a whole bucket costs a few numpy calls.
+    """
+
+    def __init__(self, max_weight: int, n_items: int):
+        self._buckets = [[] for _ in range(max_weight + 1)]
+        self._keys = np.full(n_items, -1, dtype=np.int64)
+        self._current = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, key: int, item: int) -> None:
+        self.push_many(np.array([key], dtype=np.int64), np.array([item], dtype=np.int64))
+
+    def push_many(self, keys: np.array, items: np.array) -> None:
+        if items.size == 0:
+            return
+        self._size += int(np.count_nonzero(self._keys[items] == -1))
+        self._keys[items] = keys
+        slots = keys % len(self._buckets)
+        order = np.argsort(slots, kind="stable")
+        slots, starts = np.unique(slots[order], return_index=True)
+        for slot, chunk in zip(slots.tolist(), np.split(items[order], starts[1:])):
+            self._buckets[slot].append(chunk)
+
+    def pop_bucket(self) -> typing.Tuple[int, np.array]:
+        if self._size == 0:
+            raise IndexError("pop from an empty priority queue")
+        while True:
+            slot = self._current % len(self._buckets)
+            if self._buckets[slot]:
+                # the outdated entries (the key of the item has been decreased) are dropped
+                items = np.unique(np.concatenate(self._buckets[slot]))
+                self._buckets[slot] = []
+                items = items[self._keys[items] == self._current]
+                if items.size > 0:
+                    self._keys[items] = -1
+                    self._size -= items.size
+                    return self._current, items
+            self._current += 1
+
+    def pop(self) -> typing.Tuple[int, int]:
+        key, items = self.pop_bucket()
+        # the other items go back to the current bucket
+        self.push_many(np.full(items.size - 1, key, dtype=np.int64), items[1:])
+        return key, int(items[0])
+
+
+class RadixHeap(_PriorityQueue):
+    """
+    Radix heap, for any range of integer weights.
+
+    An entry with key k is in the bucket bit_length(k xor last), where last is the last popped key.
+    When the bucket 0 (keys equal to last) is empty, the first non empty bucket is redistributed
+    in the lower buckets using its smallest key as last.
+    """
+
+    def __init__(self, n_items: int):
+        self._buckets = [[] for _ in range(65)]  # the bucket 0 is a heap of items, the others (key, item) lists
+        self._keys = np.full(n_items, -1, dtype=np.int64)
+        self._last = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _insert(self, key: int, item: int) -> None:
+        bucket = (key ^ self._last).bit_length()
+        if bucket == 0:
+            heappush(self._buckets[0], item)
+        else:
+            self._buckets[bucket].append((key, item))
+
+    def push(self, key: int, item: int) -> None:
+        if self._keys[item] == -1:
+            self._size += 1
+        self._keys[item] = key
+        self._insert(key, item)
+
+    def pop(self) -> typing.Tuple[int, int]:
+        if self._size == 0:
+            raise IndexError("pop from an empty priority queue")
+        while True:
+            while self._buckets[0]:
+                item = heappop(self._buckets[0])
+                if self._keys[item] == self._last:
+                    self._keys[item] = -1
+                    self._size -= 1
+                    return self._last, item
+
+            # redistribute the first non empty bucket (only the entries that are not outdated)
+            bucket = next(b for b in range(1, len(self._buckets)) if self._buckets[b])
+            entries = [(key, item) for key, item in self._buckets[bucket] if self._keys[item] == key]
+            self._buckets[bucket] = []
+            if entries:
+                self._last = min(key for key, _ in entries)
+                for key, item in entries:
+                    self._insert(key, item)
+
+    def pop_bucket(self) -> typing.Tuple[int, np.array]:
+        key, item = self.pop()
+        items = [item]
+        # the other items with the same key are in the bucket 0 (the following buckets are not redistributed,
+        # the dijkstra can still push items with this key)
+        while self._buckets[0]:
+            item = heappop(self._buckets[0])
+            if self._keys[item] == key:
+                self._keys[item] = -1
+                self._size -= 1
+                items.append(item)
+        return key, np.array(items, dtype=np.int64)
+
+
+class IndexedDaryHeap(_PriorityQueue):
+    """
+    Array-based d-ary heap with decrease-key.
+
+    The position of each item in the heap is kept in an array, so each item is in the heap at most once.
+    The entries are ordered by (key, item).
+    """
+
+    def __init__(self, n_items: int, d: int = 4):
+        self._d = d
+        self._heap = []
+        self._positions = np.full(n_items, -1, dtype=np.int64)
+        self._keys = np.zeros(n_items, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _less(self, item_1: int, item_2: int) -> bool:
+        return (self._keys[item_1], item_1) < (self._keys[item_2], item_2)
+
+    def _move(self, item: int, position: int) -> None:
+        self._heap[position] = item
+        self._positions[item] = position
+
+    def _sift_up(self, position: int) -> None:
+        item = self._heap[position]
+        while position > 0:
+            parent = (position - 1) // self._d
+            if not self._less(item, self._heap[parent]):
+                break
+            self._move(self._heap[parent], position)
+            position = parent
+        self._move(item, position)
+
+    def _sift_down(self, position: int) -> None:
+        item = self._heap[position]
+        size = len(self._heap)
+        while True:
+            first_child = self._d * position + 1
+            if first_child >= size:
+                break
+            child = min(range(first_child, min(first_child + self._d, size)),
+                        key=lambda c: (self._keys[self._heap[c]], self._heap[c]))
+            if not self._less(self._heap[child], item):
+                break
+            self._move(self._heap[child], position)
+            position = child
+        self._move(item, position)
+
+    def push(self, key: int, item: int) -> None:
+        self._keys[item] = key
+        if self._positions[item] == -1:
+            self._heap.append(item)
+            self._positions[item] = len(self._heap) - 1
+        self._sift_up(self._positions[item])
+
+    def pop(self) -> typing.Tuple[int, int]:
+        if not self._heap:
+            raise IndexError("pop from an empty priority queue")
+        item = self._heap[0]
+        last = self._heap.pop()
+        self._positions[item] = -1
+        if self._heap:
+            self._move(last, 0)
+            self._sift_down(0)
+        return int(self._keys[item]), item
+
+    def pop_bucket(self) -> typing.Tuple[int, np.array]:
+        key, item = self.pop()
+        items = [item]
+        while self._heap and self._keys[self._heap[0]] == key:
+            items.append(self.pop()[1])
+        return key, np.array(items, dtype=np.int64)
+
+
+# Largest weight for which the bucket queue is chosen automatically
+BUCKET_QUEUE_MAX_WEIGHT = 1024
+
+
+def build_priority_queue(backend: str, max_weight: int, n_items: int):
+    """
+    Returns an empty priority queue.
+
+    backend: "bucket" (Dial), "radix", "dary" or "auto". With "auto" the bucket queue is used if max_weight is
+             small (<= BUCKET_QUEUE_MAX_WEIGHT), the radix heap otherwise.
+    max_weight: the largest weight of an edge
+    """
+    if backend == "auto":
+        backend = "bucket" if max_weight <= BUCKET_QUEUE_MAX_WEIGHT else "radix"
+
+    if backend == "bucket":
+        return BucketQueue(max_weight, n_items)
+    if backend == "radix":
+        return RadixHeap(n_items)
+    if backend == "dary":
+        return IndexedDaryHeap(n_items)
+    raise ValueError(f"Unknown priority queue backend: {backend}")
@@ -1,55 +1,210 @@
 import typing
 
+import cv2
 import numpy as np
 import math
 
 
-from distance_transform.wave_propagation import wave_propagation_dt_image
+from combinatorial.gmaps import ROLE_BLOCKED, ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET
+from combinatorial.pixelmap import LabelMap
+from distance_transform.separable_dt import _column_distances, _manhattan_rows, separable_dt_binary_image
+from distance_transform.wave_propagation import generalized_wave_propagation_gmap, wave_propagation_dt_image
 
+# role of the pixels added to fit the kernel, they do not take part in the reduction
+_PADDING_ROLE = -1
 
-def pyramidal_dt_binary_image(image: np.array, stride: int) -> np.array:
+# Largest stride of pyramidal_dt_gmap with a usable error. On a synthetic 512x512 leaf slice (see
+# performance/evaluate_performance_pyramidal_dt.py, mean distance 380) the mean absolute error is 1.0 with
+# stride 2, 4.4 with stride 3 and 58 with stride 4, where the coarse windows close the air chambers of the stomata
+PYRAMIDAL_DT_GMAP_MAX_STRIDE = 3
+
+# There is no pyramidal version of generalized_wave_propagation_image: the same scheme on the pixels (coarse wave on
+# the reduced roles, masked with the fine reachability and refined near the label boundaries) reaches the same pixels
+# of the exact wave, but on a synthetic 1024x1024 leaf slice it takes 1.4-1.7 times the time of the exact frontier
+# wave (already linear, and the coarse wave alone takes half of it) with a mean absolute error of 11 to 32
+# (stride 2 to 4). For the images use generalized_wave_propagation_image, for the LabelMaps pyramidal_dt_gmap.
+
+
+def pyramidal_dt_binary_image(image: np.array, stride: int, levels: int = 1, tolerance: int = None) -> np.array:
     """
-    Parallel approximate algorithm that should (hopefully) takes O(log(n))
-    where n is the number of darts
+    Approximate dt of a binary image (distance from the closest 0) computed on a pyramid.
 
-    Time complexity: O(log(n)) ?
-    Space complexity: O(n) ?
+    Time complexity: O(n), a few vectorized passes over each level of the pyramid
+    Space complexity: O(n)
 
     Algorithm:
     1) Reduce image size through a pyramid
     2) Compute dt on a reduced image
-    3) Interpolate the obtained values for each level
+    3) Interpolate the obtained values for each level: the pixels take a closed form value from the centers
+       of the coarse cells, only the windows of the cells with a seed are refined (see _interpolate_centers)
+
+    On a 1000x1000 image with 0.1% of seeds (see test_mae_time_levels_improved_pyramidal in
+    performance/evaluate_performance_pyramidal_dt.py), with one level, the pyramid takes about 0.7 of the time of the
+    exact separable_dt_binary_image with stride 2 (mean absolute error 0.7) and about 0.55 with stride 3 (mae 1.4).
+    The time is dominated by the interpolation of the finest level, so more levels (or a larger tolerance) increase
+    the error without reducing the time much: the stride is the parameter that trades the error for the time.
 
     :param image:
     :param stride:
+    :param levels: number of reductions of the pyramid
+    :param tolerance: if not None, the maximum error allowed (see _pyramid_levels), the pyramid has the largest
+                      number of levels (not greater than levels) within the tolerance
     :return:
     """
-    # reduce image
-    reduced_image = reduce_size_binary_image(image, stride)
+    return _multi_level_pyramidal_dt(image, stride, _pyramid_levels(stride, levels, tolerance),
+                                     lambda fine_image, dt_image: interpolate_dt_binary_image(dt_image, stride))
 
-    # compute dt
-    dt_image = wave_propagation_dt_image(reduced_image)
 
-    # interpolate
-    dt_image = interpolate_dt_binary_image(dt_image, stride)
+def improved_pyramidal_dt_binary_image(image: np.array, stride: int, levels: int = 1,
+                                       tolerance: int = None) -> np.array:
+    """
+    See pyramidal_dt_binary_image, the zeros of each level are preserved by the interpolation
+    (see improved_interpolate_dt_binary_image).
+    """
+    return _multi_level_pyramidal_dt(image, stride, _pyramid_levels(stride, levels, tolerance),
+                                     improved_interpolate_dt_binary_image)
 
-    return dt_image
 
+def pyramidal_dt_gmap(gmap: LabelMap, seed_labels: typing.List[int], propagation_labels: typing.List[int],
+                      target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None,
+                      stride: int = 2, band_radius: int = None) -> None:
+    """
+    Approximation of generalized_wave_propagation_gmap computed on a coarse LabelMap and refined near the
+    label boundaries:
+    1) the roles of the pixels (seed, propagation, target or blocked) are reduced with reduce_size_roles_image and
+       the dt is computed (exact) on the LabelMap of the reduced roles, with the same accumulation directions
+    2) each dart takes the value upsampled (see _upsample_centers) from the darts with the same position in the
+       coarse pixels, the seeds are 0. Only the darts of the pixels connected to a seed at the fine level
+       (see _seed_connected_pixels) take a value: a coarse window with a seed and a blocked pixel is a seed,
+       so the coarse wave can cross a wall, and the distances cannot increase in the refinement
+    3) the darts of propagation of the pixels at a manhattan distance not greater than band_radius (stride if
+       None) from a label boundary, and the ones that are not reached at the coarse level (for example behind a
+       channel narrower than a window, closed by the reduction), are refined: they take the value of a neighbour
+       seed or propagation dart (+ 1 if the direction accumulates the distance) if it is smaller, as the levels
+       of the wave, until the values do not change. After the first iteration only the darts next to a
+       decreased dart are visited, so the work is proportional to the size of the band and of the corrections.
+    4) a target takes the smallest value of its neighbour seeds and propagation darts (as in the exact wave,
+       a target is reached only from them)
+
+    The distances are saved in gmap.distances (-1 for the darts that are not reached).
+    The dt_connected_components_labels are not computed.
+    The gmap cannot be reduced: the estimates are distances between pixels, not between the faces of a reduced map.
+    """
+    if gmap.n_darts != 8 * gmap.n_rows * gmap.n_cols or gmap.shape[1] != gmap.n_darts:
+        raise ValueError("The pyramidal dt needs the map of the pixels, the gmap cannot be reduced")
+    if accumulation_directions is None:
+        accumulation_directions = [True] * (gmap.n + 1)
+    if band_radius is None:
+        band_radius = stride
+
+    # coarse level
+    labels = gmap.pixel_image_labels()
+    roles = np.select([np.isin(labels, seed_labels), np.isin(labels, propagation_labels),
+                       np.isin(labels, target_labels)], [ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET], ROLE_BLOCKED)
+    reduced_roles = reduce_size_roles_image(roles, stride)
+    reduced_gmap = LabelMap.from_labels(reduced_roles, add_polyline=False)
+    generalized_wave_propagation_gmap(reduced_gmap, [ROLE_SEED], [ROLE_PROPAGATE], [ROLE_TARGET],
+                                      accumulation_directions)
+    reduced_distances = reduced_gmap.distances[:8 * reduced_roles.size].reshape(*reduced_roles.shape, 8)
+    upsampled = _upsample_centers(reduced_distances, stride, labels.shape).ravel()
+
+    # the darts of the pixel (i, j) are 8 * (i * n_cols + j) + k, as the upsampled values
+    infinity = np.iinfo(np.int64).max // 4
+    dart_roles = gmap.dart_roles(seed_labels, propagation_labels, target_labels)
+    propagates = dart_roles & (ROLE_SEED | ROLE_PROPAGATE) != 0
+    connected = np.repeat(_seed_connected_pixels(roles).ravel(), 8)
+    distances = np.where((dart_roles == ROLE_PROPAGATE) & connected & (upsampled >= 0), upsampled, infinity)
+    distances[dart_roles == ROLE_SEED] = 0
+
+    # the pixels near a label boundary
+    boundaries = np.zeros(labels.shape, dtype=bool)
+    boundaries[1:, :] |= labels[1:, :] != labels[:-1, :]
+    boundaries[:-1, :] |= labels[1:, :] != labels[:-1, :]
+    boundaries[:, 1:] |= labels[:, 1:] != labels[:, :-1]
+    boundaries[:, :-1] |= labels[:, 1:] != labels[:, :-1]
+    near_boundaries = np.zeros(labels.shape, dtype=bool)
+    if np.any(boundaries):
+        near_boundaries = separable_dt_binary_image(~boundaries) <= band_radius
+
+    alphas = np.asarray(gmap)
+    steps = np.array(accumulation_directions, dtype=np.int64)[:, None]
+    in_band = (np.repeat(near_boundaries.ravel(), 8) | (distances == infinity)) & (dart_roles == ROLE_PROPAGATE) \
+        & connected
+    # after the first iteration only the darts of the band next to a decreased dart can decrease
+    active = np.flatnonzero(in_band)
+    while active.size > 0:
+        neighbours = alphas[:, active].astype(np.int64)
+        candidates = np.where(propagates[neighbours], distances[neighbours] + steps, infinity).min(axis=0)
+        decreased = candidates < distances[active]
+        active = active[decreased]
+        distances[active] = candidates[decreased]
+        active = np.unique(alphas[:, active])
+        active = active[in_band[active]]
+
+    targets = np.flatnonzero(dart_roles == ROLE_TARGET)
+    neighbours = alphas[:, targets].astype(np.int64)
+    distances[targets] = np.where(propagates[neighbours], distances[neighbours] + steps, infinity).min(axis=0)
+
+    gmap.distances[:] = np.where(distances < infinity, distances, -1)
+
+
+def _seed_connected_pixels(roles: np.array) -> np.array:
+    """
+    The seed and propagation pixels of the 4-connected components (of seed and propagation pixels) that contain
+    a seed: the pixels that the exact wave can reach, except the targets
+    """
+    propagates = (roles == ROLE_SEED) | (roles == ROLE_PROPAGATE)
+    _, components = cv2.connectedComponents(propagates.astype(np.uint8), connectivity=4)
+    seeded = np.zeros(components.max() + 1, dtype=bool)
+    seeded[components[roles == ROLE_SEED]] = True
+    return seeded[components] & propagates
+
+
+def _pyramid_levels(stride: int, levels: int, tolerance: typing.Optional[int]) -> int:
+    """
+    Returns the number of levels of the pyramid: levels, reduced until the error bound is within the tolerance.
+
+    The error bound of a pyramid with levels reductions is 2 * (stride ** levels - 1): the distance of a pixel
+    is estimated from the cells of stride ** levels pixels, the closest seed can be anywhere in its cell
+    and the pixel anywhere in its cell (stride ** levels - 1 pixels on each axis).
+    """
+    if tolerance is not None:
+        while levels > 0 and 2 * (stride ** levels - 1) > tolerance:
+            levels -= 1
+    return levels
+
+
+def _multi_level_pyramidal_dt(image: np.array, stride: int, levels: int,
+                              interpolate: typing.Callable[[np.array, np.array], np.array]) -> np.array:
+    """
+    1) The image is reduced recursively levels times (the image is padded with ones to a multiple of
+       stride ** levels, so the interpolation of each level has the shape of the level)
+    2) The dt is computed on the coarsest level (exact)
+    3) The dt is interpolated level by level (interpolate(image of the level, dt of the previous level)),
+       each interpolation computes the values of the pixels from the coarse centers in closed form (a few
+       vectorized passes over the level) and refines with a local dt only the windows of the centers with a seed
+       (see _interpolate_centers)
+    """
+    n_rows, n_cols = image.shape
+    size = stride ** levels
+    padded_image = np.ones((math.ceil(n_rows / size) * size, math.ceil(n_cols / size) * size), dtype=image.dtype)
+    padded_image[:n_rows, :n_cols] = image
 
-def improved_pyramidal_dt_binary_image(image: np.array, stride: int) -> np.array:
-    # reduce image
-    reduced_image = reduce_size_binary_image(image, stride)
+    pyramid = [padded_image]
+    for _ in range(levels):
+        pyramid.append(reduce_size_binary_image(pyramid[-1], stride))
 
     # compute dt
-    dt_image = wave_propagation_dt_image(reduced_image)
+    dt_image = wave_propagation_dt_image(pyramid[-1])
 
     # interpolate
-    dt_image = improved_interpolate_dt_binary_image(image, dt_image)
+    for fine_image in reversed(pyramid[:-1]):
+        dt_image = interpolate(fine_image, dt_image)
 
-    return dt_image
+    return dt_image[:n_rows, :n_cols]
 
 
-def reduce_size_binary_image(image: np.array, stride: int) -> np.array:
+def reduce_size_binary_image(image: np.array, stride: typing.Union[int, typing.Tuple[int, int]]) -> np.array:
     """
     How to compress the image?
     A binary image has only zeroes and ones.
@@ -67,42 +222,67 @@ def reduce_size_binary_image(image: np.array, stride: int) -> np.array:
     How to manage boundaries if the kernel size is not perfect?
     I can add ones to the boundaries if the kernel size does not fit perfectly.
 
-    PRECONDITIONS:
-    At the moment, for simplicity, only 2d images are considered.
+    The reduction is a min-pooling of the windows (0 if the window contains a 0, 1 otherwise), computed with an or
+    of the strided slices of the rows of the windows and then of their columns (the missing pixels of the
+    windows on the border are ones, they do not change the result).
 
-    :param image:
-    :param stride: for simplicity for the moment it is only an integer (square kernel). It could be a tuple of integers
-                   if kernels of different forms would be used
+    :param image: a 2d image or a stack of 2d images (the last two axes are the rows and the columns)
+    :param stride: an integer (square kernel) or a tuple (stride_rows, stride_cols)
     :return:
     """
+    stride_rows, stride_cols = (stride, stride) if np.isscalar(stride) else stride
+    image = np.asarray(image)
+
+    # if the kernel does not cover perfectly the image the windows on the border are smaller
+    # (as if ones were added to the original image to fit the kernel)
+    zeros = image == 0
+
+    # the rows of each window (slices of the image), then the columns of the reduced rows
+    rows_zeros = zeros[..., ::stride_rows, :].copy()
+    for r in range(1, stride_rows):
+        window_rows = zeros[..., r::stride_rows, :]
+        rows_zeros[..., :window_rows.shape[-2], :] |= window_rows
+    windows_zeros = rows_zeros[..., ::stride_cols].copy()
+    for c in range(1, stride_cols):
+        window_cols = rows_zeros[..., c::stride_cols]
+        windows_zeros[..., :window_cols.shape[-1]] |= window_cols
+    return (~windows_zeros).astype(image.dtype)
+
+
+def reduce_size_roles_image(roles: np.array, stride: typing.Union[int, typing.Tuple[int, int]]) -> np.array:
+    """
+    Reduction of an image of roles (ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET, ROLE_BLOCKED), the role of each
+    window is, in order of priority:
+    1) seed if the window contains a seed (the seeds are never lost, as in reduce_size_binary_image, and the wave
+       starts from all the sides of the window, even if a blocked pixel of the window separates them: the coarse
+       wave can cross a wall next to a seed, so the coarse values have to be masked with the reachability at the
+       fine level, see pyramidal_dt_gmap)
+    2) blocked if the window contains a blocked pixel (the wave never crosses a blocked pixel at a coarse level)
+    3) propagation if the window contains a propagation pixel (so the channels narrower than a window between
+       the targets are kept, but the coarse wave can cross a wall of targets thinner than a window)
+    4) target if the window contains only targets
+    The pixels added to fit the kernel (and the windows that contain only them) have the role _PADDING_ROLE,
+    they are ignored by the reduction and they are blocked for the dt.
+
+    :param roles: a 2d image or a stack of 2d images (the last two axes are the rows and the columns)
+    :param stride: an integer (square kernel) or a tuple (stride_rows, stride_cols)
+    :return:
+    """
+    stride_rows, stride_cols = (stride, stride) if np.isscalar(stride) else stride
+    roles = np.asarray(roles)
+    *stack_shape, n_rows, n_cols = roles.shape
 
-    def compute_reduced_value(image: np.array, reduced_image_x: int, reduced_image_y: int, stride: int) -> int:
-        start_x = reduced_image_x * stride
-        start_y = reduced_image_y * stride
-        end_x = start_x + stride
-        end_y = start_y + stride
-
-        for i in range(start_x, end_x):
-            for j in range(start_y, end_y):
-                if i > (image.shape[0] - 1) or j > (image.shape[1] - 1):
-                    continue
-                if image[i][j] == 0:
-                    return 0
-
-        return 1
-
-    # Allocate new image
-    # Ceil has to be used because if the kernel does not cover perfectly the image ones will be added to the
-    # original image to fit the kernel
-    reduced_image_shape = [math.ceil(dim / stride) for dim in image.shape]
-    reduced_image = np.zeros(reduced_image_shape, dtype=image.dtype)
-
-    for i in range(reduced_image_shape[0]):
-        for j in range(reduced_image_shape[1]):
-            reduced_value = compute_reduced_value(image, i, j, stride)
-            reduced_image[i][j] = reduced_value
+    # the roles of the pixels of each window as bits (or of the window), the blocked role is 0
+    blocked_bit = (ROLE_SEED | ROLE_PROPAGATE | ROLE_TARGET) + 1
+    reduced_rows, reduced_cols = math.ceil(n_rows / stride_rows), math.ceil(n_cols / stride_cols)
+    bits = np.zeros((*stack_shape, reduced_rows * stride_rows, reduced_cols * stride_cols), dtype=np.uint8)
+    bits[..., :n_rows, :n_cols] = np.where(roles == ROLE_BLOCKED, blocked_bit, np.maximum(roles, 0))
 
-    return reduced_image
+    windows = bits.reshape(*stack_shape, reduced_rows, stride_rows, reduced_cols, stride_cols)
+    window_bits = np.bitwise_or.reduce(np.bitwise_or.reduce(windows, axis=-1), axis=-2)
+    priorities = (ROLE_SEED, ROLE_BLOCKED, ROLE_PROPAGATE, ROLE_TARGET)
+    return np.select([window_bits & (blocked_bit if role == ROLE_BLOCKED else role) != 0 for role in priorities],
+                     priorities, _PADDING_ROLE).astype(roles.dtype)
 
 
 def _wave_propagation_interpolation(image: np.array, center_position: typing.Tuple[int, int], stride: int) -> None:
@@ -146,14 +326,93 @@ def _wave_propagation_interpolation(image: np.array, center_position: typing.Tup
     output_image = wave_propagation_dt_image(sub_image, seeds=seeds)
 
     # Update the input image saving the minimum between the current value and the new one for each pixel
-    for i in range(output_image.shape[0]):
-        for j in range(output_image.shape[1]):
-            original_x = i + left_x
-            original_y = j + left_y
-            if image[original_x][original_y] == -1:
-                image[original_x][original_y] = output_image[i][j]
-            else:
-                image[original_x][original_y] = min(image[original_x][original_y], output_image[i][j])
+    sub_image[...] = np.where(sub_image == -1, output_image, np.minimum(sub_image, output_image))
+
+
+def _interpolate_centers(image: np.array, stride: int) -> None:
+    """
+    Applies _wave_propagation_interpolation to all the centers (i * stride, j * stride) of the image at once.
+
+    Each pixel is in the windows (the squares of radius stride - 1) of the (up to) 4 centers at the corners of
+    its cell:
+    - a center with a positive value propagates its value plus the manhattan distance inside its window.
+      This is a closed form of the position of the pixel in its cell, computed for all the cells at once on the
+      (rows, stride, cols, stride) view of the image, without visiting the windows.
+    - the other centers (the cells with a seed) propagate the distance from the zeros of their window.
+      The windows are rectangles, so this is the manhattan distance from the zeros of the window, computed only for
+      the windows of these centers as a stack of images (see separable_dt) and scattered to their pixels.
+    The result is the minimum of the values of the centers, the same of calling _wave_propagation_interpolation
+    for each center. Only the pixels near a seed are refined with the windows, so the time is linear in the size of
+    the image with a small constant (a few vectorized passes) plus the size of the windows of the seeds.
+    """
+    n_rows, n_cols = image.shape
+    centers = image[::stride, ::stride].astype(np.int64)
+    n_center_rows, n_center_cols = centers.shape
+    radius = stride - 1
+    size = 2 * radius + 1
+
+    # the zeros of the window of each seeded center (the pixels out of the image are not zeros)
+    seeded_rows, seeded_cols = np.nonzero(centers <= 0)
+    window_rows = (seeded_rows * stride - radius)[:, None] + np.arange(size)
+    window_cols = (seeded_cols * stride - radius)[:, None] + np.arange(size)
+    valid_rows = (window_rows >= 0) & (window_rows < n_rows)
+    valid_cols = (window_cols >= 0) & (window_cols < n_cols)
+    windows = image[np.clip(window_rows, 0, n_rows - 1)[:, :, None], np.clip(window_cols, 0, n_cols - 1)[:, None, :]]
+    windows = (windows == 0) & valid_rows[:, :, None] & valid_cols[:, None, :]
+    if not np.all(np.any(windows, axis=(1, 2))):
+        # the propagation gives -1 to the window, the result depends on the order of the centers
+        for i, j in np.ndindex(*centers.shape):
+            _wave_propagation_interpolation(image, (i * stride, j * stride), stride)
+        return
+    windows_distances = _manhattan_rows(_column_distances(windows))
+
+    # the values already in the image out of the centers (the zeros), the centers are the values propagated below
+    off_center = image != -1
+    off_center[::stride, ::stride] = False
+    known_rows, known_cols = np.nonzero(off_center)
+    known_values = image[known_rows, known_cols]
+
+    # positive centers: the pixel (r, c) of the cell (i, j) is covered by the centers (i + di, j + dj), its offset
+    # from the center is r (di = 0) or stride - r (di = 1, only r > 0 is in the window), c for the columns.
+    # The best corner of each row of centers is computed for each column of pixels, then each row of pixels
+    # of the cells (a slice of the image) takes the best of the two rows of centers
+    # the values are computed in the image if its dtype is wide enough (a distance is smaller than the size of the
+    # image), in an int32 array otherwise
+    dtype = image.dtype if image.dtype in (np.int32, np.int64) else np.dtype(np.int32)
+    infinity = np.iinfo(np.int32).max // 4  # the sum of three is not an overflow
+    values = np.full((n_center_rows + 1, n_center_cols + 1), infinity, dtype=dtype)
+    values[:-1, :-1] = np.where(centers > 0, np.minimum(centers, infinity), infinity)
+    row_values = np.empty((n_center_rows + 1, n_cols), dtype=dtype)
+    for c in range(stride):
+        cell_cols = row_values[:, c::stride]
+        np.add(values[:, :cell_cols.shape[1]], c, out=cell_cols)
+        if c > 0:
+            np.minimum(cell_cols, values[:, 1:cell_cols.shape[1] + 1] + (stride - c), out=cell_cols)
+    propagated = image if image.dtype == dtype else np.empty(image.shape, dtype=dtype)
+    for r in range(stride):
+        cell_rows = propagated[r::stride]
+        np.add(row_values[:cell_rows.shape[0]], r, out=cell_rows)
+        if r > 0:
+            np.minimum(cell_rows, row_values[1:cell_rows.shape[0] + 1] + (stride - r), out=cell_rows)
+
+    # seeded centers: only the pixels of their windows
+    in_image = valid_rows[:, :, None] & valid_cols[:, None, :]
+    window_pixels = (np.broadcast_to(window_rows[:, :, None], in_image.shape)[in_image],
+                     np.broadcast_to(window_cols[:, None, :], in_image.shape)[in_image])
+    np.minimum.at(propagated, window_pixels, windows_distances[in_image].astype(dtype))
+
+    np.minimum.at(propagated, (known_rows, known_cols), np.minimum(known_values, infinity).astype(dtype))
+    if propagated is not image:
+        image[...] = propagated
+    # the pixels that are not in the window of a reached center, only the columns of the cells without a positive
+    # corner in the first row of centers can have one
+    unreached_rows, unreached_cols = np.nonzero(row_values[:-1] >= infinity)
+    unreached_rows = (unreached_rows[:, None] * stride + np.arange(stride)).ravel()
+    unreached_cols = np.repeat(unreached_cols, stride)
+    in_image = unreached_rows < n_rows
+    unreached_rows, unreached_cols = unreached_rows[in_image], unreached_cols[in_image]
+    unreached = propagated[unreached_rows, unreached_cols] >= infinity
+    image[unreached_rows[unreached], unreached_cols[unreached]] = -1
 
 
 def interpolate_dt_binary_image(dt_reduced_image: np.array, stride: int) -> np.array:
@@ -169,12 +428,7 @@ def interpolate_dt_binary_image(dt_reduced_image: np.array, stride: int) -> np.a
     """
 
     dt_original_image_shape = [dim * stride for dim in dt_reduced_image.shape]
-    dt_original_image = np.zeros(dt_original_image_shape, dtype=dt_reduced_image.dtype)
-
-    # Initialization
-    for i in range(dt_original_image.shape[0]):
-        for j in range(dt_original_image.shape[1]):
-            dt_original_image[i][j] = -1
+    dt_original_image = np.full(dt_original_image_shape, -1, dtype=dt_reduced_image.dtype)
 
     # 1) Fill original image with values obtained from the reduced one multiplied by stride
     #    The values will always be placed in the top left position
@@ -188,9 +442,7 @@ def interpolate_dt_binary_image(dt_reduced_image: np.array, stride: int) -> np.a
          2 ? 4 ?
          ? ? ? ?
     """
-    for i in range(dt_reduced_image.shape[0]):
-        for j in range(dt_reduced_image.shape[1]):
-            dt_original_image[i*stride][j*stride] = dt_reduced_image[i][j] * stride
+    dt_original_image[::stride, ::stride] = dt_reduced_image * stride
 
     # 2) Interpolate
     """
@@ -219,10 +471,7 @@ def interpolate_dt_binary_image(dt_reduced_image: np.array, stride: int) -> np.a
         A detailed explanations and more examples can be found in my notebook.
     """
 
-    for i in range(dt_reduced_image.shape[0]):
-        for j in range(dt_reduced_image.shape[1]):
-            original_image_center_position = (i * stride, j * stride)
-            _wave_propagation_interpolation(dt_original_image, original_image_center_position, stride)
+    _interpolate_centers(dt_original_image, stride)
 
     return dt_original_image
 
@@ -246,25 +495,46 @@ def improved_interpolate_dt_binary_image(original_image: np.array, dt_reduced_im
     stride = int(original_image.shape[0] / dt_reduced_image.shape[0])
 
     # Initialize to -1 except for background pixels
-    dt_interpolated_image = np.zeros(original_image.shape, dtype=dt_reduced_image.dtype)
-    for i in range(dt_interpolated_image.shape[0]):
-        for j in range(dt_interpolated_image.shape[1]):
-            if original_image[i][j] == 0:
-                dt_interpolated_image[i][j] = 0
-            else:
-                dt_interpolated_image[i][j] = -1
+    dt_interpolated_image = np.full(original_image.shape, -1, dtype=dt_reduced_image.dtype)
+    dt_interpolated_image[original_image == 0] = 0
 
     # Fill the interpolated image with values obtained from the reduced one (multiplied bu stride)
     # The background pixels will not be copied (the real background pixels have been copied from the original image)
-    for i in range(dt_reduced_image.shape[0]):
-        for j in range(dt_reduced_image.shape[1]):
-            if dt_reduced_image[i][j] != 0:
-                dt_interpolated_image[i * stride][j * stride] = dt_reduced_image[i][j] * stride
+    centers = dt_interpolated_image[::stride, ::stride]
+    centers[dt_reduced_image != 0] = dt_reduced_image[dt_reduced_image != 0] * stride
 
     # Interpolate
-    for i in range(dt_reduced_image.shape[0]):
-        for j in range(dt_reduced_image.shape[1]):
-            interpolated_image_center_position = (i * stride, j * stride)
-            _wave_propagation_interpolation(dt_interpolated_image, interpolated_image_center_position, stride)
+    _interpolate_centers(dt_interpolated_image, stride)
 
     return dt_interpolated_image
+
+
+def _upsample_centers(dt_reduced_image: np.array, stride: int, shape: typing.Tuple[int, int]) -> np.array:
+    """
+    The value of each pixel of an image of the given shape is the minimum of the values of the (up to) 4 reached
+    centers (i * stride, j * stride) whose window contains it: value * stride plus the manhattan distance from
+    the center (as the positive centers of _interpolate_centers).
+    dt_reduced_image can have more axes after the rows and the columns (the values are upsampled separately).
+
+    :return: int64 values with shape shape + dt_reduced_image.shape[2:], -1 for the pixels that are not in the
+             window of a reached center
+    """
+    n_rows, n_cols = shape
+    rows, cols = np.arange(n_rows), np.arange(n_cols)
+    extra_axes = (None,) * (dt_reduced_image.ndim - 2)
+
+    infinity = np.iinfo(np.int64).max // 4  # the sum of three is not an overflow
+    values = np.full((dt_reduced_image.shape[0] + 1, dt_reduced_image.shape[1] + 1, *dt_reduced_image.shape[2:]),
+                     infinity, dtype=np.int64)
+    values[:-1, :-1] = np.where(dt_reduced_image >= 0, dt_reduced_image.astype(np.int64) * stride, infinity)
+    upsampled = np.full((n_rows, n_cols, *dt_reduced_image.shape[2:]), infinity, dtype=np.int64)
+    for di in (0, 1):
+        row_offsets = np.abs(rows - (rows // stride + di) * stride)
+        row_offsets = np.where(row_offsets < stride, row_offsets, infinity)
+        for dj in (0, 1):
+            col_offsets = np.abs(cols - (cols // stride + dj) * stride)
+            col_offsets = np.where(col_offsets < stride, col_offsets, infinity)
+            corner_values = values[rows // stride + di][:, cols // stride + dj]
+            offsets = row_offsets[(slice(None), None, *extra_axes)] + col_offsets[(None, slice(None), *extra_axes)]
+            np.minimum(upsampled, corner_values + offsets, out=upsampled)
+    return np.where(upsampled < infinity, upsampled, -1)
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+"""
+Exact distance transforms of images computed separately on the columns and on the rows (linear time).
+
+1) For each pixel the distance to the closest seed in the same column is computed (g).
+2) For each row, the distance of the pixel x is min over the columns i of f(x, i) = distance(x - i, g[i]),
+   the lower envelope of the functions f(., i). For the manhattan distance f(x, i) = |x - i| + g[i] and the envelope
+   is computed with two cumulative minimums. For the chessboard and the euclidean distances the envelope is computed
+   with the algorithm of Meijster, Roerdink and Hesselink (a scan from left to right keeps the functions that are
+   part of the envelope and the points where they start, a scan from right to left evaluates the envelope).
+   All the rows are processed at once.
+"""
+
+METRICS = ("manhattan", "chessboard", "euclidean")
+
+
+def _column_distances(seeds: np.array) -> np.array:
+    """
+    Returns for each pixel the distance to the closest seed in the same column,
+    rows + cols (larger than any distance) if the column has no seeds.
+    The images are the last two axes (a stack of images can be passed).
+    """
+    n_rows, n_cols = seeds.shape[-2:]
+    rows = np.arange(n_rows)[:, None]
+    infinity = n_rows + n_cols
+
+    previous = np.maximum.accumulate(np.where(seeds, rows, -infinity), axis=-2)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(seeds, rows, 2 * infinity), axis=-2), axis=-2),
+                        axis=-2)
+    return np.minimum(np.minimum(rows - previous, following - rows), infinity)
+
+
+def _manhattan_rows(g: np.array) -> np.array:
+    """
+    min over i of |x - i| + g[i] for all the rows: (g[i] - i) + x for i <= x and (g[i] + i) - x for i >= x
+    The rows are on the last axis.
+    """
+    cols = np.arange(g.shape[-1])
+    left = np.minimum.accumulate(g - cols, axis=-1) + cols
+    right = np.flip(np.minimum.accumulate(np.flip(g + cols, axis=-1), axis=-1), axis=-1) - cols
+    return np.minimum(left, right)
+
+
+def _envelope_rows(g: np.array, metric: str) -> np.array:
+    """
+    min over i of f(x, i) for all the rows, where f is the chessboard or the squared euclidean distance
+    (Meijster's second phase, the stacks of all the rows are updated at once).
+    """
+    n_rows, n_cols = g.shape
+    rows = np.arange(n_rows)
+
+    if metric == "chessboard":
+        def f(x, i, g_i):
+            return np.maximum(np.abs(x - i), g_i)
+
+        def sep(i, u, g_i, g_u):
+            # first x where f(., u) <= f(., i) (i < u)
+            middle = (i + u) // 2
+            return np.where(g_i <= g_u, np.maximum(i + g_u, middle), np.minimum(u - g_i, middle))
+    else:
+        g = g * g
+
+        def f(x, i, g_i):
+            return (x - i) ** 2 + g_i
+
+        def sep(i, u, g_i, g_u):
+            return (u * u - i * i + g_u - g_i) // (2 * (u - i))
+
+    # s[r, :q + 1] are the functions of the envelope of the row r, t[r, k] is the first point of s[r, k]
+    s = np.zeros((n_rows, n_cols), dtype=np.int64)
+    t = np.zeros((n_rows, n_cols), dtype=np.int64)
+    q = np.zeros(n_rows, dtype=np.int64)
+    for u in range(1, n_cols):
+        g_u = g[:, u]
+        # remove the functions that are above f(., u) at their first point
+        active = rows
+        while active.size > 0:
+            top = s[active, q[active]]
+            above = f(t[active, q[active]], top, g[active, top]) > f(t[active, q[active]], u, g_u[active])
+            active = active[above]
+            q[active] -= 1
+            active = active[q[active] >= 0]
+
+        empty = q < 0
+        q[empty] = 0
+        s[empty, 0] = u
+
+        top = s[~empty, q[~empty]]
+        w = 1 + sep(top, u, g[~empty, top], g_u[~empty])
+        push = np.flatnonzero(~empty)[w < n_cols]
+        w = w[w < n_cols]
+        q[push] += 1
+        s[push, q[push]] = u
+        t[push, q[push]] = w
+
+    distances = np.empty((n_rows, n_cols), dtype=np.int64)
+    for u in range(n_cols - 1, -1, -1):
+        top = s[rows, q]
+        distances[:, u] = f(u, top, g[rows, top])
+        q -= u == t[rows, q]
+    return distances
+
+
+def separable_dt_binary_image(image: np.array, metric: str = "manhattan") -> np.array:
+    """
+    Exact distance transform of an image: the distance of each pixel to the closest pixel equal to 0.
+
+    metric: "manhattan" (the same result of wave_propagation_dt_image, the 4-neighborhood), "chessboard"
+            (8-neighborhood) or "euclidean"
+    :return: int64 distances for the manhattan and the chessboard distances, float64 for the euclidean distance.
+             -1 for all the pixels if the image has no zeroes.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}, it has to be one of {METRICS}")
+
+    seeds = np.asarray(image) == 0
+    if not np.any(seeds):
+        return np.full(seeds.shape, -1, dtype=np.float64 if metric == "euclidean" else np.int64)
+
+    if metric == "manhattan":
+        return _manhattan_rows(_column_distances(seeds))
+
+    # the envelope needs one iteration for each column, so the longer side is on the rows
+    transpose = seeds.shape[1] > seeds.shape[0]
+    distances = _envelope_rows(_column_distances(seeds.T if transpose else seeds), metric)
+    if transpose:
+        distances = distances.T
+    if metric == "euclidean":
+        return np.sqrt(distances)
+    return distances
@@ -1,79 +1,115 @@
 import typing
-from queue import Queue
 import numpy as np
-import time
+
+from combinatorial.gmaps import ROLE_BLOCKED, ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET
+from distance_transform.separable_dt import separable_dt_binary_image
 
 
 def generalized_wave_propagation_image(image: np.array, seed_labels: typing.List[int],
-                                       propagation_labels: typing.List[int], target_labels: typing.List[int]) -> np.array:
-    # int64 should be sufficient
-    output_image = np.zeros(image.shape, np.int64)
-    output_image.fill(-1)  # initialize output_image
+                                       propagation_labels: typing.List[int], target_labels: typing.List[int],
+                                       max_distance: int = None, stop_when_targets_reached: bool = False) -> np.array:
+    """
+    If all the pixels that are not seeds have a propagation label, the distance is the manhattan distance
+    from the closest seed (see separable_dt_binary_image), otherwise the wave is propagated level by level
+    (see _frontier_wave_propagation_image).
+
+    max_distance: if not None, the pixels farther than max_distance are not reached (-1)
+    stop_when_targets_reached: if True, the propagation stops when all the pixels with a target label
+                               are reached, the pixels farther than the farthest target are not reached (-1)
+    The propagation is level by level if one of them is used (it stops early).
+    """
+    seeds = np.isin(image, seed_labels)
 
-    queue = Queue()
+    bounded = max_distance is not None or stop_when_targets_reached
+    if not bounded and np.all(seeds | np.isin(image, propagation_labels)):
+        return separable_dt_binary_image(~seeds)
 
-    #
-    admissible_labels = propagation_labels + target_labels
+    # int64 should be sufficient
+    output_image = np.full(image.size, -1, dtype=np.int64)
+    seeds = np.flatnonzero(seeds)
+    output_image[seeds] = 0
 
-    # Find seeds and add to queue
-    for i in range(image.shape[0]):
-        for j in range(image.shape[1]):
-            if image[i][j] in seed_labels:
-                queue.put((i, j))
-                output_image[i][j] = 0
+    propagates = np.isin(image, propagation_labels).ravel()
+    targets = np.isin(image, target_labels).ravel()
+    admissible = propagates | targets
+    _frontier_wave_propagation_image(output_image, image.shape, admissible, propagates, seeds, max_distance,
+                                     np.flatnonzero(targets) if stop_when_targets_reached else None)
 
-    while not queue.empty():
-        pixel = queue.get()
-        # Visit all the neighbours
-        for i in range(4):
-            neighbour = get_next_neighbour_image(i, pixel[0], pixel[1], image.shape[0] - 1, image.shape[1] - 1)
-            if neighbour is not None and image[neighbour[0]][neighbour[1]] in admissible_labels and\
-                    output_image[neighbour[0], neighbour[1]] == -1:
-                output_image[neighbour[0], neighbour[1]] = output_image[pixel[0], pixel[1]] + 1
-                if image[neighbour[0]][neighbour[1]] in propagation_labels:
-                    queue.put(neighbour)
+    return output_image.reshape(image.shape)
 
-    return output_image
-    
 
-def wave_propagation_dt_image(image: np.array, seeds: typing.List[typing.Tuple[int, int]] = None) -> np.array:
+def wave_propagation_dt_image(image: np.array, seeds: typing.List[typing.Tuple[int, int]] = None,
+                              max_distance: int = None) -> np.array:
     """
     4-neighborhood connection
 
     :param image:
     :param seeds: A list of seeds (x, y). If None, all values equal to 0 in the image will be used as seeds
+    :param max_distance: if not None, the pixels with a value greater than max_distance are not reached (-1)
     :return:
     """
+    if seeds is None and max_distance is None:
+        # the distance from the closest zero
+        return separable_dt_binary_image(image).astype(image.dtype)
 
-    output_image = np.zeros(image.shape, image.dtype)
-    # initialize output_image
-    for i in range(output_image.shape[0]):
-        for j in range(output_image.shape[1]):
-            output_image[i][j] = -1
-
-    queue = Queue()
+    output_image = np.full(image.size, -1, dtype=np.int64)
     if seeds is None:
-        # find seeds and add to queue
-        for i in range(image.shape[0]):
-            for j in range(image.shape[1]):
-                if image[i][j] == 0:
-                    queue.put((i, j))
-                    output_image[i][j] = 0
+        seeds = np.flatnonzero(np.ravel(image) == 0)
     else:
-        for seed in seeds:
-            output_image[seed[0]][seed[1]] = image[seed[0]][seed[1]]
-            queue.put(seed)
+        seeds = np.ravel_multi_index(tuple(np.array(seeds, dtype=np.int64).reshape(-1, 2).T), image.shape)
+    output_image[seeds] = image.ravel()[seeds]
 
-    while not queue.empty():
-        pixel = queue.get()
-        # Visit all the neighbours
-        for i in range(4):
-            neighbour = get_next_neighbour_image(i, pixel[0], pixel[1], image.shape[0] - 1, image.shape[1] - 1)
-            if neighbour is not None and output_image[neighbour[0], neighbour[1]] == -1:
-                output_image[neighbour[0], neighbour[1]] = output_image[pixel[0], pixel[1]] + 1
-                queue.put(neighbour)
+    admissible = np.ones(image.size, dtype=bool)
+    _frontier_wave_propagation_image(output_image, image.shape, admissible, admissible, seeds, max_distance)
 
-    return output_image
+    return output_image.reshape(image.shape).astype(image.dtype)
+
+
+def _frontier_wave_propagation_image(output_image: np.array, shape: typing.Tuple[int, int], admissible: np.array,
+                                     propagates: np.array, seeds: np.array, max_distance: int = None,
+                                     targets: np.array = None) -> None:
+    """
+    Breadth first propagation on the 4-neighborhood, one level at a time (all the pixels of a level at once).
+
+    The result is the same of a queue: a pixel takes the value + 1 of the first pixel of the previous level
+    (in the order of the level) that finds it, the neighbours are visited as in get_next_neighbour_image.
+    output_image, admissible and propagates are flat, the seeds are flat indices (in the order of the queue).
+
+    max_distance: the values greater than max_distance are not propagated
+    targets: if not None, the propagation stops when all the targets (flat indices) have a value,
+             the values greater than the largest value of a target are not propagated
+    """
+    n_rows, n_cols = shape
+    # left, up, right, down
+    offsets = np.array([-1, -n_cols, 1, n_cols])
+    unreached_targets = targets
+
+    level = seeds
+    while level.size > 0:
+        if unreached_targets is not None:
+            unreached_targets = unreached_targets[output_image[unreached_targets] == -1]
+            if unreached_targets.size == 0:
+                bound = int(output_image[targets].max()) if targets.size > 0 else 0
+                max_distance = bound if max_distance is None else min(max_distance, bound)
+                unreached_targets = None
+        if max_distance is not None:
+            level = level[output_image[level] < max_distance]
+
+        rows, cols = level // n_cols, level % n_cols
+        inside = np.stack([cols > 0, rows > 0, cols < n_cols - 1, rows < n_rows - 1], axis=1).ravel()
+        neighbours = (level[:, None] + offsets).ravel()
+        sources = np.repeat(level, 4)
+        neighbours, sources = neighbours[inside], sources[inside]
+
+        found = admissible[neighbours] & (output_image[neighbours] == -1)
+        neighbours, sources = neighbours[found], sources[found]
+        # the first source of each neighbour
+        _, first = np.unique(neighbours, return_index=True)
+        first.sort()
+        neighbours, sources = neighbours[first], sources[first]
+
+        output_image[neighbours] = output_image[sources] + 1
+        level = neighbours[propagates[neighbours]]
 
 
 def get_next_neighbour_image(index: int, x: int, y: int, max_x: int, max_y: int) -> (int, int):
@@ -112,102 +148,317 @@ def get_next_neighbour_image(index: int, x: int, y: int, max_x: int, max_y: int)
         raise Exception(f"Unexpected index {index}")
 
 
+def build_quotient_graph(gmap, i: int) -> typing.Tuple[np.array, np.array, np.array, np.array]:
+    """
+    Builds the quotient graph of the gmap for the dimension i.
+    The nodes are the i-cells (numbered as in gmap.cell_ids(i)), two i-cells are connected if alpha_i links
+    a dart of the first one to a dart of the second one (the other involutions do not leave the i-cell).
+
+    Returns (cell_ids, representatives, offsets, neighbours):
+        cell_ids        ... node of each dart (-1 for removed darts)
+        representatives ... smallest dart of each node
+        offsets         ... the neighbours of the node c are neighbours[offsets[c]:offsets[c+1]] (sorted)
+    """
+    cell_ids = gmap.cell_ids(i)
+    representatives = gmap.darts_of_i_cells(i)
+    n_nodes = representatives.size
+
+    darts = gmap.darts
+    sources = cell_ids[darts].astype(np.int64)
+    destinations = cell_ids[np.asarray(gmap)[i, darts]].astype(np.int64)
+    different = sources != destinations
+    edges = np.unique(sources[different] * n_nodes + destinations[different])  # sorted by source
+
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges // n_nodes, minlength=n_nodes), out=offsets[1:])
+    return cell_ids, representatives, offsets, edges % n_nodes
+
+
+def quotient_wave_propagation_gmap(gmap, i: int, seed_labels: typing.List[int], propagation_labels: typing.List[int],
+                                   target_labels: typing.List[int] = (),
+                                   quotient_graph: typing.Optional[typing.Tuple] = None,
+                                   max_distance: int = None, stop_when_targets_reached: bool = False) -> None:
+    """
+    It computes the dt propagating the distance between i-cells instead of darts.
+    The distance is increased passing from an i-cell to another one (through alpha_i), so the distances are the ones of
+    generalized_wave_propagation_gmap with accumulation directions [j == i for j in 0..n]
+    (example, i = 0 for generate_accumulation_directions_vertex and i = n for generate_accumulation_directions_cell).
+    On reduced maps the dart wave propagation can leave a greater distance to some darts of a face (a dart whose
+    distance decreases after its level does not propagate the decrease), the distances computed here are the smaller
+    exact ones.
+    The distances and the connected_component_labels of the closest seed are then copied to all the darts
+    of each i-cell that propagates the distance (seeds and propagation labels).
+
+    The darts of an i-cell that is only a target do not propagate the distance to each other, so each one of them
+    takes the distance (plus one) and the label of the i-cell linked to it by alpha_i, as in the dart wave propagation.
+
+    The labels have to be uniform inside each i-cell (ValueError otherwise), the role of an i-cell is the role
+    of its darts. The faces of a LabelMap are uniform, for the vertices uniform_labels_for_vertices can be used.
+    The label of a propagating i-cell is the one of the first seed that reaches it, while the dart wave propagation
+    can give different labels (at the same distance) to the darts of an i-cell reached from different seeds.
+
+    quotient_graph: the result of build_quotient_graph(gmap, i), it can be passed to reuse it for several queries
+    (it is valid until the gmap is modified).
+    max_distance, stop_when_targets_reached: see generalized_wave_propagation_gmap
+    """
+    if quotient_graph is None:
+        quotient_graph = build_quotient_graph(gmap, i)
+    cell_ids, representatives, offsets, neighbours = quotient_graph
+
+    darts = gmap.darts
+    dart_nodes = cell_ids[darts]
+    dart_roles = gmap.dart_roles(seed_labels, propagation_labels, target_labels)
+    roles = dart_roles[representatives]
+    if not np.array_equal(dart_roles[darts], roles[dart_nodes]):
+        raise ValueError(f"The labels are not uniform inside the {i}-cells")
+    dt_labels = gmap.dt_connected_components_labels
+    node_distances = np.full(representatives.size, -1, dtype=np.int64)
+    node_labels = np.zeros(representatives.size, dtype=dt_labels.dtype)
+
+    # Initialize distance to 0 for seeds
+    seeds = np.unique(cell_ids[gmap.label_darts(seed_labels)])
+    node_distances[seeds] = 0
+    node_labels[seeds] = gmap.connected_components_labels[representatives[seeds]]
+
+    # each target dart takes the distance of the node that reaches it (plus the offset): its own node if it propagates
+    # the distance, otherwise the node linked to it by alpha_i (if it propagates the distance)
+    target_darts = gmap.label_darts(target_labels)
+    target_nodes = cell_ids[target_darts]
+    alpha_nodes = cell_ids[np.asarray(gmap)[i, target_darts]]
+    propagates = roles & (ROLE_SEED | ROLE_PROPAGATE) != 0
+    only_target = ~propagates[target_nodes]
+    reaching_nodes = np.where(only_target, alpha_nodes, target_nodes)
+    reaching_offsets = only_target.astype(np.int64)
+    reachable = ~only_target | ((alpha_nodes != target_nodes) & propagates[alpha_nodes])
+
+    # target darts, until they are all reached (never if one of them cannot be reached)
+    unreached_targets = None
+    if stop_when_targets_reached and np.all(reachable):
+        unreached_targets = np.arange(target_darts.size)
+
+    # level by level, the label is taken from the first node that reaches a node
+    frontier = seeds
+    distance = 0
+    while frontier.size > 0:
+        if unreached_targets is not None:
+            unreached_targets = unreached_targets[node_distances[reaching_nodes[unreached_targets]] == -1]
+            if unreached_targets.size == 0:
+                # the levels are exact, the distances of the reaching nodes cannot change anymore
+                bound = int((node_distances[reaching_nodes] + reaching_offsets).max()) if target_darts.size else 0
+                max_distance = bound if max_distance is None else min(max_distance, bound)
+                unreached_targets = None
+        if max_distance is not None and distance >= max_distance:
+            break
+
+        counts = offsets[frontier + 1] - offsets[frontier]
+        sources = np.repeat(frontier, counts)
+        candidates = neighbours[np.repeat(offsets[frontier] - np.cumsum(counts) + counts, counts)
+                                + np.arange(counts.sum())]
+
+        keep = (roles[candidates] & (ROLE_PROPAGATE | ROLE_TARGET) != 0) & (node_distances[candidates] == -1)
+        candidates, sources = candidates[keep], sources[keep]
+        _, first = np.unique(candidates, return_index=True)
+        first.sort()
+        found = candidates[first]
+
+        distance += 1
+        node_distances[found] = distance
+        node_labels[found] = node_labels[sources[first]]
+        frontier = found[roles[found] & ROLE_PROPAGATE != 0]
+
+    # copy the values to the darts
+    distances = node_distances[dart_nodes]
+    labels = node_labels[dart_nodes]
+    if target_darts.size:
+        target_positions = np.searchsorted(darts, target_darts)
+        target_distances = node_distances[reaching_nodes]
+        reached_targets = reachable & (target_distances != -1)
+        distances[target_positions] = np.where(reached_targets, target_distances + reaching_offsets, -1)
+        labels[target_positions] = node_labels[reaching_nodes]
+    if max_distance is not None:
+        distances[distances > max_distance] = -1
+    gmap.distances[darts] = distances
+    reached = distances != -1
+    dt_labels[darts[reached]] = labels[reached]
+
+
 def improved_wave_propagation_gmap_vertex(gmap, seed_labels: typing.List[int], propagation_labels: typing.List[int]) -> None:
     """
-    It computes only dt, without saving information for the generation of voronoi diagram
-
-    I add to the queue only one dart per vertex.
-
-    It does not work with voronoi diagram righ now.
-    gmap.dt_connected_components_labels[dart] = gmap.connected_components_labels[dart]
-    """
-
-    total_start = time.time()
-    # print(f"n_darts: {gmap.n_darts}")
-
-    def _get_neighbours_vertices(gmap, dart):
-        yield gmap.a0(dart)
-        yield gmap.a0(gmap.a1(dart))
-        yield gmap.a0(gmap.a1(gmap.a2(dart)))
-        yield gmap.a0(gmap.a1(gmap.a2(gmap.a1(dart))))
-
-    def _set_distance_vertex(gmap, dart, distance):
-        gmap.distances[dart] = distance
-        gmap.distances[gmap.a1(dart)] = distance
-        gmap.distances[gmap.a2(dart)] = distance
-        gmap.distances[gmap.a2(gmap.a1(dart))] = distance
-        gmap.distances[gmap.a1(gmap.a2(dart))] = distance
-        gmap.distances[gmap.a2(gmap.a1(gmap.a2(dart)))] = distance
-        gmap.distances[gmap.a1(gmap.a2(gmap.a1(dart)))] = distance
-        gmap.distances[gmap.a2(gmap.a1(gmap.a2(gmap.a1(dart))))] = distance
-
-    def _init_seed_darts(gmap, wave_propagation_queue):
-        """
-        Return a dart for each vertex
-        """
-        queue = Queue()
-
-        dart = next(gmap.darts)
-        _set_distance_vertex(gmap, dart, -1)  # I am using -1 to indicate that has been visited
-        queue.put(dart)
-
-        while not queue.empty():
-            dart = queue.get()
-
-            if gmap.image_labels[dart] in seed_labels and gmap.distances[neighbour] != 0:
-                wave_propagation_queue.put(dart)
-                _set_distance_vertex(gmap, dart, 0)
-
-            # Visit all the neighbouring vertices
-            for neighbour in _get_neighbours_vertices(gmap, dart):
-                if gmap.distances[neighbour] == -2:
-                    queue.put(neighbour)
-                    _set_distance_vertex(gmap, neighbour, -1)
-
-    # Initialization
-    start = time.time()
-    gmap.distances.fill(-2)
-    end = time.time()
-    print(f"time required init to -1: {end - start}")
-
-    start = time.time()
-    queue = Queue()
-    _init_seed_darts(gmap, queue)
-    end = time.time()
-    print(f"time required init seed darts: {end - start}")
-
-    start = time.time()
-    while not queue.empty():
-        dart = queue.get()
-        # Visit all the neighbouring vertices
-        for neighbour in _get_neighbours_vertices(gmap, dart):
-            # Check if I can propagate to that dart
-            if gmap.image_labels[neighbour] not in propagation_labels:
+    It computes the dt propagating the distance between vertices (one node for each vertex),
+    see quotient_wave_propagation_gmap.
+
+    The labels have to be uniform for the darts of each vertex (see uniform_labels_for_vertices),
+    a ValueError is raised otherwise.
+    """
+    quotient_wave_propagation_gmap(gmap, 0, seed_labels, propagation_labels)
+
+
+def _propagate_batch_sequentially(alphas: np.array, distances: np.array, labels: typing.Optional[np.array],
+                                  batch: np.array, steps: np.array, roles: np.array) -> (np.array, np.array):
+    """
+    Processes the darts of the batch one at a time, in order.
+
+    It is used only when the darts of the batch depend on each other (see _propagate_batch).
+    Returns the darts to add to the current level and to the next level, in the order in which they are found.
+    """
+    curr_level, next_level = [], []
+    for dart in batch:
+        for i in range(steps.size):
+            neighbour = alphas[i, dart]
+            if not roles[neighbour] & (ROLE_PROPAGATE | ROLE_TARGET):
                 continue
+            if distances[neighbour] == -1 and roles[neighbour] & ROLE_PROPAGATE:
+                (next_level if steps[i] else curr_level).append(neighbour)
+            if distances[neighbour] == -1 or distances[dart] + steps[i] < distances[neighbour]:
+                distances[neighbour] = distances[dart] + steps[i]
+                if labels is not None:
+                    labels[neighbour] = labels[dart]
+    return np.array(curr_level, dtype=np.int64), np.array(next_level, dtype=np.int64)
 
-            if gmap.distances[neighbour] == -1:
-                # put to the same distance to all the darts of the vertex
-                _set_distance_vertex(gmap, neighbour, gmap.distances[dart] + 1)
-                queue.put(neighbour)
-    end = time.time()
-    print(f"Time required queue: {end - start}")
-    total_end = time.time()
-    print(f"Total time: {total_end - total_start}")
+
+def _propagate_batch(alphas: np.array, distances: np.array, labels: typing.Optional[np.array],
+                     batch: np.array, steps: np.array, roles: np.array) -> (np.array, np.array):
+    """
+    Processes all the darts of the batch at once.
+
+    The result is the same of processing the darts one at a time, in order, visiting the involutions from 0 to n:
+    - the distance of a neighbour is the smallest value proposed by the darts of the batch (or the previous one,
+      if it is smaller or equal). The label is taken from the first dart that proposed that value.
+    - a neighbour is added to a level the first time it is found, to the current level if the direction does not
+      increase the distance, to the next level otherwise.
+    The distances of the darts of the batch are read before the updates. If a dart of the batch is improved by a
+    previous dart of the batch, the batch is split before it and the remaining part is processed afterwards.
+
+    Returns the darts to add to the current level and to the next level, in the order in which they are found.
+    """
+    n_involutions = steps.size
+    curr_level, next_level = [], []
+    while batch.size > 0:
+        # candidates in the order of the sequential visit (dart by dart, involution by involution)
+        neighbours = alphas[:, batch].T.ravel()
+        keep = np.flatnonzero(roles[neighbours] & (ROLE_PROPAGATE | ROLE_TARGET))
+        neighbours = neighbours[keep]
+        source_positions = keep // n_involutions
+        candidate_steps = steps[keep % n_involutions]
+        values = distances[batch[source_positions]].astype(np.int64) + candidate_steps
+        previous = distances[neighbours]
+
+        # First dart of the batch improved by a previous dart of the batch
+        split = batch.size
+        improved = np.flatnonzero((previous != -1) & (values < previous))
+        if improved.size > 0:
+            sorter = np.argsort(batch, kind="stable")
+            positions = sorter[np.minimum(np.searchsorted(batch, neighbours[improved], sorter=sorter),
+                                          batch.size - 1)]
+            dependent = (batch[positions] == neighbours[improved]) & (positions > source_positions[improved])
+            if np.any(dependent):
+                if np.unique(batch).size < batch.size:
+                    # repeated darts (seeds passed by the user)
+                    found = _propagate_batch_sequentially(alphas, distances, labels, batch, steps, roles)
+                    curr_level.append(found[0])
+                    next_level.append(found[1])
+                    break
+                split = positions[dependent].min()
+                head = source_positions < split
+                neighbours, source_positions = neighbours[head], source_positions[head]
+                candidate_steps, values, previous = candidate_steps[head], values[head], previous[head]
+
+        # For each neighbour, the first candidate with the smallest value (lexsort is stable)
+        order = np.lexsort((values, neighbours))
+        sorted_neighbours = neighbours[order]
+        starts = np.flatnonzero(np.r_[True, sorted_neighbours[1:] != sorted_neighbours[:-1]])
+        best = order[starts]
+        targets = neighbours[best]
+        # For each neighbour, the first candidate (the one that finds it)
+        _, first = np.unique(neighbours, return_index=True)
+
+        best_previous = previous[best]
+        update = (best_previous == -1) | (values[best] < best_previous)
+        distances[targets[update]] = values[best][update]
+        if labels is not None:
+            labels[targets[update]] = labels[batch[source_positions[best[update]]]]
+
+        found = np.sort(first[(best_previous == -1) & (roles[targets] & ROLE_PROPAGATE != 0)])
+        found_steps = candidate_steps[found]
+        curr_level.append(neighbours[found[found_steps == 0]])
+        next_level.append(neighbours[found[found_steps != 0]])
+
+        batch = batch[split:]
+
+    if len(curr_level) == 1:
+        return curr_level[0], next_level[0]
+    return np.concatenate(curr_level), np.concatenate(next_level)
+
+
+def _level_synchronous_propagation(gmap, seeds: np.array, accumulation_directions: typing.List[bool],
+                                   roles: np.array, labels: typing.Optional[np.array] = None,
+                                   max_distance: int = None, targets: np.array = None) -> None:
+    """
+    Wave propagation from the seeds (their distance has to be already set), level by level.
+
+    Each level is a sequence of batches of darts (int arrays): the first batch is the level found by the previous one,
+    the following batches contain the darts found through directions that do not increase the distance.
+    All the neighbours of a batch are gathered with fancy indexing and filtered with boolean masks.
+
+    roles: role of each dart (see nGmap.dart_roles). The distance propagates to the darts with role ROLE_PROPAGATE
+           or ROLE_TARGET, and then from the darts with role ROLE_PROPAGATE
+    labels: if not None, the label of the dart that propagated the distance is propagated too
+    max_distance: if not None, the darts with a greater distance are marked as not reached (-1).
+                  The distance of a dart can still decrease after its level (the directions that do not increase
+                  the distance), so the propagation stops only when no dart of the level can propose a distance
+                  not greater than max_distance. The distances not greater than max_distance are the unbounded ones.
+    targets: if not None, when all the targets have a distance max_distance is reduced to the largest one
+    """
+    alphas = np.asarray(gmap)
+    distances = gmap.distances
+    steps = np.array([1 if accumulate else 0 for accumulate in accumulation_directions], dtype=np.int64)
+    # the last level finds darts at the same distance only through the directions that do not increase it
+    last_level_offset = 0 if np.any(steps == 0) else 1
+    unreached_targets = targets
+
+    level = np.asarray(seeds, dtype=np.int64)
+    targets_reached = False
+    # the distances only decrease and a dart proposes its distance (plus the step) only when its level is processed,
+    # so when no dart of the level has a distance that can propose a value not greater than max_distance,
+    # the darts with a distance not greater than max_distance cannot change anymore
+    while level.size > 0 and (max_distance is None or np.any(distances[level] + last_level_offset <= max_distance)):
+        next_level = []
+        batch = level
+        while batch.size > 0:
+            batch, found = _propagate_batch(alphas, distances, labels, batch, steps, roles)
+            next_level.append(found)
+        level = np.concatenate(next_level)
+
+        if unreached_targets is not None:
+            unreached_targets = unreached_targets[distances[unreached_targets] == -1]
+            if unreached_targets.size == 0:
+                bound = int(distances[targets].max()) if targets.size > 0 else 0
+                max_distance = bound if max_distance is None else min(max_distance, bound)
+                unreached_targets = None
+                targets_reached = True
+
+    if targets_reached and targets.size > 0:
+        # the distances of the targets may have decreased after they have been reached
+        max_distance = min(max_distance, int(distances[targets].max()))
+    if max_distance is not None:
+        darts = gmap.darts
+        distances[darts[distances[darts] > max_distance]] = -1
 
 
 def generalized_wave_propagation_gmap(gmap, seed_labels: typing.List[int], propagation_labels: typing.List[int],
-                                      target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None) -> None:
+                                      target_labels: typing.List[int], accumulation_directions: typing.List[bool] = None,
+                                      max_distance: int = None, stop_when_targets_reached: bool = False) -> None:
     """
     It also saves for each dart the connected_component_label of the closest seed.
     It is useful for the generation of voronoi diagrams.
+
+    max_distance: if not None, the propagation stops at max_distance, the farther darts are not reached (-1)
+    stop_when_targets_reached: if True, the propagation stops when all the darts with a target label are reached,
+                               the darts farther than the farthest target are not reached (-1)
     """
 
-    # Initialization
-    # gmap.distances.fill(-1)  Not super good, it iterates through the whole array even for deleted darts
-    for dart in gmap.darts:
-        gmap.distances[dart] = -1
-    #
-    admissible_labels = propagation_labels + target_labels
+    # Initialization (only the alive darts)
+    gmap.distances[gmap.darts] = -1
 
     # Initialize accumulation directions if None
     if accumulation_directions is None:
@@ -215,49 +466,153 @@ def generalized_wave_propagation_gmap(gmap, seed_labels: typing.List[int], propa
         for i in range(gmap.n + 1):
             accumulation_directions.append(True)
 
-    # Initialize distance to 0 for seeds and add the seeds to the queue
-    curr_queue = Queue()
-    next_queue = Queue()
-    for dart in gmap.darts:
-        if gmap.image_labels[dart] in seed_labels:
-            curr_queue.put(dart)
-            gmap.distances[dart] = 0
-            gmap.dt_connected_components_labels[dart] = gmap.connected_components_labels[dart]
-
-    while not curr_queue.empty():
-        while not curr_queue.empty():
-            dart = curr_queue.get()
-            # Visit all the neighbours
-            for i in range(gmap.n + 1):
-                neighbour = gmap.ai(i, dart)
-                # Check if I can propagate to that dart
-                if gmap.image_labels[neighbour] not in admissible_labels:
-                    continue
-
-                # Due to the accumulation policies, it happens that the first distance value associated to a neighbour
-                # could not be the right one. All the values have to be checked. View example on joplin (01/11/2021)
-                # I don't remember exactly what this part do. I have to check again.
-                if accumulation_directions[i]:
-                    if gmap.distances[neighbour] == -1:
-                        if gmap.image_labels[neighbour] in propagation_labels:
-                            next_queue.put(neighbour)
-                    if gmap.distances[neighbour] == -1 \
-                            or gmap.distances[dart] + 1 < gmap.distances[neighbour]:
-                        gmap.distances[neighbour] = gmap.distances[dart] + 1
-                        gmap.dt_connected_components_labels[neighbour] = gmap.dt_connected_components_labels[dart]
-                else:
-                    if gmap.distances[neighbour] == -1:
-                        if gmap.image_labels[neighbour] in propagation_labels:
-                            curr_queue.put(neighbour)
-                    if gmap.distances[neighbour] == -1 \
-                            or gmap.distances[dart] < gmap.distances[neighbour]:
-                        gmap.distances[neighbour] = gmap.distances[dart]
-                        gmap.dt_connected_components_labels[neighbour] = gmap.dt_connected_components_labels[dart]
-        curr_queue = next_queue
-        next_queue = Queue()
-
-
-def wave_propagation_dt_gmap(gmap, seeds_identifiers: typing.Optional[typing.List[int]], accumulation_directions: typing.List[bool] = None) -> None:
+    # Initialize distance to 0 for seeds
+    seeds = gmap.label_darts(seed_labels)
+    gmap.distances[seeds] = 0
+    gmap.dt_connected_components_labels[seeds] = gmap.connected_components_labels[seeds]
+
+    _level_synchronous_propagation(gmap, seeds, accumulation_directions,
+                                   roles=gmap.dart_roles(seed_labels, propagation_labels, target_labels),
+                                   labels=gmap.dt_connected_components_labels, max_distance=max_distance,
+                                   targets=gmap.label_darts(target_labels) if stop_when_targets_reached else None)
+
+
+def seed_sets_by_connected_component(gmap, seed_labels: typing.List[int]) -> (np.array, typing.List[np.array]):
+    """
+    Groups the darts with a label in seed_labels by connected_component_label,
+    to compute the dt from one connected component at a time (see multi_query_wave_propagation_gmap).
+
+    Returns (connected_components_labels, seed_sets), seed_sets[q] are the darts of connected_components_labels[q].
+    """
+    seeds = gmap.label_darts(seed_labels)
+    components = gmap.connected_components_labels[seeds]
+    order = np.argsort(components, kind="stable")
+    components_labels, starts = np.unique(components[order], return_index=True)
+    return components_labels, np.split(seeds[order], starts[1:])
+
+
+def _propagate_query_bits(alphas: np.array, visited: np.array, admissible: np.array, frontier: np.array,
+                          bits: np.array, involutions: np.array) -> (np.array, np.array):
+    """
+    One step of the multi-query wave propagation: the bits of the frontier darts are sent through the involutions.
+
+    Returns the darts reached for the first time by at least one query and their new bits (the queries that
+    reach them), the visited bits are updated.
+    """
+    neighbours = alphas[involutions][:, frontier].ravel()
+    sent = np.tile(bits, involutions.size)
+    keep = admissible[neighbours]
+    neighbours, sent = neighbours[keep], sent[keep] & ~visited[neighbours[keep]]
+    keep = sent != 0
+    neighbours, sent = neighbours[keep], sent[keep]
+    if neighbours.size == 0:
+        return neighbours, sent
+
+    # OR of the bits received by each neighbour
+    order = np.argsort(neighbours, kind="stable")
+    neighbours, sent = neighbours[order], sent[order]
+    starts = np.flatnonzero(np.r_[True, neighbours[1:] != neighbours[:-1]])
+    found, found_bits = neighbours[starts], np.bitwise_or.reduceat(sent, starts)
+    visited[found] |= found_bits
+    return found, found_bits
+
+
+def _save_query_distances(distances: np.array, first_query: int, darts: np.array, bits: np.array,
+                          distance: int) -> None:
+    """Sets the distance of the darts for the queries of their bits (bit q is the query first_query + q)"""
+    while darts.size > 0:
+        # one bit at a time for each dart, from the lowest one
+        lowest = bits & (~bits + np.uint64(1))
+        distances[first_query + np.log2(lowest).astype(np.int64), darts] = distance
+        bits = bits ^ lowest
+        keep = bits != 0
+        darts, bits = darts[keep], bits[keep]
+
+
+def multi_query_wave_propagation_gmap(gmap, seed_sets: typing.List[typing.Iterable[int]],
+                                      propagation_labels: typing.List[int], target_labels: typing.List[int],
+                                      accumulation_directions: typing.List[bool] = None,
+                                      max_distance: int = None, stop_when_targets_reached: bool = False) -> np.array:
+    """
+    It computes the dt of several queries that differ only for the seeds, in one traversal.
+
+    The query q has the darts of seed_sets[q] as seeds (see seed_sets_by_connected_component),
+    the distance propagates to the darts with a label in propagation_labels or target_labels
+    and then from the seeds and the darts with a label in propagation_labels.
+    The queries are processed in groups of 64: each dart has a uint64 with a bit for each query
+    (the queries that have reached it) and the wavefronts of all the queries are advanced together
+    with bitwise operations. Inside a level, the directions that do not increase the distance
+    are followed until no new dart is found, so the distances are the shortest ones
+    (the same of generalized_dijkstra_dt_gmap with unit weights).
+
+    max_distance: if not None, the darts farther than max_distance are not reached
+    stop_when_targets_reached: if True, each query stops when all the darts with a target label are reached
+                               (its bit is removed from the wavefront), the farther darts are not reached
+
+    The gmap is not modified.
+    :return: int32 array with shape (len(seed_sets), n_darts), the distance of each dart for each query,
+             -1 for the darts that are not reached (or removed)
+    """
+    if accumulation_directions is None:
+        accumulation_directions = [True] * (gmap.n + 1)
+    steps = np.array(accumulation_directions, dtype=bool)
+    accumulating, non_accumulating = np.flatnonzero(steps), np.flatnonzero(~steps)
+
+    alphas = np.asarray(gmap)
+    roles = gmap.dart_roles([], propagation_labels, target_labels)
+    admissible = roles & (ROLE_PROPAGATE | ROLE_TARGET) != 0
+    propagates = np.where(roles & ROLE_PROPAGATE != 0, ~np.uint64(0), np.uint64(0))
+    targets = gmap.label_darts(target_labels) if stop_when_targets_reached else None
+
+    def propagate(frontier, bits, involutions, distance):
+        found, found_bits = _propagate_query_bits(alphas, visited, admissible, frontier, bits, involutions)
+        _save_query_distances(distances, first_query, found, found_bits, distance)
+        found_bits &= propagates[found]
+        keep = found_bits != 0
+        return found[keep], found_bits[keep]
+
+    distances = np.full((len(seed_sets), gmap.shape[1]), -1, dtype=np.int32)
+    for first_query in range(0, len(seed_sets), 64):
+        visited = np.zeros(gmap.shape[1], dtype=np.uint64)
+        for q, seeds in enumerate(seed_sets[first_query:first_query + 64]):
+            seeds = np.asarray(seeds, dtype=np.int64)
+            visited[seeds] |= np.uint64(1 << q)
+            distances[first_query + q, seeds] = 0
+        # the seeds propagate for their queries
+        frontier = np.flatnonzero(visited)
+        bits = visited[frontier]
+        n_queries = min(64, len(seed_sets) - first_query)
+        queries = np.uint64((1 << n_queries) - 1)
+        unreached_targets = targets
+
+        distance = 0
+        while frontier.size > 0:
+            # the darts at the same distance, found through the directions that do not increase the distance
+            level, level_bits = [frontier], [bits]
+            while non_accumulating.size > 0 and frontier.size > 0:
+                frontier, bits = propagate(frontier, bits, non_accumulating, distance)
+                level.append(frontier)
+                level_bits.append(bits)
+            if max_distance is not None and distance >= max_distance:
+                break
+            level, level_bits = np.concatenate(level), np.concatenate(level_bits)
+
+            if unreached_targets is not None:
+                # the queries that have reached all the targets do not propagate anymore
+                unreached_targets = unreached_targets[visited[unreached_targets] & queries != queries]
+                missing = np.bitwise_or.reduce(~visited[unreached_targets] & queries)
+                level_bits &= ~(queries & ~missing)
+                keep = level_bits != 0
+                level, level_bits = level[keep], level_bits[keep]
+
+            distance += 1
+            frontier, bits = propagate(level, level_bits, accumulating, distance)
+
+    return distances
+
+
+def wave_propagation_dt_gmap(gmap, seeds_identifiers: typing.Optional[typing.List[int]], accumulation_directions: typing.List[bool] = None,
+                             max_distance: int = None) -> None:
     """
     It computes the dt for the gmap passed as parameter.
     The distance propagates through all the cells (using all the involutions).
@@ -277,11 +632,11 @@ def wave_propagation_dt_gmap(gmap, seeds_identifiers: typing.Optional[typing.Lis
 
     seed_identifiers: if None all the darts with label equal to 0 will be used and the distance
                       propagates only in the non foreground darts (!= 255)
+    max_distance: if not None, the propagation stops at max_distance, the farther darts are not reached (-1)
     """
 
-    # Initialization
-    for dart in gmap.darts:
-        gmap.distances[dart] = -1
+    # Initialization (only the alive darts)
+    gmap.distances[gmap.darts] = -1
 
     # Initialize accumulation directions if None
     if accumulation_directions is None:
@@ -289,42 +644,15 @@ def wave_propagation_dt_gmap(gmap, seeds_identifiers: typing.Optional[typing.Lis
         for i in range(gmap.n + 1):
             accumulation_directions.append(True)
 
-    curr_queue = Queue()
-    next_queue = Queue()
     if seeds_identifiers is None:
-        for dart in gmap.darts:
-            if gmap.image_labels[dart] == 0:
-                curr_queue.put(dart)
-                gmap.distances[dart] = 0
+        seeds = gmap.label_darts([0])
+        roles = np.where(gmap.image_labels != 255, ROLE_PROPAGATE, ROLE_BLOCKED).astype(np.uint8)
     else:
-        for seed_identifier in seeds_identifiers:
-            curr_queue.put(seed_identifier)
-            gmap.distances[seed_identifier] = 0
-
-    while not curr_queue.empty():
-        while not curr_queue.empty():
-            dart = curr_queue.get()
-            # Visit all the neighbours
-            for i in range(gmap.n + 1):
-                neighbour = gmap.ai(i, dart)
-                if seeds_identifiers is None and gmap.image_labels[neighbour] == 255:
-                    continue
-                # due to the accumulation policies, it happens that the first distance value associated to a neighbours
-                # could not be the right one. All the values have to be checked. View example on joplin (01/11/2021)
-                if accumulation_directions[i]:
-                    if gmap.distances[neighbour] == -1:
-                        next_queue.put(neighbour)  # only the first time I add the element to the queue
-                    if gmap.distances[neighbour] == -1\
-                            or gmap.distances[dart] + 1 < gmap.distances[neighbour]:
-                        gmap.distances[neighbour] = gmap.distances[dart] + 1
-                else:
-                    if gmap.distances[neighbour] == -1:
-                        curr_queue.put(neighbour)  # only the first time I add the element to the queue
-                    if gmap.distances[neighbour] == -1 \
-                                or gmap.distances[dart] < gmap.distances[neighbour]:
-                        gmap.distances[neighbour] = gmap.distances[dart]
-        curr_queue = next_queue
-        next_queue = Queue()
+        seeds = np.asarray(seeds_identifiers, dtype=np.int64)
+        roles = np.full(gmap.shape[1], ROLE_PROPAGATE, dtype=np.uint8)
+    gmap.distances[seeds] = 0
+
+    _level_synchronous_propagation(gmap, seeds, accumulation_directions, roles=roles, max_distance=max_distance)
 
 
 def generate_accumulation_directions_vertex(gmap_size: int) -> typing.List[bool]:
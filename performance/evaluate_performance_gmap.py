@@ -38,6 +38,7 @@ def measure_memory_build_gmap_tracemalloc(image) -> None:
     tracemalloc.stop()
     logger.info(f"Memory: current: {traced_memory[0]/1000000} MB peak: {traced_memory[1]/1000000} MB")
     logger.info(f"Memory required for each dart is: {traced_memory[0]/(shape[0]*shape[1]*8)} B")
+    logger.info(f"Memory of the alphas: {np.asarray(gmap).nbytes/1000000} MB")
 
 
 def measure_time_wave_propagation(gmap) -> None:
@@ -2,8 +2,11 @@ import typing
 from unittest import TestCase
 
 import math
+import time
 
-from distance_transform.wave_propagation import wave_propagation_dt_image
+from combinatorial.pixelmap import LabelMap
+from distance_transform.wave_propagation import generalized_wave_propagation_gmap, \
+    generate_accumulation_directions_vertex, wave_propagation_dt_image
 from distance_transform.pyramidal_dt import *
 from distance_transform.performance_evaluation import mae_image
 from distance_transform.dt_utils import *
@@ -61,3 +64,57 @@ class EvaluatePerformancePyramidalDt(TestCase):
         image = generate_random_binary_image(self.image_size, background_prob)
         self.evaluate_mae_with_multiple_strides(image, self.strides, improved_pyramidal_dt_binary_image)
         self.assertTrue(True)
+
+    def test_mae_time_levels_improved_pyramidal(self):
+        background_prob = 0.001
+        image = generate_random_binary_image(self.image_size, background_prob)
+        start = time.time()
+        dt_image = wave_propagation_dt_image(image)
+        end = time.time()
+        print(f"exact dt - time s: {end - start}")
+        for levels in range(5):
+            start = time.time()
+            approximate_dt_image = improved_pyramidal_dt_binary_image(image, 2, levels=levels)
+            end = time.time()
+
+            mae = mae_image(dt_image, approximate_dt_image)
+            print(f"mae: {mae} - levels: {levels} - error bound: {2 * (2 ** levels - 1)} - time s: {end - start}")
+        self.assertTrue(True)
+
+    @staticmethod
+    def synthetic_leaf_image(size: int) -> np.array:
+        """A synthetic leaf slice: cells (targets) in the air, stomata (seeds) in the epidermis (blocked)"""
+        random_state = np.random.RandomState(42)
+        image = np.full((size, size), 255, dtype=np.uint8)
+        rows, cols = np.indices(image.shape)
+        for _ in range(size * size // 1750):
+            row, col, radius = random_state.randint(size), random_state.randint(size), random_state.randint(10, 30)
+            image[(rows - row) ** 2 + (cols - col) ** 2 < radius ** 2] = 0
+        image[:10] = 152
+        for col in random_state.randint(0, size - 6, 5):
+            image[:10, col:col + 6] = 170
+            image[10:20, col - 4:col + 10] = 255
+        return image
+
+    def test_mae_time_pyramidal_dt_gmap(self):
+        image = self.synthetic_leaf_image(512)
+        accumulation_directions = generate_accumulation_directions_vertex(2)
+
+        gmap = LabelMap.from_labels(image)
+        start = time.time()
+        generalized_wave_propagation_gmap(gmap, [170], [255], [0], accumulation_directions)
+        print(f"exact - time s: {time.time() - start}")
+        dt = gmap.distances[gmap.darts]
+        for stride in (2, 3, 4):
+            gmap = LabelMap.from_labels(image)
+            start = time.time()
+            pyramidal_dt_gmap(gmap, [170], [255], [0], accumulation_directions, stride=stride)
+            end = time.time()
+
+            approximate_dt = gmap.distances[gmap.darts]
+            reached = (dt >= 0) & (approximate_dt >= 0)
+            mae = mae_image(dt[reached], approximate_dt[reached])
+            not_reached = np.count_nonzero((dt >= 0) != (approximate_dt >= 0))
+            print(f"mae: {mae} - stride: {stride} - darts reached only by one of the algorithms: {not_reached} - "
+                  f"time s: {end - start}")
+        self.assertTrue(True)
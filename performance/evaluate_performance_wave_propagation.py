@@ -1,3 +1,4 @@
+import os
 import typing
 from unittest import TestCase
 
@@ -5,8 +6,11 @@ import matplotlib.pyplot as plt
 
 from distance_transform.dt_utils import *
 from distance_transform.wave_propagation import *
+from distance_transform.separable_dt import separable_dt_binary_image
+from distance_transform.dijkstra import generalized_dijkstra_dt_gmap
+from distance_transform.tiled_dt import tiled_dt_gmap
 from scipy.interpolate import interp1d
-from combinatorial.pixelmap import PixelMap
+from combinatorial.pixelmap import PixelMap, LabelMap
 
 import time
 
@@ -71,6 +75,80 @@ class EvaluatePerformanceWavePropagation(TestCase):
         self._plot_size_time(image_sizes, elapsed_times)
         self.assertTrue(True)
 
+    def test_time_separable_dt_binary_image(self):
+        image_sizes = [200, 400, 600, 800, 1000, 1200, 1400, 1600, 1800, 2000]
+        background_probability = 0.01
+
+        for metric in ("manhattan", "chessboard", "euclidean"):
+            elapsed_times = []
+            for image_size in image_sizes:
+                image = generate_random_binary_image(image_size, background_probability)
+
+                start = time.time()
+                separable_dt_binary_image(image, metric)
+                end = time.time()
+
+                elapsed_time = end - start
+                elapsed_times.append(elapsed_time)
+
+                print(f"metric: {metric} - image size: {image_size} - number of pixels: {image_size*image_size}"
+                      f" background probability: {background_probability} - time s: {elapsed_time}")
+
+            # plot results
+            self._plot_size_time(image_sizes, elapsed_times)
+        self.assertTrue(True)
+
+    def test_time_multi_query_wave_propagation_gmap(self):
+        image_sizes = [20, 40, 60, 80, 100, 120, 140, 160, 180, 200]
+        background_probability = 0.01
+        n_queries = 64
+
+        elapsed_times = []
+        for image_size in image_sizes:
+            image = generate_random_binary_image(image_size, background_probability)
+            gmap = LabelMap.from_labels(image, connected_components_labels=np.arange(image.size).reshape(image.shape))
+            _, seed_sets = seed_sets_by_connected_component(gmap, [0])
+            seed_sets = seed_sets[:n_queries]
+
+            start = time.time()
+            multi_query_wave_propagation_gmap(gmap, seed_sets, [1], [])
+            end = time.time()
+
+            elapsed_time = end - start
+            elapsed_times.append(elapsed_time)
+
+            print(f"image size: {image_size} - number of darts: {image_size*image_size*8}"
+                  f" queries: {len(seed_sets)} - time s: {elapsed_time}")
+
+        # plot results
+        self._plot_size_time(image_sizes, elapsed_times)
+        self.assertTrue(True)
+
+    def test_time_tiled_dt_gmap_scaling(self):
+        # speed-up of the tiled dt with respect to the serial dijkstra for an increasing number of workers
+        image_sizes = [250, 500, 1000]
+        background_probability = 0.01
+        workers = sorted({2, 4, os.cpu_count() or 1} - {1})
+
+        for image_size in image_sizes:
+            image = generate_random_binary_image(image_size, background_probability)
+            gmap = LabelMap.from_labels(image)
+
+            start = time.time()
+            generalized_dijkstra_dt_gmap(gmap, [0], [1], [])
+            serial_time = time.time() - start
+            expected = gmap.distances.copy()
+            print(f"image size: {image_size} - number of darts: {image_size*image_size*8}"
+                  f" - serial dijkstra time s: {serial_time}")
+
+            for n_workers in workers:
+                start = time.time()
+                tiled_dt_gmap(gmap, [0], [1], [], n_workers=n_workers, min_darts=0)
+                elapsed_time = time.time() - start
+                self.assertTrue(np.array_equal(gmap.distances, expected))
+                print(f"image size: {image_size} - workers: {n_workers} - tiled time s: {elapsed_time}"
+                      f" - speed-up: {serial_time / elapsed_time}")
+
     def test_time_wave_propagation_dt_gmap(self):
         image_sizes = [20, 40, 60, 80, 100, 120, 140, 160, 180, 200]
         background_probability = 0.01
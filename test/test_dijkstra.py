@@ -7,6 +7,7 @@ from distance_transform.dt_utils import *
 from combinatorial.pixelmap import LabelMap
 from distance_transform.preprocessing import *
 from distance_transform.dijkstra import *
+from distance_transform.priority_queues import BucketQueue, RadixHeap, IndexedDaryHeap
 import cv2
 
 
@@ -170,3 +171,83 @@ class TestDijkstra(TestCase):
         actual_gmap.plot_dt(fill_cell='face')
 
         self.assertTrue(gmap_dt_equal(actual_gmap, expected_gmap))
+
+    def test_priority_queues(self):
+        for queue in (BucketQueue(3, 10), RadixHeap(10), IndexedDaryHeap(10)):
+            queue.push(2, 5)
+            queue.push(0, 7)
+            queue.push(3, 1)
+            queue.push(1, 5)  # decrease key
+            self.assertEqual(queue.pop(), (0, 7))
+            queue.push(1, 4)
+            queue.push(1, 9)
+            self.assertEqual(len(queue), 4)
+            self.assertEqual([queue.pop() for _ in range(4)], [(1, 4), (1, 5), (1, 9), (3, 1)])
+            self.assertEqual(len(queue), 0)
+
+        # a whole bucket at a time, the items pushed with the current key are in the next bucket
+        for queue in (BucketQueue(3, 10), RadixHeap(10), IndexedDaryHeap(10)):
+            queue.push_many(np.array([2, 0, 3, 0, 2]), np.array([5, 7, 1, 3, 8]))
+            queue.push(0, 5)  # decrease key
+            key, items = queue.pop_bucket()
+            self.assertEqual((key, items.tolist()), (0, [3, 5, 7]))
+            queue.push_many(np.array([0, 1]), np.array([9, 4]))
+            self.assertEqual(len(queue), 4)
+            buckets = [queue.pop_bucket() for _ in range(4)]
+            self.assertEqual([(key, items.tolist()) for key, items in buckets],
+                             [(0, [9]), (1, [4]), (2, [8]), (3, [1])])
+            self.assertEqual(len(queue), 0)
+
+    def test_generalized_dijkstra_dt_gmap_backends(self):
+        random.seed(42)
+        labels_image = np.random.RandomState(42).randint(0, 4, (7, 8))
+        gmap = LabelMap.from_labels(labels_image, connected_components_labels=np.arange(56).reshape(7, 8))
+        gmap.remove_edges(0.5)
+        gmap.remove_vertices()
+
+        results = []
+        for backend in ("bucket", "radix", "dary", "auto"):
+            generalized_dijkstra_dt_gmap(gmap, [0], [1, 2], [3], generate_accumulation_directions_vertex(2),
+                                         backend=backend)
+            results.append((gmap.distances.copy(), gmap.dt_connected_components_labels.copy()))
+
+        for distances, dt_labels in results[1:]:
+            self.assertTrue(np.array_equal(distances, results[0][0]))
+            self.assertTrue(np.array_equal(dt_labels, results[0][1]))
+
+    def test_generalized_dijkstra_dt_gmap_zero_weight_labels(self):
+        # the face in the middle is at distance 1 from both the seeds (cell accumulation, alpha0 and alpha1
+        # do not increase the distance): each dart takes the label of the first dart of the step that reaches it
+        labels_image = np.array([[0, 1, 0]])
+        connected_components_labels = np.array([[5, 6, 7]])
+        gmap = LabelMap.from_labels(labels_image, connected_components_labels=connected_components_labels)
+        expected_gmap = LabelMap.from_labels(labels_image, connected_components_labels=connected_components_labels)
+
+        generalized_dijkstra_dt_gmap(gmap, [0], [1], [], generate_accumulation_directions_cell(2))
+        generalized_wave_propagation_gmap(expected_gmap, [0], [1], [], generate_accumulation_directions_cell(2))
+
+        self.assertEqual(gmap.distances[8:16].tolist(), [1] * 8)
+        # the one at a time visit (heapq) gave [7, 7, 7, 7, 7, 7, 5, 5]
+        self.assertEqual(gmap.dt_connected_components_labels[8:16].tolist(), [5, 7, 7, 7, 7, 5, 5, 5])
+        self.assertTrue(gmap_dt_equal(gmap, expected_gmap))
+
+    def test_generalized_dijkstra_dt_gmap_bounded(self):
+        random.seed(42)
+        labels_image = np.random.RandomState(3).choice([0] + [1] * 30 + [2, 2, 3], (24, 22))
+        gmap = LabelMap.from_labels(labels_image, connected_components_labels=np.arange(528).reshape(24, 22))
+        gmap.remove_edges(0.5)
+        gmap.remove_vertices()
+
+        for accumulation_directions in (None, generate_accumulation_directions_vertex(2)):
+            generalized_dijkstra_dt_gmap(gmap, [0], [1, 2], [3], accumulation_directions)
+            expected = gmap.distances.copy()
+            # the propagation does not stop if a target is not reached
+            targets = gmap.label_darts([3])
+            farthest_target = expected[targets].max() if np.all(expected[targets] >= 0) else expected.max()
+
+            for max_distance, stop_when_targets_reached, bound in ((5, False, 5), (None, True, farthest_target),
+                                                                   (3, True, min(3, farthest_target))):
+                generalized_dijkstra_dt_gmap(gmap, [0], [1, 2], [3], accumulation_directions,
+                                             max_distance=max_distance,
+                                             stop_when_targets_reached=stop_when_targets_reached)
+                self.assertTrue(np.array_equal(gmap.distances, np.where(expected > bound, -1, expected)))
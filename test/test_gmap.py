@@ -9,6 +9,7 @@ from distance_transform.preprocessing import *
 from combinatorial.utils import build_dt_grey_image_from_gmap
 from test_utils import *
 from combinatorial.utils import *
+from combinatorial.gmaps import narrowest_integer_dtype, ROLE_BLOCKED, ROLE_SEED, ROLE_PROPAGATE, ROLE_TARGET
 import cv2
 import random
 
@@ -237,3 +238,279 @@ class TestGmap(TestCase):
         gmap.remove_edges(0.1)
         gmap.remove_vertices()
         gmap.plot()
+
+    def test_alive_darts_after_reduction(self):
+        random.seed(42)
+        image = cv2.imread('../data/5_5_boundary.png', 0)
+        gmap = LabelMap.from_labels(image)
+
+        self.assertEqual(gmap.n_darts, 200)
+        self.assertEqual(gmap.darts.tolist(), list(range(200)))
+
+        gmap.remove_edges(0.5)
+        gmap.remove_vertices()
+
+        alive = np.flatnonzero(np.asarray(gmap)[0] >= 0)
+        self.assertEqual(gmap.n_darts, len(alive))
+        self.assertEqual(gmap.darts.tolist(), alive.tolist())
+        for d in range(200):
+            self.assertEqual(gmap.is_alive(d), gmap.a0(d) != -1)
+
+    def test_marks_unmark_all(self):
+        gmap = PixelMap.from_shape(2, 2)
+        m = gmap.reserve_mark()
+        for d in range(8):
+            gmap.mark(m, d)
+        self.assertTrue(all(gmap.marked(m, d) for d in range(8)))
+        self.assertFalse(gmap.marked(m, 8))
+
+        gmap.unmark_all(m)
+        self.assertFalse(any(gmap.marked(m, d) for d in gmap.darts))
+
+        # the stamps are cleared when the epoch overflows
+        gmap.mark(m, 3)
+        gmap._epochs[m] = np.iinfo(gmap._marks.dtype).max
+        gmap.mark(m, 5)
+        gmap.unmark_all(m)
+        self.assertFalse(any(gmap.marked(m, d) for d in gmap.darts))
+
+        # the stamps never match an old epoch after many resets and the row is not cleared
+        self.assertEqual(gmap._marks.dtype, np.int32)
+        gmap.mark(m, 2)
+        stamp = gmap._marks[m, 2]
+        for _ in range(600):
+            gmap.unmark_all(m)
+            self.assertFalse(gmap.marked(m, 2))
+        self.assertEqual(gmap._marks[m, 2], stamp)
+        gmap.free_mark(m)
+
+        self.assertEqual(len(list(gmap.cell_2(0))), 8)
+        self.assertEqual(gmap.no_0_cells, 9)
+
+    def test_is_valid(self):
+        gmap = PixelMap.from_shape(3, 4, bounded=False)
+        self.assertTrue(gmap.is_valid)
+
+        # break alpha_0 of a single dart
+        gmap[0, 10] = 12
+        with self.assertLogs(level='DEBUG') as logs:
+            self.assertFalse(gmap.is_valid)
+        self.assertTrue(any('broken at dart 10' in message for message in logs.output))
+
+    def test_is_valid_broken_sewing(self):
+        gmap = PixelMap.from_shape(2, 2)
+        # unsew a single dart of a 2-sewn edge
+        gmap._link(2, 2, 15)
+        gmap._link(2, 3, 3)
+        self.assertFalse(gmap.is_valid)
+
+    def test_cell_ids(self):
+        gmap = PixelMap.from_shape(2, 3)
+
+        self.assertEqual(gmap.no_0_cells, 12)
+        self.assertEqual(gmap.no_1_cells, 17)
+        self.assertEqual(gmap.no_2_cells, 6)
+        self.assertEqual(gmap.no_ccs, 1)
+
+        face_ids = gmap.cell_ids(2)
+        self.assertEqual(face_ids.tolist(), np.repeat(np.arange(6), 8).tolist())
+        self.assertEqual(gmap.darts_of_i_cells(2).tolist(), list(range(0, 48, 8)))
+        self.assertEqual(sorted(gmap.cell_i(0, 2)), gmap.cell_i_darts(0, 2).tolist())
+
+        self.assertTrue(gmap.incident(0, 2, 2, 8))
+        self.assertFalse(gmap.incident(0, 0, 2, 8))
+        self.assertTrue(gmap.adjacent(2, 0, 8))
+        self.assertFalse(gmap.adjacent(2, 0, 16))
+
+    def test_cell_ids_invalidated_by_removal(self):
+        random.seed(42)
+        image = cv2.imread('../data/5_5_boundary.png', 0)
+        gmap = LabelMap.from_labels(image)
+        n_faces = gmap.no_2_cells
+
+        gmap.remove_edges(0.5)
+        self.assertLess(gmap.no_2_cells, n_faces)
+        self.assertEqual(gmap.no_2_cells, len(list(gmap.all_i_cells(2))))
+        for d in gmap.darts_of_i_cells(2):
+            self.assertEqual(sorted(gmap.cell_2(d)), gmap.cell_i_darts(2, d).tolist())
+
+    def test_attributes_lazy_allocation(self):
+        image = cv2.imread('../data/5_5_boundary.png', 0)
+        gmap = LabelMap.from_labels(image)
+
+        self.assertTrue(gmap.is_attribute_allocated("image_labels"))
+        self.assertEqual(gmap.image_labels.dtype, np.uint8)
+        for name in ("distances", "weights", "connected_components_labels", "face_identifiers"):
+            self.assertFalse(gmap.is_attribute_allocated(name))
+        self.assertEqual(gmap.attributes_saved_nbytes(), 200 * (4 + 4 + 2 + 4 + 4 + 4) - 200)
+
+        # allocated on first use with the fill value and the narrowest dtype
+        self.assertTrue((gmap.distances == -1).all())
+        self.assertEqual(gmap.distances.dtype, np.int16)
+        self.assertTrue((gmap.connected_components_labels == -1).all())
+        self.assertTrue(gmap.is_attribute_allocated("distances"))
+        self.assertFalse(gmap.is_attribute_allocated("weights"))
+
+    def test_narrowest_integer_dtype(self):
+        self.assertEqual(narrowest_integer_dtype(-1, 100), np.int8)
+        self.assertEqual(narrowest_integer_dtype(0, 255), np.uint8)
+        self.assertEqual(narrowest_integer_dtype(-1, 255), np.int16)
+        self.assertEqual(narrowest_integer_dtype(-1, 10 ** 6), np.int32)
+
+    def test_from_shape_instance_shape(self):
+        gmap_1 = PixelMap.from_shape(2, 3)
+        gmap_2 = PixelMap.from_shape(4, 5, bounded=False)
+
+        self.assertEqual((gmap_1.n_rows, gmap_1.n_cols), (2, 3))
+        self.assertEqual((gmap_2.n_rows, gmap_2.n_cols), (4, 5))
+        self.assertEqual(gmap_2.n_darts, 8 * 4 * 5 + 4 * (4 + 5))
+        self.assertEqual(gmap_2.no_2_cells, 4 * 5 + 1)
+
+        # the construction does not check the involutions, the grid must be valid by construction
+        for sew in (True, False):
+            for bounded in (True, False):
+                self.assertTrue(PixelMap.from_shape(3, 4, sew=sew, bounded=bounded).is_valid)
+
+    def test_from_labels(self):
+        labels = np.array([[0, 1, 2], [3, 4, 5]], dtype=np.uint8)
+        connected_components_labels = np.array([[10, 11, 12], [13, 14, 15]])
+        gmap = LabelMap.from_labels(labels, connected_components_labels=connected_components_labels)
+
+        self.assertEqual(gmap.image_labels.tolist(), np.repeat(np.arange(6), 8).tolist())
+        self.assertEqual(gmap.connected_components_labels.tolist(), np.repeat(np.arange(10, 16), 8).tolist())
+        self.assertTrue(np.array_equal(gmap.labels, labels))
+
+        # polyline of the dart 13 (pixel (0, 1), dart 5 of the pixel)
+        expected = LabelMap._initial_dart_polylines_00[5] + [1, 0]
+        self.assertTrue(np.allclose(gmap._dart_polyline[13], expected))
+        self.assertTrue(np.allclose(LabelMap.initial_dart_polylines(gmap.darts, 3)[13], expected))
+
+    def test_dart_polylines_after_vertex_removal(self):
+        labels = np.zeros((1, 3), dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        self.assertEqual(gmap._dart_polyline.nbytes, 0)
+
+        # polylines computed by concatenation, as before the compact store
+        expected = {}
+        def polyline(d):
+            return expected[d] if d in expected else LabelMap.initial_dart_polylines(d, gmap.n_cols)
+        gmap.remove_edges()
+        for d in list(gmap.darts_of_i_cells(0)):
+            if gmap.is_alive(d) and gmap.is_i_removable(0, d):
+                for e in gmap.cell_0(d):
+                    expected[gmap.a0(e)] = np.vstack((polyline(gmap.a0(e)), polyline(e)[::-1]))
+                gmap.remove_vertex(d)
+
+        self.assertGreater(len(expected), 0)
+        for d in gmap.darts:
+            self.assertTrue(np.array_equal(gmap._dart_polyline[d], polyline(d)))
+
+    def test_compact(self):
+        labels = np.array([[0, 0, 1, 1], [0, 0, 1, 1], [2, 2, 2, 1]], dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        gmap.remove_edges()
+        gmap.remove_vertices()
+        gmap.distances[gmap.darts] = np.arange(gmap.n_darts)
+
+        compacted = gmap.compact()
+        self.assertTrue(compacted.is_valid)
+        self.assertEqual(compacted.shape[1], gmap.n_darts)
+        self.assertTrue(np.array_equal(compacted.original_darts, gmap.darts))
+        self.assertTrue(np.array_equal(compacted.distances, np.arange(gmap.n_darts)))
+        self.assertEqual(compacted.no_2_cells, gmap.no_2_cells)
+        for interpolate_missing_values in (True, False):
+            self.assertTrue(np.array_equal(compacted.build_dt_image([0, 1, 2], interpolate_missing_values),
+                                           gmap.build_dt_image([0, 1, 2], interpolate_missing_values)))
+            self.assertTrue(np.array_equal(compacted.get_label_image(interpolate_missing_values),
+                                           gmap.get_label_image(interpolate_missing_values)))
+        for d in compacted.darts:
+            self.assertTrue(np.array_equal(compacted._dart_polyline[d], gmap._dart_polyline[gmap.darts[d]]))
+
+    def test_representative_darts(self):
+        labels = np.array([[0, 0, 1, 1], [0, 0, 1, 1], [2, 2, 2, 1]], dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        self.assertTrue(np.array_equal(gmap.representative_darts(), np.arange(gmap.shape[1])))
+
+        gmap.remove_edges()
+        gmap.remove_vertices()
+        representatives = gmap.representative_darts()
+        self.assertIs(gmap.representative_darts(), representatives)
+        for dart in range(gmap.shape[1]):
+            self.assertEqual(representatives[dart], gmap.resolve_dart(dart))
+
+        pixel_darts = gmap.pixel_darts()
+        pixel_darts_no_interpolation = gmap.pixel_darts(interpolate_missing_values=False)
+        for i in range(gmap.n_rows):
+            for j in range(gmap.n_cols):
+                self.assertEqual(pixel_darts[i, j], gmap.pixel_dart(i, j))
+                self.assertEqual(pixel_darts_no_interpolation[i, j], gmap.pixel_dart(i, j, False))
+
+        # invalidated by a removal
+        gmap.remove_edge(gmap.darts_of_i_cells(1)[0])
+        self.assertIsNot(gmap.representative_darts(), representatives)
+
+    def test_label_darts(self):
+        labels = np.array([[0, 0, 1, 1], [0, 0, 1, 1], [2, 2, 2, 1]], dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        self.assertEqual(gmap.label_darts([2]).tolist(), list(range(64, 88)))
+        self.assertEqual(gmap.label_darts([5]).tolist(), [])
+
+        # kept up to date through removals
+        gmap.remove_edges()
+        gmap.remove_vertices()
+        for query in ([0], [1, 2], [0, 1, 2]):
+            expected = [dart for dart in gmap.darts if gmap.image_labels[dart] in query]
+            self.assertEqual(gmap.label_darts(query).tolist(), expected)
+
+    def test_dart_roles(self):
+        labels = np.array([[0, 1, 2, 3]], dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        roles = gmap.dart_roles([0], [1, 0], [2])
+        self.assertIs(gmap.dart_roles([0], [0, 1], [2]), roles)
+        self.assertEqual(roles[::8].tolist(), [ROLE_SEED | ROLE_PROPAGATE, ROLE_PROPAGATE, ROLE_TARGET, ROLE_BLOCKED])
+
+        # rebuilt when the labels are modified, the labels array can be modified only with set_image_labels
+        with self.assertRaises(ValueError):
+            gmap.image_labels[24:32] = 1
+        gmap.set_image_labels(slice(24, 32), 1)
+        self.assertEqual(gmap.dart_roles([0], [0, 1], [2])[24], ROLE_PROPAGATE)
+        self.assertEqual(gmap.label_darts([1]).tolist(), list(range(8, 16)) + list(range(24, 32)))
+
+    def test_set_image_labels(self):
+        labels = np.array([[0, 1, 2, 3]], dtype=np.uint8)
+        gmap = LabelMap.from_labels(labels)
+        gmap.dart_roles([0], [1], [2])
+        gmap.set_image_labels(range(24, 32), 1)
+        self.assertEqual(gmap.label_darts([1]).tolist(), list(range(8, 16)) + list(range(24, 32)))
+        self.assertEqual(gmap.dart_roles([0], [1], [2])[24], ROLE_PROPAGATE)
+
+        # the labels array is widened for the labels out of its range, a direct write cannot truncate them
+        self.assertEqual(gmap.image_labels.dtype, np.int8)
+        with self.assertRaises(ValueError):
+            gmap.image_labels[:4] = 300
+        gmap.set_image_labels([0, 1], [300, 301])
+        self.assertEqual(gmap.image_labels[:3].tolist(), [300, 301, 0])
+        self.assertEqual(gmap.label_darts([301]).tolist(), [1])
+
+    def test_uniform_labels_for_vertices_ties(self):
+        # labels that are not uniform on the faces, so some vertices have equally frequent labels
+        # different from the label of their smallest dart
+        rng = np.random.default_rng(3)
+        gmap = LabelMap.from_labels(np.zeros((12, 12), dtype=np.uint8))
+        gmap.set_image_labels(gmap.darts, rng.integers(0, 6, size=len(gmap.darts)))
+
+        expected = {}
+        for representative_dart in gmap.darts_of_i_cells(0):
+            traversal = list(gmap.cell_i(0, representative_dart))
+            counts = {}
+            for dart in traversal:
+                counts[gmap.image_labels[dart]] = counts.get(gmap.image_labels[dart], 0) + 1
+            max_count = max(counts.values())
+            # the first label of the traversal among the most frequent ones
+            expected[representative_dart] = next(gmap.image_labels[dart] for dart in traversal
+                                                 if counts[gmap.image_labels[dart]] == max_count)
+
+        gmap.uniform_labels_for_vertices()
+        for representative_dart, label in expected.items():
+            for dart in gmap.cell_i(0, representative_dart):
+                self.assertEqual(gmap.image_labels[dart], label)
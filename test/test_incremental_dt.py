@@ -0,0 +1,105 @@
+import random
+from unittest import TestCase
+
+import numpy as np
+
+from combinatorial.pixelmap import LabelMap
+from distance_transform.dijkstra import generalized_dijkstra_dt_gmap
+from distance_transform.incremental_dt import IncrementalDt
+from distance_transform.wave_propagation import *
+
+
+class TestIncrementalDt(TestCase):
+    def setUp(self) -> None:
+        labels_image = np.random.RandomState(3).choice([0, 1, 1, 1, 1, 2, 3], (16, 14))
+        self.labels_image = labels_image
+        self.connected_components_labels = np.arange(labels_image.size).reshape(labels_image.shape)
+
+    def _gmap(self, reduce: bool, image_labels: np.array = None) -> LabelMap:
+        gmap = LabelMap.from_labels(self.labels_image, connected_components_labels=self.connected_components_labels)
+        if reduce:
+            random.seed(7)
+            gmap.remove_edges(0.5)
+            gmap.remove_vertices()
+        if image_labels is not None:
+            gmap.set_image_labels(slice(None), image_labels)
+        return gmap
+
+    def _updates(self, incremental_dt: IncrementalDt, gmap: LabelMap, random_state: np.random.RandomState):
+        """Removes and adds seeds and relabels regions of pixels"""
+        for step in range(6):
+            if step % 2 == 0:
+                incremental_dt.relabel_darts(random_state.choice(gmap.darts, 5), random_state.randint(0, 4))
+            else:
+                mask = np.zeros(self.labels_image.shape, dtype=bool)
+                r, c = random_state.randint(0, 12, 2)
+                mask[r:r + 4, c:c + 3] = True
+                incremental_dt.relabel_pixels(mask, random_state.randint(0, 4))
+            yield
+
+    def test_incremental_dt_same_as_recomputed(self):
+        random_state = np.random.RandomState(1)
+        for reduce in (False, True):
+            for accumulation_directions in (None, generate_accumulation_directions_vertex(2),
+                                            generate_accumulation_directions_cell(2)):
+                gmap = self._gmap(reduce)
+                incremental_dt = gmap.incremental_dt([0], [1, 2], [3], accumulation_directions)
+                for _ in self._updates(incremental_dt, gmap, random_state):
+                    expected_gmap = self._gmap(reduce, gmap.image_labels)
+                    IncrementalDt(expected_gmap, [0], [1, 2], [3], accumulation_directions)
+
+                    darts = gmap.darts
+                    self.assertTrue(np.array_equal(gmap.distances[darts], expected_gmap.distances[darts]))
+                    reached = darts[gmap.distances[darts] >= 0]
+                    self.assertTrue(np.array_equal(gmap.dt_connected_components_labels[reached],
+                                                   expected_gmap.dt_connected_components_labels[reached]))
+
+    def test_incremental_dt_same_as_dijkstra(self):
+        random_state = np.random.RandomState(2)
+        gmap = self._gmap(reduce=True)
+        weights = random_state.randint(1, 4, gmap.shape[1])
+        gmap.weights[:] = weights
+        incremental_dt = gmap.incremental_dt([0], [1, 2], [3], engine="dijkstra")
+        for _ in self._updates(incremental_dt, gmap, random_state):
+            expected_gmap = self._gmap(True, gmap.image_labels)
+            expected_gmap.weights[:] = weights
+            generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3])
+
+            darts = gmap.darts
+            self.assertTrue(np.array_equal(gmap.distances[darts], expected_gmap.distances[darts]))
+            reached = darts[gmap.distances[darts] >= 0]
+            self.assertTrue(np.array_equal(gmap.dt_connected_components_labels[reached],
+                                           expected_gmap.dt_connected_components_labels[reached]))
+
+    def test_incremental_dt_same_as_dijkstra_accumulation_directions(self):
+        # the engine "wave" gives the distances of the dijkstra with unit weights (not the ones of
+        # generalized_wave_propagation_gmap), both engines give the labels of the dijkstra
+        random_state = np.random.RandomState(4)
+        for reduce in (False, True):
+            for accumulation_directions in (generate_accumulation_directions_vertex(2),
+                                            generate_accumulation_directions_cell(2)):
+                for engine in ("dijkstra", "wave"):
+                    gmap = self._gmap(reduce)
+                    weights = random_state.randint(1, 4, gmap.shape[1]) if engine == "dijkstra" else 1
+                    gmap.weights[:] = weights
+                    incremental_dt = gmap.incremental_dt([0], [1, 2], [3], accumulation_directions, engine=engine)
+                    for _ in self._updates(incremental_dt, gmap, random_state):
+                        expected_gmap = self._gmap(reduce, gmap.image_labels)
+                        expected_gmap.weights[:] = weights
+                        generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3], accumulation_directions)
+
+                        darts = gmap.darts
+                        self.assertTrue(np.array_equal(gmap.distances[darts], expected_gmap.distances[darts]))
+                        reached = darts[gmap.distances[darts] >= 0]
+                        self.assertTrue(np.array_equal(gmap.dt_connected_components_labels[reached],
+                                                       expected_gmap.dt_connected_components_labels[reached]))
+
+    def test_incremental_dt_max_distance(self):
+        random_state = np.random.RandomState(3)
+        gmap = self._gmap(reduce=True)
+        incremental_dt = gmap.incremental_dt([0], [1, 2], [3], max_distance=4)
+        for _ in self._updates(incremental_dt, gmap, random_state):
+            expected_gmap = self._gmap(True, gmap.image_labels)
+            expected_gmap.weights[:] = 1
+            generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3], max_distance=4)
+            self.assertTrue(np.array_equal(gmap.distances[gmap.darts], expected_gmap.distances[gmap.darts]))
@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+import numpy as np
+
+from distance_transform.separable_dt import separable_dt_binary_image
+from distance_transform.wave_propagation import wave_propagation_dt_image
+
+
+class TestSeparableDt(TestCase):
+    def _brute_force_dt(self, image: np.array, metric: str) -> np.array:
+        zeroes = np.argwhere(image == 0)
+        pixels = np.indices(image.shape).reshape(2, -1).T
+        differences = np.abs(pixels[:, None, :] - zeroes[None, :, :])
+        if metric == "manhattan":
+            distances = differences.sum(axis=2)
+        elif metric == "chessboard":
+            distances = differences.max(axis=2)
+        else:
+            distances = np.sqrt((differences ** 2).sum(axis=2))
+        return distances.min(axis=1).reshape(image.shape)
+
+    def test_separable_dt_binary_image(self):
+        random_state = np.random.RandomState(2)
+        for shape, background_probability in (((7, 5), 0.2), ((30, 41), 0.05), ((41, 30), 0.01), ((1, 9), 0.2)):
+            image = (random_state.random_sample(shape) > background_probability).astype(np.int64)
+            image[0, 0] = 0
+            for metric in ("manhattan", "chessboard", "euclidean"):
+                actual = separable_dt_binary_image(image, metric)
+                self.assertTrue(np.allclose(actual, self._brute_force_dt(image, metric)))
+
+            self.assertEqual(separable_dt_binary_image(image).tolist(), wave_propagation_dt_image(image).tolist())
+
+    def test_separable_dt_binary_image_without_zeroes(self):
+        image = np.ones((3, 4), dtype=np.int64)
+        self.assertTrue(np.all(separable_dt_binary_image(image) == -1))
+        self.assertTrue(np.all(separable_dt_binary_image(image, "euclidean") == -1))
+        with self.assertRaises(ValueError):
+            separable_dt_binary_image(image, "cityblock")
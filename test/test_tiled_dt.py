@@ -0,0 +1,89 @@
+import random
+from unittest import TestCase
+
+import numpy as np
+
+from combinatorial.pixelmap import LabelMap
+from distance_transform.dijkstra import generalized_dijkstra_dt_gmap
+from distance_transform.tiled_dt import TILED_MIN_DARTS, tiled_dt_gmap
+from distance_transform.wave_propagation import *
+
+
+class TestTiledDt(TestCase):
+    def setUp(self) -> None:
+        labels_image = np.random.RandomState(5).choice([0, 1, 1, 1, 1, 2, 3], (24, 20))
+        self.labels_image = labels_image
+        self.connected_components_labels = np.arange(labels_image.size).reshape(labels_image.shape)
+
+    def _gmaps(self, reduce: bool = False) -> (LabelMap, LabelMap):
+        gmaps = []
+        for _ in range(2):
+            gmap = LabelMap.from_labels(self.labels_image, connected_components_labels=self.connected_components_labels)
+            if reduce:
+                random.seed(7)
+                gmap.remove_edges(0.5)
+                gmap.remove_vertices()
+            gmaps.append(gmap)
+        return gmaps
+
+    def test_tiled_dt_gmap_same_as_dijkstra(self):
+        for reduce in (False, True):
+            # one worker and the small maps fall back to the serial dijkstra
+            for tile_shape, n_workers, min_darts in (((5, 7), 2, 0), ((8, 8), 2, 0), ((24, 20), 2, 0),
+                                                     ((8, 8), 1, 0), ((8, 8), 2, TILED_MIN_DARTS)):
+                actual_gmap, expected_gmap = self._gmaps(reduce)
+                weights = np.random.RandomState(1).randint(1, 4, actual_gmap.shape[1])
+                actual_gmap.weights[:] = weights
+                expected_gmap.weights[:] = weights
+
+                generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3])
+                tiled_dt_gmap(actual_gmap, [0], [1, 2], [3], tile_shape=tile_shape, n_workers=n_workers,
+                              min_darts=min_darts)
+
+                darts = actual_gmap.darts
+                self.assertTrue(np.array_equal(actual_gmap.distances[darts], expected_gmap.distances[darts]))
+                self.assertTrue(np.array_equal(actual_gmap.dt_connected_components_labels[darts],
+                                               expected_gmap.dt_connected_components_labels[darts]))
+
+    def test_tiled_dt_gmap_unit_weights(self):
+        for accumulation_directions in ([True, True, True], generate_accumulation_directions_vertex(2),
+                                        generate_accumulation_directions_cell(2)):
+            actual_gmap, expected_gmap = self._gmaps(reduce=True)
+            expected_gmap.weights[:] = 1
+
+            generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3], accumulation_directions)
+            tiled_dt_gmap(actual_gmap, [0], [1, 2], [3], accumulation_directions, tile_shape=(6, 5), n_workers=2,
+                          engine="wave", min_darts=0)
+
+            darts = actual_gmap.darts
+            self.assertTrue(np.array_equal(actual_gmap.distances[darts], expected_gmap.distances[darts]))
+            # the label is the one of a closest seed
+            reached = darts[actual_gmap.distances[darts] > 0]
+            seeds = darts[actual_gmap.distances[darts] == 0]
+            self.assertTrue(np.all(np.isin(actual_gmap.dt_connected_components_labels[reached],
+                                           actual_gmap.connected_components_labels[seeds])))
+
+        # the same distances of the wave propagation
+        actual_gmap, expected_gmap = self._gmaps(reduce=True)
+        generalized_wave_propagation_gmap(expected_gmap, [0], [1, 2], [3])
+        tiled_dt_gmap(actual_gmap, [0], [1, 2], [3], tile_shape=(6, 5), n_workers=1, engine="wave")
+        self.assertTrue(np.array_equal(actual_gmap.distances[actual_gmap.darts],
+                                       expected_gmap.distances[expected_gmap.darts]))
+
+    def test_tiled_dt_gmap_bounded(self):
+        for engine in ("dijkstra", "wave"):
+            actual_gmap, expected_gmap = self._gmaps(reduce=True)
+            if engine == "wave":
+                expected_gmap.weights[:] = 1
+            generalized_dijkstra_dt_gmap(expected_gmap, [0], [1, 2], [3])
+            expected = expected_gmap.distances[expected_gmap.darts]
+            targets = expected_gmap.label_darts([3])
+            farthest_target = expected_gmap.distances[targets].max() if np.all(
+                expected_gmap.distances[targets] >= 0) else expected.max()
+
+            for max_distance, stop_when_targets_reached, bound in ((4, False, 4), (None, True, farthest_target)):
+                tiled_dt_gmap(actual_gmap, [0], [1, 2], [3], tile_shape=(6, 5), n_workers=2, engine=engine,
+                              max_distance=max_distance, stop_when_targets_reached=stop_when_targets_reached,
+                              min_darts=0)
+                self.assertTrue(np.array_equal(actual_gmap.distances[actual_gmap.darts],
+                                               np.where(expected > bound, -1, expected)))
@@ -5,6 +5,8 @@ import numpy as np
 
 from combinatorial.utils import build_dt_grey_image_from_gmap
 from distance_transform.wave_propagation import *
+from distance_transform.wave_propagation import _propagate_batch_sequentially
+from distance_transform.dijkstra import generalized_dijkstra_dt_gmap
 from combinatorial.pixelmap import PixelMap
 from distance_transform.dt_utils import *
 from combinatorial.pixelmap import LabelMap
@@ -376,6 +378,182 @@ class TestWavePropagation(TestCase):
 
         self.assertEqual(actual.tolist(), expected.tolist())
 
+    def test_generalized_wave_propagation_gmap_same_as_sequential(self):
+        """
+        The darts processed in batches have to produce the same distances and labels of the darts processed one at
+        a time (first in first out, as with a queue)
+        """
+        def sequential(gmap, accumulation_directions):
+            darts = gmap.darts
+            gmap.distances[darts] = -1
+            seeds = darts[np.isin(gmap.image_labels[darts], [0])]
+            gmap.distances[seeds] = 0
+            gmap.dt_connected_components_labels[seeds] = gmap.connected_components_labels[seeds]
+            steps = np.array(accumulation_directions, dtype=np.int64)
+            level = seeds
+            while level.size > 0:
+                next_level = []
+                batch = level
+                while batch.size > 0:
+                    batch, found = _propagate_batch_sequentially(
+                        np.asarray(gmap), gmap.distances, gmap.dt_connected_components_labels, batch, steps,
+                        gmap.dart_roles([0], [1, 2], [3]))
+                    next_level.append(found)
+                level = np.concatenate(next_level)
+            return gmap.distances.copy(), gmap.dt_connected_components_labels.copy()
+
+        random.seed(3)
+        labels_image = np.random.RandomState(3).randint(0, 4, (8, 9))
+        gmap = LabelMap.from_labels(labels_image, connected_components_labels=np.arange(72).reshape(8, 9))
+        gmap.remove_edges(0.5)
+        gmap.remove_vertices()
+        for accumulation_directions in ([True, True, True], [True, False, False], [False, False, True]):
+            expected = sequential(gmap, accumulation_directions)
+            generalized_wave_propagation_gmap(gmap, [0], [1, 2], [3], accumulation_directions)
+            self.assertTrue(np.array_equal(gmap.distances, expected[0]))
+            self.assertTrue(np.array_equal(gmap.dt_connected_components_labels, expected[1]))
+
+    def test_quotient_wave_propagation_gmap(self):
+        labels_image = np.array([[0, 1, 1, 1], [1, 1, 2, 1], [1, 2, 2, 1], [1, 1, 1, 0]])
+        for i, accumulation_directions in ((0, generate_accumulation_directions_vertex(2)),
+                                           (2, generate_accumulation_directions_cell(2))):
+            expected_gmap = LabelMap.from_labels(labels_image, connected_components_labels=labels_image)
+            actual_gmap = LabelMap.from_labels(labels_image, connected_components_labels=labels_image)
+            if i == 0:
+                # the labels have to be uniform inside the i-cells (the faces of a LabelMap already are)
+                expected_gmap.uniform_labels_for_vertices()
+                actual_gmap.uniform_labels_for_vertices()
+
+            generalized_wave_propagation_gmap(expected_gmap, [0], [1], [], accumulation_directions)
+            quotient_graph = build_quotient_graph(actual_gmap, i)
+            self.assertEqual(quotient_graph[1].size, actual_gmap.no_i_cells(i))
+            quotient_wave_propagation_gmap(actual_gmap, i, [0], [1], quotient_graph=quotient_graph)
+
+            self.assertTrue(gmap_dt_equal(actual_gmap, expected_gmap))
+            # all the darts of an i-cell have the same distance
+            cell_ids = actual_gmap.cell_ids(i)
+            for cell in range(actual_gmap.no_i_cells(i)):
+                self.assertEqual(np.unique(actual_gmap.distances[cell_ids == cell]).size, 1)
+
+            # the darts of a target i-cell take the distance of the i-cell linked by alpha_i, as in the dart wave
+            generalized_wave_propagation_gmap(expected_gmap, [0], [1], [2], accumulation_directions)
+            quotient_wave_propagation_gmap(actual_gmap, i, [0], [1], [2])
+            self.assertTrue(gmap_dt_equal(actual_gmap, expected_gmap))
+
+        labels_image = np.array([[0, 1, 1, 3, 1], [1, 1, 2, 1, 1]])
+        expected_gmap = LabelMap.from_labels(labels_image)
+        actual_gmap = LabelMap.from_labels(labels_image)
+        generalized_wave_propagation_gmap(expected_gmap, [0], [1], [3], generate_accumulation_directions_cell(2))
+        quotient_wave_propagation_gmap(actual_gmap, 2, [0], [1], [3])
+        self.assertEqual(actual_gmap.distances[24:32].tolist(), [-1, -1, -1, -1, -1, -1, 3, 3])
+        self.assertTrue(np.array_equal(actual_gmap.distances, expected_gmap.distances))
+
+        # the labels have to be uniform inside the i-cells
+        with self.assertRaises(ValueError):
+            improved_wave_propagation_gmap_vertex(actual_gmap, [0], [1])
+
+    def test_multi_query_wave_propagation_gmap(self):
+        # more than 64 queries (one for each seed pixel), so two groups of bits are used
+        labels_image = np.random.RandomState(2).choice([0, 0, 1, 1, 2, 3], (14, 16))
+        connected_components_labels = np.arange(labels_image.size).reshape(labels_image.shape)
+        for reduce in (False, True):
+            for accumulation_directions in (None, generate_accumulation_directions_vertex(2),
+                                            generate_accumulation_directions_cell(2)):
+                gmap = LabelMap.from_labels(labels_image, connected_components_labels=connected_components_labels)
+                if reduce:
+                    random.seed(3)
+                    gmap.remove_edges(0.5)
+                    gmap.remove_vertices()
+                components, seed_sets = seed_sets_by_connected_component(gmap, [0])
+                self.assertGreater(len(seed_sets), 64)
+                distances = multi_query_wave_propagation_gmap(gmap, seed_sets, [1, 2], [3], accumulation_directions)
+                self.assertEqual(distances.shape, (len(seed_sets), gmap.shape[1]))
+
+                image_labels = gmap.image_labels.copy()
+                gmap.weights[:] = 1
+                for q in (0, 40, 64, len(seed_sets) - 1):
+                    # the darts of the other seed sets are blocked
+                    gmap.set_image_labels(slice(None), np.where(image_labels == 0, 4, image_labels))
+                    gmap.set_image_labels(seed_sets[q], 0)
+                    self.assertTrue(np.all(gmap.connected_components_labels[seed_sets[q]] == components[q]))
+                    generalized_dijkstra_dt_gmap(gmap, [0], [1, 2], [3], accumulation_directions)
+                    self.assertTrue(np.array_equal(distances[q, gmap.darts], gmap.distances[gmap.darts]))
+
+    def test_bounded_wave_propagation(self):
+        labels_image = np.random.RandomState(1).choice([0] + [1] * 30 + [3], (20, 20))
+        targets = labels_image == 3
+
+        # images
+        expected = generalized_wave_propagation_image(labels_image, [0], [1], [3])
+        farthest_target = expected[targets].max()
+        self.assertLess(farthest_target, expected.max())
+        actual = generalized_wave_propagation_image(labels_image, [0], [1], [3], max_distance=4)
+        self.assertEqual(actual.tolist(), np.where(expected > 4, -1, expected).tolist())
+        actual = generalized_wave_propagation_image(labels_image, [0], [1], [3], stop_when_targets_reached=True)
+        self.assertEqual(actual.tolist(), np.where(expected > farthest_target, -1, expected).tolist())
+        expected = wave_propagation_dt_image(self.binary_image_1)
+        actual = wave_propagation_dt_image(self.binary_image_1, max_distance=2)
+        self.assertEqual(actual.tolist(), np.where(expected > 2, -1, expected).tolist())
+
+        # gmaps
+        gmap = LabelMap.from_labels(labels_image, connected_components_labels=np.arange(400).reshape(20, 20))
+        generalized_wave_propagation_gmap(gmap, [0], [1], [3])
+        expected = gmap.distances.copy()
+        # the propagation does not stop if a target is not reached
+        target_distances = expected[gmap.label_darts([3])]
+        farthest_target = target_distances.max() if np.all(target_distances >= 0) else expected.max()
+        generalized_wave_propagation_gmap(gmap, [0], [1], [3], max_distance=4)
+        self.assertTrue(np.array_equal(gmap.distances, np.where(expected > 4, -1, expected)))
+        generalized_wave_propagation_gmap(gmap, [0], [1], [3], stop_when_targets_reached=True)
+        self.assertTrue(np.array_equal(gmap.distances, np.where(expected > farthest_target, -1, expected)))
+
+        # vertex and cell accumulation on reduced gmaps (the distances can decrease after their level)
+        for reduce in (False, True):
+            reduced_gmap = LabelMap.from_labels(labels_image,
+                                                connected_components_labels=np.arange(400).reshape(20, 20))
+            if reduce:
+                random.seed(3)
+                reduced_gmap.remove_edges(0.5)
+                reduced_gmap.remove_vertices()
+            for accumulation_directions in (generate_accumulation_directions_vertex(2),
+                                            generate_accumulation_directions_cell(2)):
+                generalized_wave_propagation_gmap(reduced_gmap, [0], [1], [3], accumulation_directions)
+                expected = reduced_gmap.distances.copy()
+                expected_labels = reduced_gmap.dt_connected_components_labels.copy()
+                target_distances = expected[reduced_gmap.label_darts([3])]
+                farthest_target = target_distances.max() if np.all(target_distances >= 0) else expected.max()
+                for max_distance in (1, 4, 9):
+                    generalized_wave_propagation_gmap(reduced_gmap, [0], [1], [3], accumulation_directions,
+                                                      max_distance=max_distance)
+                    self.assertTrue(np.array_equal(reduced_gmap.distances,
+                                                   np.where(expected > max_distance, -1, expected)))
+                    reached = reduced_gmap.distances >= 0
+                    self.assertTrue(np.array_equal(reduced_gmap.dt_connected_components_labels[reached],
+                                                   expected_labels[reached]))
+                generalized_wave_propagation_gmap(reduced_gmap, [0], [1], [3], accumulation_directions,
+                                                  stop_when_targets_reached=True)
+                self.assertTrue(np.array_equal(reduced_gmap.distances,
+                                               np.where(expected > farthest_target, -1, expected)))
+
+        quotient_wave_propagation_gmap(gmap, 2, [0], [1], [3])
+        expected = gmap.distances.copy()
+        target_distances = expected[gmap.label_darts([3])]
+        farthest_target = target_distances.max() if np.all(target_distances >= 0) else expected.max()
+        quotient_wave_propagation_gmap(gmap, 2, [0], [1], [3], max_distance=4)
+        self.assertTrue(np.array_equal(gmap.distances, np.where(expected > 4, -1, expected)))
+        quotient_wave_propagation_gmap(gmap, 2, [0], [1], [3], stop_when_targets_reached=True)
+        self.assertTrue(np.array_equal(gmap.distances, np.where(expected > farthest_target, -1, expected)))
+
+        # each query stops when it reaches all the targets
+        _, seed_sets = seed_sets_by_connected_component(gmap, [0])
+        expected = multi_query_wave_propagation_gmap(gmap, seed_sets, [1], [3])
+        actual = multi_query_wave_propagation_gmap(gmap, seed_sets, [1], [3], max_distance=4)
+        self.assertTrue(np.array_equal(actual, np.where(expected > 4, -1, expected)))
+        actual = multi_query_wave_propagation_gmap(gmap, seed_sets, [1], [3], stop_when_targets_reached=True)
+        target_distances = expected[:, gmap.label_darts([3])]
+        farthest_targets = np.where(target_distances.min(axis=1) >= 0, target_distances.max(axis=1), expected.max())
+        self.assertTrue(np.array_equal(actual, np.where(expected > farthest_targets[:, None], -1, expected)))
+
     def test_improved_wave_propagation_gmap_vertex_small_image(self):
         image_name = "bug_image_improved.png"
         image = cv2.imread("../data/" + image_name, 0)